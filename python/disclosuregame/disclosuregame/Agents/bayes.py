@@ -1,10 +1,21 @@
-from ..Util import shuffled
+from ..Util import shuffled, new_log, log_entry, pack_value, unpack_value
+from ..Util import sampling
 
 from random import Random
-from itertools import count
+from itertools import count, izip
+from array import array
+import copy_reg
+
+# Counterfactual decisions draw on this, set to the deciding agent's state, so
+# that her own random stream is left as it was.
+_scratch_random = Random()
 
 class Agent(object):
     id_generator = count()
+    # Number of recent entries to retain in the history logs, or None to keep
+    # everything. Measures which index logs by round give NA once the round
+    # has been discarded.
+    log_window = None
     """
     An agent who plays a game, according to their
     type, and some decision rule.
@@ -16,20 +27,28 @@ class Agent(object):
     Players have two possible response moves.
     0 = do nothing
     1 = refer
+
+    Agents use __slots__, and keep their counts and beliefs in small float
+    arrays indexed by signal, type or response.
     """
+    __slots__ = ('player_type', 'signals', 'responses', 'payoff_log', 'signal_log',
+        'response_log', 'type_log', 'rounds', 'payoffs', 'social_payoffs', 'baby_payoffs',
+        'signal_matches', 'finished', 'started', 'is_finished', 'accrued_payoffs',
+        'random', 'ident', 'type_weights')
+
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], seed=None):
         self.player_type = player_type
         self.signals = signals
         self.responses = responses
-        self.payoff_log = []
-        self.signal_log = []
-        self.response_log = []
-        self.type_log = []
+        self.payoff_log = new_log('d', self.log_window)
+        self.signal_log = new_log('b', self.log_window)
+        self.response_log = new_log('b', self.log_window)
+        self.type_log = new_log('b', self.log_window)
         self.rounds = 0
         self.payoffs = None
         self.social_payoffs = None
         self.baby_payoffs = None
-        self.signal_matches = dict.fromkeys(signals, 0.)#dict([(y, 0.) for y in signals])
+        self.signal_matches = array('d', [0.]*len(signals))
         self.finished = 0
         self.started = 0
         self.is_finished = False
@@ -40,37 +59,106 @@ class Agent(object):
     def __hash__(self):
         return self.ident
 
+    def scratch_random(self):
+        """
+        Return a random stream in the same state as this agent's own, to make
+        draws from without consuming hers.
+        """
+        _scratch_random.setstate(self.random.getstate())
+        return _scratch_random
+
+    def snapshot(self):
+        """
+        Return the state of this agent as a flat tuple of its class, then each
+        slot packed by pack_value (or None if unset), then any instance dict.
+        """
+        state = [self.__class__]
+        for name in copy_reg._slotnames(self.__class__):
+            try:
+                state.append(pack_value(getattr(self, name)))
+            except AttributeError:
+                state.append(None)
+        try:
+            state.append(tuple((k, pack_value(v)) for k, v in self.__dict__.iteritems()))
+        except AttributeError:
+            pass
+        return tuple(state)
+
+    def __reduce__(self):
+        return (restore_agent, (self.snapshot(),))
+
     def __deepcopy__(self, memo):
-        cls = self.__class__
-        result = cls.__new__(cls)
-        memo[id(self)] = result
-        for k, v in self.__dict__.items():
-            setattr(result, k, deepcopy(v, memo))
+        result = restore_agent(self.snapshot(), memo, id(self))
         result.ident = Agent.id_generator.next()
         return result
 
 
+class Probe(object):
+    """
+    A stand-in opponent for counterfactual decisions, of no known type. A game
+    keeps one to reuse for every probe.
+    """
+    __slots__ = ('ident',)
+    player_type = None
+
+    def __init__(self, ident=None):
+        if ident is None:
+            ident = Agent.id_generator.next()
+        self.ident = ident
+
+    def __hash__(self):
+        return self.ident
+
+
+def restore_agent(snapshot, memo=None, original=None):
+    """
+    Rebuild an agent from a snapshot. If memo is given, values not packed by
+    pack_value are deep copied with it, and the new agent is recorded against
+    the id original.
+    """
+    cls = snapshot[0]
+    agent = cls.__new__(cls)
+    if memo is not None:
+        memo[original] = agent
+    names = copy_reg._slotnames(cls)
+    for name, packed in izip(names, snapshot[1:]):
+        if packed is not None:
+            setattr(agent, name, unpack_value(packed, memo))
+    if len(snapshot) > len(names) + 1:
+        for name, packed in snapshot[len(names) + 1]:
+            setattr(agent, name, unpack_value(packed, memo))
+    return agent
+
+
 class Signaller(Agent):
+    __slots__ = ('response_belief', 'type_distribution', 'type_matches',
+        'response_signal_matches', 'response_weights', 'loss_matrix')
 
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], seed=None):
         # Given own type, there are always 6 possible payoffs for a given signal.
         # 2 for each of the three midwife types, per signal.
         self.response_belief = self.response_signal_dict(signals, responses)
-        self.type_distribution = {s:[] for s in signals}#dict([(signal, []) for signal in signals])
-        self.type_matches = dict.fromkeys(signals, 0.)#dict([(signal, 0.) for signal in signals])
+        self.type_distribution = array('d', [0.]*len(signals))
+        self.type_matches = array('d', [0.]*len(signals))
         self.response_signal_matches = self.response_signal_dict(signals, responses)
+        # Losses for each outcome, made from the payoffs when first needed
+        self.loss_matrix = None
         #self.risk_log = dict([(signal, []) for signal in signals])
         #self.risk_log_general = dict([(signal, []) for signal in signals])
         super(Signaller, self).__init__(player_type, signals, responses, seed)
 
     def response_signal_dict(self, signals, responses):
-        return {s:dict.fromkeys(responses, 0.) for s in signals}
+        """
+        Return a signal x response table of zeros, as a list of float arrays.
+        """
+        return [array('d', [0.]*len(responses)) for s in signals]
 
     def response_belief_dict(self, signals, responses):
         return {s:{k:[] for k in responses} for s in signals}#dict([(signal, dict([(response, []) for response in responses])) for signal in signals])
 
     def init_payoffs(self, baby_payoffs, social_payoffs, type_weights=[1., 1., 1.], 
                      response_weights=[[1., 1.], [1., 1.], [1., 2.]]):
+        self.loss_matrix = None
         # Don't set up twice.
         if self.baby_payoffs is not None:
             return
@@ -81,9 +169,9 @@ class Signaller(Agent):
         self.response_weights = response_weights
 
         # Front load alpha_dot values
-        for signal, responses in self.response_signal_matches.iteritems():
-            for response, count in responses.iteritems():
-                self.response_signal_matches[signal][response] = response_weights[signal][response]
+        for signal, responses in enumerate(self.response_signal_matches):
+            for response in xrange(len(responses)):
+                responses[response] = response_weights[signal][response]
         #Response per signal per type
         self.update_counts(None, None, None)
         self.update_beliefs()
@@ -94,6 +182,7 @@ class Signaller(Agent):
         An alternative way of generating priors by using the provided weights
         as weightings for random encounters.
         """
+        self.loss_matrix = None
         # Don't set up twice.
         if self.baby_payoffs is not None:
             return
@@ -103,13 +192,13 @@ class Signaller(Agent):
         self.type_weights = [0., 0., 0.]
         self.response_weights = response_weights
 
-        for i in xrange(num):
-            # Choose a random signal
-            signal = self.random.choice(self.signals)
-            # A weighted response
-            response = weighted_random_choice(self.responses, response_weights[signal], self.random)
-            # A weighted choice of type
-            player_type = weighted_random_choice(self.signals, type_weights, self.random)
+        # A random signal, a weighted response and a weighted choice of type
+        # per encounter, drawn in that order
+        us = sampling.uniforms(self.random, 3*num)
+        signals = sampling.choose(self.signals, us[0::3])
+        responses = sampling.keyed_weighted_choose(self.responses, response_weights, signals, us[1::3])
+        player_types = sampling.weighted_choose(self.signals, type_weights, us[2::3])
+        for signal, response, player_type in zip(signals, responses, player_types):
             # Payoffs
             payoff = baby_payoffs[self.player_type][response] + social_payoffs[signal][player_type]
             self.response_signal_matches[signal][response] += 1
@@ -124,24 +213,15 @@ class Signaller(Agent):
         """
         result = {}
 
-        for signal, responses in self.response_belief.items():
-            #signal_matches = [x == signal for x in self.signal_log]
-            result[signal] = {}
-            for response, belief in responses.items():
-                result[signal][response] = belief[len(belief) - 1]
+        for signal, responses in enumerate(self.response_belief):
+            result[signal] = dict(enumerate(responses))
         return result
 
     def round_response_belief(self, rounds):
-        result = {}
-        try:
-            for signal, responses in self.response_belief.items():
-                #signal_matches = [x == signal for x in self.signal_log]
-                result[signal] = {}
-                for response, belief in responses.items():
-                    result[signal][response] = belief[rounds]
-            return result
-        except IndexError:
-            return self.current_response_belief()
+        """
+        Beliefs are not kept per round, so this is the current response belief.
+        """
+        return self.current_response_belief()
 
     def current_signal_risk(self):
         result = {}
@@ -160,10 +240,9 @@ class Signaller(Agent):
 
     def round_signal(self, rounds):
         try:
-            sig = self.signal_log[rounds]
+            sig = log_entry(self.signal_log, rounds)
         except IndexError:
-            sig = self.do_signal()
-            self.signal_log.pop()
+            sig = self.counterfactual_signal()
         return sig
 
 
@@ -171,19 +250,13 @@ class Signaller(Agent):
         """
         Return the most current believed type distribution.
         """
-        result = {}
-        for signal, record in self.type_distribution.items():
-            result[signal] = record[len(record) - 1]
-        return result
+        return dict(enumerate(self.type_distribution))
 
     def round_type_distribution(self, rounds):
-        try:
-            result = {}
-            for signal, record in self.type_distribution.items():
-                result[signal] = record[rounds]
-            return result
-        except IndexError:
-            return self.current_type_distribution()
+        """
+        Beliefs are not kept per round, so this is the current type distribution.
+        """
+        return self.current_type_distribution()
 
     def update_counts(self, response, midwife, payoff, midwife_type=None, weight=1.):
         """
@@ -216,8 +289,8 @@ class Signaller(Agent):
         """
 
         #alpha_dot = sum(self.type_weights)
-        n = float(sum(self.type_matches.values()) + sum(self.type_weights))
-        for player_type, estimate in self.type_distribution.iteritems():
+        n = float(sum(self.type_matches) + sum(self.type_weights))
+        for player_type in xrange(len(self.type_distribution)):
             alpha_k = self.type_weights[player_type]
             n_k = self.type_matches[player_type]
             
@@ -229,11 +302,11 @@ class Signaller(Agent):
 
         # Update signal-response beliefs
         
-        for signal, responses in self.response_signal_matches.iteritems():
+        for signal, responses in enumerate(self.response_signal_matches):
             # alpha_dot + n
-            n = float(sum(responses.values()))
+            n = float(sum(responses))
             # Count is alpha_k + n_k
-            for response, count in responses.iteritems():
+            for response, count in enumerate(responses):
                 self.response_belief[signal][response] = 0.
                 if n > 0:
                     self.response_belief[signal][response] = count / n#prob
@@ -246,8 +319,16 @@ class Signaller(Agent):
         self.signal_matches[signal] += weight
         self.signal_log.append(signal)
 
+    def counterfactual_signal(self, opponent=None):
+        """
+        Return the signal that would be sent to opponent right now, without
+        sending it. Logs, counts and the random stream are left alone.
+        """
+        return self.choose_signal(opponent, self.scratch_random())
+
 
 class BayesianSignaller(Signaller):
+    __slots__ = ()
 
     def __str__(self):
         return "bayes"
@@ -257,42 +338,86 @@ class BayesianSignaller(Signaller):
         """
         return -payoff
 
+    def payoff_losses(self):
+        """
+        Return the signal x midwife type x response table of losses.
+        """
+        return [[[-(self.baby_payoffs[response] + self.social_payoffs[player_type][signal])
+            for response in xrange(len(self.response_belief[signal]))]
+            for player_type in xrange(len(self.type_distribution))]
+            for signal in self.signals]
+
     def risk(self, signal, opponent):
         """
         Compute the bayes risk of sending this signal.
         """
+        losses = self.loss_matrix
+        if losses is None:
+            losses = self.loss_matrix = self.payoff_losses()
         signal_risk = 0.
-        for player_type, type_belief in self.type_distribution.items():
-            for response, response_belief in self.response_belief[signal].items():
-                payoff = self.baby_payoffs[response] + self.social_payoffs[player_type][signal]
-                #payoff = self.loss(payoff)
-                #print "Believe payoff will be",payoff,"with confidence",payoff_belief
-                #print "Risk is",payoff,"*",payoff_belief
-                signal_risk += -payoff * response_belief * type_belief
+        response_belief = self.response_belief[signal]
+        # Summed in the same order as ever, so that ties break the same way
+        for type_belief, type_losses in izip(self.type_distribution, losses[signal]):
+            for loss, belief in izip(type_losses, response_belief):
+                signal_risk += loss * belief * type_belief
        #print "R(%d|x)=%f" % (signal, signal_risk)
         return signal_risk
 
-    def do_signal(self, opponent=None):
-        best = (self.random.randint(0, 2), 9999999)
+    def risks(self, opponent=None):
+        """
+        Return the risk of every signal, indexed by signal, as one pass over
+        the loss table.
+        """
+        losses = self.loss_matrix
+        if losses is None:
+            losses = self.loss_matrix = self.payoff_losses()
+        type_distribution = self.type_distribution
+        result = []
+        for signal_losses, response_belief in izip(losses, self.response_belief):
+            signal_risk = 0.
+            for type_belief, type_losses in izip(type_distribution, signal_losses):
+                for loss, belief in izip(type_losses, response_belief):
+                    signal_risk += loss * belief * type_belief
+            result.append(signal_risk)
+        return result
+
+    def choose_signal(self, opponent=None, random=None):
+        """
+        Return the signal of least risk, drawing on random (by default
+        this signaller's own stream) to break ties. Nothing is recorded.
+        """
+        if random is None:
+            random = self.random
+        best = (random.randint(0, 2), 9999999)
        #print "Type %d woman evaluating signals." % self.player_type
-        for signal in shuffled(self.signals, self.random):
-            signal_risk = self.risk(signal, opponent)
+        risks = self.risks(opponent)
+        for signal in shuffled(self.signals, random):
+            signal_risk = risks[signal]
             #self.risk_log[signal].append(signal_risk)
             #self.risk_log_general[signal].append(self.risk(signal, None))
            #print "Risk for signal %d is %f. Best so far is signal %d at %f." % (signal, signal_risk, best[0], best[1])
             if signal_risk < best[1]:
                 best = (signal, signal_risk)
-        self.rounds += 1
-        self.log_signal(best[0], opponent)
         return best[0]
 
+    def do_signal(self, opponent=None):
+        signal = self.choose_signal(opponent)
+        self.rounds += 1
+        self.log_signal(signal, opponent)
+        return signal
+
 
 class Responder(Agent):
+    __slots__ = ('signal_belief', 'signal_type_matches', 'loss_matrix', 'confusion')
 
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], seed=None):
-        # Belief that a particular signal means a state
-        self.signal_belief = {s:dict.fromkeys(signals, 0.) for s in signals} #dict([(y, dict([(x, []) for x in signals])) for y in signals])
-        self.signal_type_matches = {s:dict.fromkeys(signals, 0.) for s in signals} #dict([(y, dict([(x, 0.) for x in signals])) for y in signals])
+        # Belief that a particular signal means a state, as signal x type tables
+        self.signal_belief = [array('d', [0.]*len(signals)) for s in signals]
+        self.signal_type_matches = [array('d', [0.]*len(signals)) for s in signals]
+        # Losses for each outcome, made from the payoffs when first needed
+        self.loss_matrix = None
+        # Running response x type counts, kept by the accuracy measures
+        self.confusion = None
 
         super(Responder, self).__init__(player_type, signals, responses, seed)
 
@@ -300,15 +425,21 @@ class Responder(Agent):
         self.type_weights = type_weights
         #Only interested in payoffs for own type
         self.payoffs = payoffs
+        self.loss_matrix = None
         self.update_beliefs(None, None, None)
 
     def init_payoffs_(self, payoffs, type_weights=[[10., 2., 1.], [1., 10., 1.], [1., 1., 10.]], num=25):
         self.type_weights = [[0.]*3]*3
-        for i in xrange(num):
-            signal = self.random.choice(self.signals)
-            self.type_weights[signal][weighted_random_choice(self.signals, type_weights[signal])] += 1
+        # Signals come from this agent's stream, and types from the shared
+        # default one
+        signals = sampling.choose(self.signals, sampling.uniforms(self.random, num))
+        player_types = sampling.keyed_weighted_choose(self.signals, type_weights, signals,
+            sampling.uniforms(sampling.default_random, num))
+        for signal, player_type in zip(signals, player_types):
+            self.type_weights[signal][player_type] += 1
         #Only interested in payoffs for own type
         self.payoffs = payoffs
+        self.loss_matrix = None
         self.update_beliefs(None, None, None)
 
     ##@profile
@@ -325,10 +456,10 @@ class Responder(Agent):
         #for player_type in self.signals:
         #    type_matches[player_type] = [x == player_type for x in self.type_log]
 
-        for signal_i, types in self.signal_belief.iteritems():
+        for signal_i, types in enumerate(self.signal_belief):
             alpha_dot = sum(self.type_weights[signal_i])
-            n = sum(self.signal_type_matches[signal_i].values())
-            for player_type, belief in types.iteritems():
+            n = sum(self.signal_type_matches[signal_i])
+            for player_type in xrange(len(types)):
                 #signal_matches = [x == signal_i for x in self.signal_log]
                #print "Updating P(%d|%d).." % (player_type, signal_i)
                 alpha_k = self.type_weights[signal_i][player_type]
@@ -353,17 +484,33 @@ class Responder(Agent):
         """ Return the current beliefs about signals.
         """
         current = {}
-        for signal, types in self.signal_belief.items():
-            current[signal] = {}
-            for player_type, log in types.items():
-                current[signal][player_type] = log[len(log) - 1]
+        for signal, types in enumerate(self.signal_belief):
+            current[signal] = dict(enumerate(types))
         return current
 
+    def log_signal(self, signal, opponent=None):
+        """
+        Record a signal received from opponent.
+        """
+        if opponent is not None:
+            self.type_log.append(opponent.player_type)
+        self.signal_log.append(signal)
+        self.signal_matches[signal] += 1.
+
+    def counterfactual_response(self, signal, opponent=None):
+        """
+        Return the response that would be made to this signal from opponent
+        right now, without making it. Logs, memories and the random stream are
+        left alone.
+        """
+        return self.choose_response(signal, opponent, self.scratch_random())
+
 
 class BayesianResponder(Responder):
     """ Responds based on belief, and the bayes action rule.
     i.e. minimise the expected risk.
     """
+    __slots__ = ()
 
     def __str__(self):
         return "bayes"
@@ -373,37 +520,69 @@ class BayesianResponder(Responder):
         """
         return -payoff
 
+    def payoff_losses(self):
+        """
+        Return the response x signaller type table of losses.
+        """
+        return [[self.loss(payoffs[act]) for payoffs in self.payoffs] for act in self.responses]
+
     def risk(self, act, signal, opponent):
         """
         Return the expected risk of this action given this signal
         was received.
         """
+        losses = self.loss_matrix
+        if losses is None:
+            losses = self.loss_matrix = self.payoff_losses()
         act_risk = 0.
 
        #print "Assessing risk for action",act,"given signal",signal
-        for player_type, type_belief in self.signal_belief[signal].items():
-            payoff = self.loss(self.payoffs[player_type][act])
-           #print "Believe true type is",player_type,"with confidence",type_belief
-           #print "Risk is",payoff,"*",type_belief
-            act_risk += payoff * type_belief
+        for loss, type_belief in izip(losses[act], self.signal_belief[signal]):
+            act_risk += loss * type_belief
        #print "R(%d|%d)=%f" % (act, signal, act_risk)
         return act_risk
 
+    def risks(self, signal, opponent=None):
+        """
+        Return the risk of every response to this signal, indexed by response,
+        as one pass over the loss table.
+        """
+        losses = self.loss_matrix
+        if losses is None:
+            losses = self.loss_matrix = self.payoff_losses()
+        signal_belief = self.signal_belief[signal]
+        result = []
+        for act_losses in losses:
+            act_risk = 0.
+            for loss, type_belief in izip(act_losses, signal_belief):
+                act_risk += loss * type_belief
+            result.append(act_risk)
+        return result
+
+    def choose_response(self, signal, opponent=None, random=None):
+        """
+        Return the response of least risk to this signal, drawing on random
+        (by default this responder's own stream) to break ties. Nothing is
+        recorded.
+        """
+        if random is None:
+            random = self.random
+        best = (random.randint(0, 1), 9999999)
+        risks = self.risks(signal, opponent)
+        for response in shuffled(self.responses, random):
+            act_risk = risks[response]
+            if act_risk < best[1]:
+                best = (response, act_risk)
+        return best[0]
+
     def respond(self, signal, opponent=None):
         """
         Make a judgement about somebody based on
         the signal they sent by minimising bayesian risk.
         """
-        if opponent is not None:
-            self.type_log.append(opponent.player_type)
-        self.signal_log.append(signal)
-        self.signal_matches[signal] += 1.
-        best = (self.random.randint(0, 1), 9999999)
-        for response in shuffled(self.responses, self.random):
-            act_risk = self.risk(response, signal, opponent)
-            if act_risk < best[1]:
-                best = (response, act_risk)
-        self.response_log.append(best[0])
+        self.log_signal(signal, opponent)
+        response = self.choose_response(signal, opponent)
+        self.response_log.append(response)
         self.rounds += 1
-        #print "Player type is %d, decision is %d" % (opponent.player_type, best[0])
-        return best[0]
\ No newline at end of file
+        #print "Player type is %d, decision is %d" % (opponent.player_type, response)
+        return response
\ No newline at end of file
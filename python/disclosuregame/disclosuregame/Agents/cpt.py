@@ -56,8 +56,8 @@ class ProspectTheorySignaller(bayes.BayesianSignaller):
         based on the estimated probalities at this appointment.
         """
         prospects = []
-        for player_type, type_belief in self.type_distribution.items():
-            for response, response_belief in self.response_belief[signal].items():
+        for player_type, type_belief in enumerate(self.type_distribution):
+            for response, response_belief in enumerate(self.response_belief[signal]):
                 total_belief = response_belief*type_belief
                 payoff = self.baby_payoffs[response] + self.social_payoffs[player_type][signal]
                 prospects.append((payoff, total_belief))
@@ -92,23 +92,39 @@ class ProspectTheorySignaller(bayes.BayesianSignaller):
             signal_risk += self.value(payoff) * weight
         return signal_risk
 
-    def do_signal(self, opponent=None):
+    def prospect_signal(self, random):
         """
-        Make a judgement about somebody based on
-        the signal they sent based on expe
+        Return the signal of greatest prospect value.
         """
-        super(ProspectTheorySignaller, self).do_signal(opponent)
-        best = (self.random.randint(0, 2), -9999999)
-        for signal in shuffled(self.signals, self.random):
+        best = (random.randint(0, 2), -9999999)
+        for signal in shuffled(self.signals, random):
             act_risk = self.cpt_value(self.collect_prospects(signal))
             #self.risk_log[signal].append(act_risk)
             #self.risk_log_general[signal].append(act_risk)
             if act_risk > best[1]:
                 best = (signal, act_risk)
-        self.signal_log.pop()
-        self.signal_log.append(best[0])
         return best[0]
 
+    def choose_signal(self, opponent=None, random=None):
+        if random is None:
+            random = self.random
+        # Draws are made as do_signal makes them
+        super(ProspectTheorySignaller, self).choose_signal(opponent, random)
+        return self.prospect_signal(random)
+
+    def do_signal(self, opponent=None):
+        """
+        Make a judgement about somebody based on
+        the signal they sent based on expe
+        """
+        signal = super(ProspectTheorySignaller, self).choose_signal(opponent, self.random)
+        self.rounds += 1
+        self.log_signal(signal, opponent)
+        best = self.prospect_signal(self.random)
+        self.signal_log.pop()
+        self.signal_log.append(best)
+        return best
+
     def __str__(self):
         return "prospect"
 
@@ -183,7 +199,7 @@ class ProspectTheoryResponder(bayes.BayesianResponder):
         and sort them in descending order of payoff.
         """
         prospects = []
-        for player_type, type_belief in self.signal_belief[signal].items():
+        for player_type, type_belief in enumerate(self.signal_belief[signal]):
             payoff = self.payoffs[player_type][response]
             prospects.append((payoff, type_belief))
         prospects.sort()
@@ -214,20 +230,20 @@ class ProspectTheoryResponder(bayes.BayesianResponder):
        #print "U(%d|x)=%f" % (signal, signal_risk)
         return signal_risk
 
-    def respond(self, signal, opponent=None):
+    def choose_response(self, signal, opponent=None, random=None):
         """
         Make a judgement about somebody based on
         the signal they sent based on expe
         """
-        super(ProspectTheoryResponder, self).respond(signal, opponent)
+        if random is None:
+            random = self.random
+        super(ProspectTheoryResponder, self).choose_response(signal, opponent, random)
 
-        best = (self.random.randint(0, 1), -9999999)
-        for response in shuffled(self.responses, self.random):
+        best = (random.randint(0, 1), -9999999)
+        for response in shuffled(self.responses, random):
             act_risk = self.cpt_value(self.collect_prospects(response, signal))
             if act_risk > best[1]:
                 best = (response, act_risk)
-        self.response_log.pop()
-        self.response_log.append(best[0])
         return best[0]
 
     def __str__(self):
@@ -2,12 +2,8 @@ from bayes import *
 from recognition import RecognitionResponder
 from sharing import *
 from disclosuregame.Util import random_expectations
+from disclosuregame.Util import sampling
 import operator
-from random import Random
-
-def weighted_random_choice(choices, weights, random=Random()):
-        population = [val for val, cnt in zip(choices, weights) for i in range(int(cnt))]
-        return random.choice(population)
 
 class LexicographicSignaller(BayesianSignaller):
     """
@@ -63,13 +59,13 @@ class LexicographicSignaller(BayesianSignaller):
         self.depth = 0
         for signal, payoffs in self.payoff_count.items():
             self.depth = max(len(payoffs), self.depth)
-        for i in xrange(num):
-            # Choose a random signal
-            signal = self.random.choice(self.signals)
-            # A weighted response
-            response = weighted_random_choice(self.responses, response_weights[signal], self.random)
-            # A weighted choice of type
-            player_type = weighted_random_choice(self.signals, type_weights, self.random)
+        # A random signal, a weighted response and a weighted choice of type
+        # per encounter, drawn in that order
+        us = sampling.uniforms(self.random, 3*num)
+        signals = sampling.choose(self.signals, us[0::3])
+        responses = sampling.keyed_weighted_choose(self.responses, response_weights, signals, us[1::3])
+        player_types = sampling.weighted_choose(self.signals, type_weights, us[2::3])
+        for signal, response, player_type in zip(signals, responses, player_types):
             # Payoffs
             payoff = baby_payoffs[self.player_type][response] + social_payoffs[signal][player_type]
             self.payoff_count[signal][payoff] += 1
@@ -104,12 +100,14 @@ class LexicographicSignaller(BayesianSignaller):
         return None
         #self.update_counts(response, midwife, payoff, midwife_type, weight)
 
-    def do_signal(self, opponent=None):
+    def choose_signal(self, opponent=None, random=None):
         #super(LexicographicSignaller, self).do_signal(opponent)
-        signals = shuffled(self.signals, self.random)
+        if random is None:
+            random = self.random
+        signals = shuffled(self.signals, random)
         n = 0
         # Reduce to possible
-        best = self.random.choice(signals)
+        best = random.choice(signals)
         while n < self.depth:
             mappings = {}
             # N most frequent outcome of each signal
@@ -131,8 +129,6 @@ class LexicographicSignaller(BayesianSignaller):
             except IndexError:
                 pass
         # No advantage found so take the first
-        self.rounds += 1
-        self.log_signal(best, opponent)
         return best
 
 
@@ -181,13 +177,13 @@ class LexicographicResponder(BayesianResponder):
         for signal, responses in self.payoff_count.items():
             for response, payoff in responses.items():
                 self.depth = max(len(payoff), self.depth)
-        for i in xrange(num):
-            # Choose a random signal
-            signal = self.random.choice(self.signals)
-            # A weighted response
-            response = self.random.choice(self.responses)
-            # A weighted choice of type
-            player_type = weighted_random_choice(self.signals, type_weights[signal], random=self.random)
+        # A random signal, a random response and a weighted choice of type
+        # per encounter, drawn in that order
+        us = sampling.uniforms(self.random, 3*num)
+        signals = sampling.choose(self.signals, us[0::3])
+        responses = sampling.choose(self.responses, us[1::3])
+        player_types = sampling.keyed_weighted_choose(self.signals, type_weights, signals, us[2::3])
+        for signal, response, player_type in zip(signals, responses, player_types):
             # Payoffs
             payoff = payoffs[player_type][response]
             self.payoff_count[signal][response][payoff] += 1
@@ -208,16 +204,12 @@ class LexicographicResponder(BayesianResponder):
         sorted_dict = sorted(self.payoff_count[signal][response].items(), key=operator.itemgetter(1), reverse=True)
         return sorted_dict[min(n, len(sorted_dict) - 1)][0]
 
-    def respond(self, signal, opponent=None):
+    def choose_response(self, signal, opponent=None, random=None):
         """
-        Make a judgement about somebody based on
-        the signal they sent by minimising bayesian risk.
+        Make a judgement about somebody based on the signal they sent, by
+        the most frequent outcomes of each response.
         """
         #super(LexicographicResponder, self).respond(signal, opponent)
-        if opponent is not None:
-            self.type_log.append(opponent.player_type)
-        self.signal_log.append(signal)
-        self.signal_matches[signal] += 1.
         n = 0
         while n < self.depth:
             mappings = {}
@@ -234,9 +226,6 @@ class LexicographicResponder(BayesianResponder):
                     #Only one payoff
                 pass
             n += 1
-        #self.response_log.pop()
-        self.rounds += 1
-        self.response_log.append(best)
         return best
 
 class RecognitionLexicographicResponder(RecognitionResponder, LexicographicResponder):
@@ -25,26 +25,42 @@ class BayesianPayoffSignaller(LexicographicSignaller):
                     self.payoff_belief[signal][payoff] = n_k / n
 
 
+    def payoff_losses(self):
+        """
+        Return the losses of each signal's possible payoffs, in the order the
+        payoff beliefs hold them.
+        """
+        return dict((signal, [self.loss(payoff) for payoff in payoffs])
+            for signal, payoffs in self.payoff_belief.iteritems())
+
     def risk(self, signal, opponent):
+        losses = self.loss_matrix
+        if losses is None:
+            losses = self.loss_matrix = self.payoff_losses()
         risk = 0.
-        for payoff, belief in self.payoff_belief[signal].iteritems():
+        for loss, belief in izip(losses[signal], self.payoff_belief[signal].itervalues()):
             #belief = belief[len(belief) - 1]
-            risk += belief*self.loss(payoff)
+            risk += belief*loss
         return risk
 
-    def do_signal(self, opponent=None):
-        best = (self.random.randint(0, 2), 9999999)
-       #print "Type %d woman evaluating signals." % self.player_type
-        for signal in shuffled(self.signals, self.random):
-            signal_risk = self.risk(signal, opponent)
-            #self.risk_log[signal].append(signal_risk)
-            #self.risk_log_general[signal].append(self.risk(signal, None))
-            #print "Risk for signal %d is %f. Best so far is signal %d at %f." % (signal, signal_risk, best[0], best[1])
-            if signal_risk < best[1]:
-                best = (signal, signal_risk)
-        self.rounds += 1
-        self.log_signal(best[0], opponent)
-        return best[0]
+    def risks(self, opponent=None):
+        """
+        Return the risk of every signal, indexed by signal.
+        """
+        losses = self.loss_matrix
+        if losses is None:
+            losses = self.loss_matrix = self.payoff_losses()
+        result = []
+        for signal in self.signals:
+            risk = 0.
+            for loss, belief in izip(losses[signal], self.payoff_belief[signal].itervalues()):
+                risk += belief*loss
+            result.append(risk)
+        return result
+
+    def choose_signal(self, opponent=None, random=None):
+        # By least risk, as a Bayesian signaller chooses
+        return BayesianSignaller.choose_signal(self, opponent, random)
 
 
 class BayesianPayoffResponder(LexicographicResponder):
@@ -87,19 +103,19 @@ class BayesianPayoffResponder(LexicographicResponder):
         #print "R(%d|%d)=%f" % (act, signal, act_risk)
         return act_risk
 
-    def respond(self, signal, opponent=None):
+    def choose_response(self, signal, opponent=None, random=None):
         """
         Make a judgement about somebody based on
         the signal they sent by minimising bayesian risk.
         """
-        super(BayesianPayoffResponder, self).respond(signal, opponent)
-        best = (self.random.randint(0, 1), 9999999)
-        for response in shuffled(self.responses, self.random):
+        if random is None:
+            random = self.random
+        super(BayesianPayoffResponder, self).choose_response(signal, opponent, random)
+        best = (random.randint(0, 1), 9999999)
+        for response in shuffled(self.responses, random):
             act_risk = self.risk(response, signal, opponent)
             if act_risk < best[1]:
                 best = (response, act_risk)
-        self.response_log.pop()
-        self.response_log.append(best[0])
         return best[0]
 
 class RecognitionBayesianPayoffResponder(RecognitionResponder, BayesianPayoffResponder):
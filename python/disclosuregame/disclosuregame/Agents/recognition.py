@@ -1,13 +1,122 @@
 from bayes import *
+from collections import OrderedDict
+
+class SignalMemory(object):
+    """
+    A memory of the signals received from, and responses made to, individual signallers,
+    keyed by the signaller's ident. Each signal-response pair is packed into a single byte.
+    If capacity is not None, the signallers first seen longest ago are forgotten once more
+    than capacity are held. An optional MemoryIndex is kept up to date with which memories
+    hold which signallers.
+    """
+    __slots__ = ('entries', 'num_responses', 'capacity', 'index')
+
+    def __init__(self, num_responses=2, capacity=None):
+        self.num_responses = num_responses
+        self.capacity = capacity
+        self.entries = {} if capacity is None else OrderedDict()
+        self.index = None
+
+    def __getstate__(self):
+        # Indexes are per game, so don't travel with the agent
+        return (self.num_responses, self.capacity, self.entries)
+
+    def __setstate__(self, state):
+        self.num_responses, self.capacity, self.entries = state
+        self.index = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, ident):
+        return ident in self.entries
+
+    def __getitem__(self, ident):
+        return self.decode(self.entries[ident])
+
+    def decode(self, codes):
+        """
+        Unpack codes into a list of (signal, response) tuples.
+        """
+        return [divmod(code, self.num_responses) for code in codes]
+
+    def remember(self, ident, signal, response):
+        """
+        Record a signal and response for the signaller with this ident.
+        """
+        codes = self.entries.get(ident)
+        if codes is not None:
+            codes.append(signal*self.num_responses + response)
+            return
+        self.entries[ident] = bytearray((signal*self.num_responses + response,))
+        if self.index is not None:
+            self.index.add(ident, self)
+        if self.capacity is not None and len(self.entries) > self.capacity:
+            oldest, codes = self.entries.popitem(last=False)
+            if self.index is not None:
+                self.index.discard(oldest, self)
+
+    def pop(self, ident, default=None):
+        """
+        Remove and return the (signal, response) pairs held for ident, or default.
+        """
+        codes = self.entries.pop(ident, None)
+        if codes is None:
+            return default
+        if self.index is not None:
+            self.index.discard(ident, self)
+        return self.decode(codes)
+
+    def use_index(self, index):
+        """
+        Register this memory, and everything held in it, with a MemoryIndex.
+        """
+        self.index = index
+        for ident in self.entries:
+            index.add(ident, self)
+
+
+class MemoryIndex(object):
+    """
+    Reverse index from signaller idents to the signal memories which hold them, so
+    a signaller can be forgotten by every responder that saw them in O(k).
+    """
+    def __init__(self):
+        self.holders = {}
+
+    def add(self, ident, memory):
+        try:
+            self.holders[ident].add(memory)
+        except KeyError:
+            self.holders[ident] = set([memory])
+
+    def discard(self, ident, memory):
+        holders = self.holders.get(ident)
+        if holders is not None:
+            holders.discard(memory)
+            if not holders:
+                del self.holders[ident]
+
+    def forget(self, ident):
+        """
+        Remove ident from every memory holding it.
+        """
+        for memory in self.holders.pop(ident, ()):
+            memory.entries.pop(ident, None)
+
 
 class RecognitionResponder(BayesianResponder):
     """
     Class of responder which remembers the actions of opponents and then retrospectively
     updates beliefs based on that when true information is available.
+    If memory_capacity is not None, at most that many opponents are remembered.
     """
-    def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], seed=None):
+    __slots__ = ('signal_memory',)
+
+    def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], memory_capacity=None,
+        seed=None):
         # Memory of a particular agent's signals.
-        self.signal_memory = {}
+        self.signal_memory = SignalMemory(len(responses), memory_capacity)
         super(RecognitionResponder, self).__init__(player_type, signals, responses, seed=seed)
 
     def __str__(self):
@@ -26,10 +135,7 @@ class RecognitionResponder(BayesianResponder):
         """
         Remember what was done in response to a signal.
         """
-        try:
-            self.signal_memory[hash(signaller)].append((signal, response))
-        except KeyError:
-            self.signal_memory[hash(signaller)] = [(signal, response)]
+        self.signal_memory.remember(hash(signaller), signal, response)
 
     def update_beliefs(self, payoff, signaller, signal, signaller_type=None, weight=1.):
         """
@@ -1,37 +1,56 @@
 from bayes import *
-from disclosuregame.Util import weighted_random_choice
-from random import Random
+from disclosuregame.Util.sampling import shifted_choice as weighted_choice
+from disclosuregame.Util import sampling
+from collections import OrderedDict
 
 def delta_v(alpha, beta, us, v):
     return alpha*beta*(us - v)
 
-def weighted_choice(choices, weights, random=Random()):
-    low = abs(min(weights))
-    weights = map(lambda x: x + low, weights)
-    #print "rescaled to", weights
-    #for weight in weights:
-    #    assert weight > -0.0000001
-    total = sum(weights)
-    r = random.uniform(0, total)
-    upto = 0
-    for c, w in zip(choices, weights):
-        if upto + w > r:
-            return c
-        upto += w
-    assert False, "Shouldn't get here"
+class LRUWeights(OrderedDict):
+    """
+    Associative weights for individual opponents, keyed by hash. Only the
+    capacity most recently updated entries are kept.
+    """
+    def __init__(self, capacity=None, items=()):
+        super(LRUWeights, self).__init__(items)
+        self.capacity = capacity
+
+    def learn(self, key, delta):
+        """
+        Add delta to the weight for key, starting from 0, and mark it as the
+        most recently used.
+        """
+        self[key] = self.pop(key, 0.) + delta
+        if self.capacity is not None and len(self) > self.capacity:
+            self.popitem(last=False)
+
+    def __reduce__(self):
+        return (self.__class__, (self.capacity, self.items()))
 
 class RWSignaller(BayesianSignaller):
+    """
+    A signaller that learns associative weights for signals, midwife types, individual
+    midwives and signal-type configurations by the Rescorla-Wagner rule.
+    Weights for individual midwives are kept for every midwife met, or only
+    for the mw_capacity most recently met if that is given.
+    """
+    __slots__ = ('signal_alpha', 'mw_alpha', 'type_alpha', 'configural_alpha', 'beta',
+        'v_sig', 'v_type', 'v_mw', 'v_configural', 'observed_type', 'low', 'diff',
+        'last_v', 'last_sig', 'last_mw', 'last_payoff', 'last_type', 'update_weight')
+
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], 
-        signal_alpha=.25, mw_alpha=.3, type_alpha=.3, configural_alpha=.03, beta=.75, seed=None):
+        signal_alpha=.25, mw_alpha=.3, type_alpha=.3, configural_alpha=.03, beta=.75,
+        mw_capacity=None, seed=None):
         self.signal_alpha = signal_alpha
         self.mw_alpha = mw_alpha
         self.type_alpha = type_alpha
         self.configural_alpha = configural_alpha
         self.beta = beta
-        self.v_sig = [0.]*3
-        self.v_type = [0.]*3
-        self.v_mw = {}
-        self.v_configural = {}
+        self.v_sig = array('d', [0.]*len(signals))
+        self.v_type = array('d', [0.]*len(signals))
+        self.v_mw = LRUWeights(mw_capacity)
+        # Signal x midwife type
+        self.v_configural = [array('d', [0.]*len(signals)) for s in signals]
         self.observed_type = False
         self.low = 0.
         self.diff = 0.
@@ -46,13 +65,13 @@ class RWSignaller(BayesianSignaller):
         self.low = min(min(l) for l in baby_payoffs) + min(min(l) for l in social_payoffs)
         self.diff = float(max(max(l) for l in baby_payoffs) + max(max(l) for l in social_payoffs) - self.low)
         tmp = type(self)()
-        for i in xrange(num):
-            # Choose a random signal
-            signal = self.random.choice(self.signals)
-            # A weighted response
-            response = weighted_random_choice(self.responses, response_weights[signal], self.random)
-            # A weighted choice of type
-            player_type = weighted_random_choice(self.signals, type_weights, self.random)
+        # A random signal, a weighted response and a weighted choice of type
+        # per encounter, drawn in that order
+        us = sampling.uniforms(self.random, 3*num)
+        signals = sampling.choose(self.signals, us[0::3])
+        responses = sampling.keyed_weighted_choose(self.responses, response_weights, signals, us[1::3])
+        player_types = sampling.weighted_choose(self.signals, type_weights, us[2::3])
+        for signal, response, player_type in zip(signals, responses, player_types):
             # Payoffs
             tmp.player_type = player_type
             payoff = baby_payoffs[self.player_type][response] + social_payoffs[signal][player_type]
@@ -63,6 +82,8 @@ class RWSignaller(BayesianSignaller):
             self.signal_log.pop()
             self.response_log.pop()
             #self.type_log.pop()
+        # The stand-in's ident may later be handed to a real midwife
+        self.v_mw.pop(hash(tmp), None)
 
     def update_counts(self, response, midwife, payoff, midwife_type=None, weight=1.):
         if response is not None:
@@ -84,44 +105,54 @@ class RWSignaller(BayesianSignaller):
         # Signal
         self.v_sig[self.last_sig] += delta_v(self.signal_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
         # Midwife 
-        try:
-            self.v_mw[self.last_mw] += delta_v(self.mw_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
+        if self.last_mw in self.v_mw:
+            self.v_mw.learn(self.last_mw, delta_v(self.mw_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v))
             self.v_type[self.last_type] += delta_v(self.type_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
-        except KeyError:
-            self.v_mw[self.last_mw] = delta_v(self.type_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
+        else:
+            self.v_mw.learn(self.last_mw, delta_v(self.type_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v))
         # Midwife type 
         #Configurals
-        try:
-            self.v_configural[(self.last_sig, self.last_type)] += delta_v(self.configural_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
-        except:
-            self.v_configural[(self.last_sig, self.last_type)] = delta_v(self.configural_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
+        self.v_configural[self.last_sig][self.last_type] += delta_v(self.configural_alpha*self.update_weight, self.beta, self.last_payoff, self.last_v)
 
     def risk(self, signal, opponent):
         risk = 0.
         risk += self.v_sig[signal]
         self.observed_type = False
-        try:
-            self.v_mw[hash(opponent)]
-            risk += self.v_type[opponent.player_type]
+        # Type cues only apply to a midwife seen before
+        player_type = getattr(opponent, 'player_type', None)
+        if player_type is not None and hash(opponent) in self.v_mw:
+            risk += self.v_type[player_type]
             self.observed_type = True
-            risk += self.v_configural[(signal, opponent.player_type)]
-        except:
-            pass
+            risk += self.v_configural[signal][player_type]
         return risk
 
-    def do_signal(self, opponent=None):
-        best = (self.random.randint(0, 2), -9999999)
+    def choose_signal(self, opponent=None, random=None):
+        if random is None:
+            random = self.random
+        best = (random.randint(0, 2), -9999999)
        #print "Type %d woman evaluating signals." % self.player_type
+        observed = self.observed_type
         weights = map(lambda signal: self.risk(signal, opponent), self.signals)
-        best = weighted_choice(self.signals, weights, self.random)
-        #best = (best, weights[best])
+        self.observed_type = observed
+        return weighted_choice(self.signals, weights, random)
+
+    def do_signal(self, opponent=None):
+        best = self.choose_signal(opponent)
         self.rounds += 1
         self.log_signal(best, opponent)
-        self.last_v = weights[best]
+        self.last_v = self.risk(best, opponent)
         return best
 
 
 class RWResponder(BayesianResponder):
+    """
+    A responder that learns associative weights for signals, responses and
+    signal-response configurations by the Rescorla-Wagner rule.
+    """
+    __slots__ = ('signal_alpha', 'w_alpha', 'response_alpha', 'configural_alpha', 'beta',
+        'v_sig', 'v_response', 'v_configural', 'observed_type', 'low', 'diff',
+        'last_v', 'last_sig', 'last_mw', 'last_payoff', 'last_type')
+
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1], 
         signal_alpha=.3, w_alpha=.3, response_alpha=.3, configural_alpha=.03, beta=.75, seed=None):
         self.signal_alpha = signal_alpha
@@ -129,10 +160,10 @@ class RWResponder(BayesianResponder):
         self.response_alpha = response_alpha
         self.configural_alpha = configural_alpha
         self.beta = beta
-        self.v_sig = [0.]*3
-        self.v_response = [0.]*2
-        self.v_mw = {}
-        self.v_configural = {}
+        self.v_sig = array('d', [0.]*len(signals))
+        self.v_response = array('d', [0.]*len(responses))
+        # Signal x response
+        self.v_configural = [array('d', [0.]*len(responses)) for s in signals]
         self.observed_type = False
         self.low = 0.
         self.diff = 0.
@@ -143,11 +174,15 @@ class RWResponder(BayesianResponder):
         self.low = min(min(l) for l in payoffs)
         self.diff = float(max(max(l) for l in payoffs) - self.low)
         #[map(lambda x: (x - low) / diff, l) for l in payoffs]
-        for i in xrange(num):
-            signal = self.random.choice(self.signals)
-            player_type = weighted_random_choice(self.signals, type_weights[signal])
+        # Signals and responses come from this agent's stream in turn, and
+        # types from the shared default one
+        us = sampling.uniforms(self.random, 2*num)
+        signals = sampling.choose(self.signals, us[0::2])
+        responses = sampling.choose(self.responses, us[1::2])
+        player_types = sampling.keyed_weighted_choose(self.signals, type_weights, signals,
+            sampling.uniforms(sampling.default_random, num))
+        for signal, player_type, response in zip(signals, player_types, responses):
             #print "Signal is %d, type is %d" % (signal, player_type)
-            response = self.random.choice(self.responses)
             self.response_log.append(response)
             payoff = payoffs[player_type][response]
             self.last_v = self.risk(response, signal, None)
@@ -177,35 +212,29 @@ class RWResponder(BayesianResponder):
         response = self.response_log[len(self.response_log) - 1]
         self.v_sig[signal] += delta_v(self.signal_alpha*weight, self.beta, payoff, self.last_v)
         self.v_response[response] += delta_v(self.response_alpha*weight, self.beta, payoff, self.last_v)
-        try:
-            self.v_configural[(signal, response)] += delta_v(self.configural_alpha*weight, self.beta, payoff, self.last_v)
-        except:
-            self.v_configural[(signal, response)] = delta_v(self.configural_alpha*weight, self.beta, payoff, self.last_v)
+        self.v_configural[signal][response] += delta_v(self.configural_alpha*weight, self.beta, payoff, self.last_v)
 
     def risk(self, act, signal, opponent):
         risk = 0.
         risk += self.v_sig[signal]
         risk += self.v_response[act]
-        #self.observed_type = False
-        try:
-            #risk += self.v_mw[hash(opponent)]
-            #risk += self.v_type[opponent.player_type]
-            #.observed_type = True
-            risk += self.v_configural[(signal, act)]
-        except:
-            pass
+        risk += self.v_configural[signal][act]
         return risk
 
+    def choose_response(self, signal, opponent=None, random=None):
+        if random is None:
+            random = self.random
+        best = (random.randint(0, 2), -9999999)
+       #print "Type %d woman evaluating signals." % self.player_type
+        weights = map(lambda response: self.risk(response, signal, opponent), self.responses)
+        return weighted_choice(self.responses, weights, random)
+
     def respond(self, signal, opponent=None):
         """
         Make a judgement about somebody based on
         the signal they sent based on expe
         """
-        best = (self.random.randint(0, 2), -9999999)
-       #print "Type %d woman evaluating signals." % self.player_type
-        weights = map(lambda response: self.risk(response, signal, opponent), self.responses)
-        best = weighted_choice(self.responses, weights, self.random)
-        #best = (best, weights[best])
-        self.last_v = weights[best]
+        best = self.choose_response(signal, opponent)
+        self.last_v = self.risk(best, signal, opponent)
         self.response_log.append(best)
         return best
\ No newline at end of file
@@ -0,0 +1,213 @@
+"""
+A population level backend for games between RWSignallers and RWResponders.
+
+The associative weights of every agent are held as rows of shared matrices,
+and each round's risks, weighted choices and Rescorla-Wagner updates are made
+for all pairings at once. Agents keep views onto their rows, so they behave as
+usual outside of play, and their own random streams are used for every draw,
+so a game plays out exactly as it would one agent at a time.
+"""
+from rl import RWSignaller, RWResponder
+from array import array
+try:
+    import numpy
+    numpy_on = True
+except ImportError:
+    numpy_on = False
+
+def shifted_choices(weights, draws):
+    """
+    Make shifted_choice for each row of weights, using the matching uniform
+    draw, and return the chosen indices.
+    """
+    low = numpy.abs(weights.min(axis=1))
+    cumulative = (weights + low[:, None]).cumsum(axis=1)
+    above = cumulative > (cumulative[:, -1] * draws)[:, None]
+    assert above.any(axis=1).all(), "Shouldn't get here"
+    return above.argmax(axis=1)
+
+class RWPopulation(object):
+    """
+    Associative weights for a population of RWSignallers and RWResponders,
+    with one row per agent. Women must be swapped out with replace when they
+    leave the game, and everybody released when play is over.
+
+    If referral is True, rounds are played by the referral game's rules, where
+    the responder only learns after referring.
+    """
+    signaller_fields = ('signal_alpha', 'mw_alpha', 'type_alpha', 'configural_alpha', 'beta', 'low', 'diff')
+    responder_fields = ('signal_alpha', 'response_alpha', 'configural_alpha', 'beta', 'low', 'diff')
+
+    def __init__(self, game, women, midwives, referral=False):
+        self.referral = referral
+        self.num_appointments = game.num_appointments
+        self.baby_payoff = game.woman_baby_payoff
+        self.social_payoff = game.woman_social_payoff
+        self.midwife_payoff = game.midwife_payoff
+        signals = len(women[0].signals)
+        responses = len(midwives[0].responses)
+        num = len(women)
+        self.w_sig = numpy.zeros((num, signals))
+        self.w_type = numpy.zeros((num, signals))
+        # Woman x signal x midwife type
+        self.w_configural = numpy.zeros((num, signals, signals))
+        self.w_params = dict((k, numpy.zeros(num)) for k in self.signaller_fields)
+        num = len(midwives)
+        self.m_sig = numpy.zeros((num, signals))
+        self.m_response = numpy.zeros((num, responses))
+        # Midwife x signal x response
+        self.m_configural = numpy.zeros((num, signals, responses))
+        self.m_params = dict((k, numpy.zeros(num)) for k in self.responder_fields)
+        self.rows = {}
+        self.women = {}
+        self.free = range(len(women) - 1, -1, -1)
+        for woman in women:
+            self.attach(woman)
+        for row, midwife in enumerate(midwives):
+            self.m_sig[row] = midwife.v_sig
+            self.m_response[row] = midwife.v_response
+            self.m_configural[row] = midwife.v_configural
+            for k in self.responder_fields:
+                self.m_params[k][row] = getattr(midwife, k)
+            midwife.v_sig = self.m_sig[row]
+            midwife.v_response = self.m_response[row]
+            midwife.v_configural = self.m_configural[row]
+            self.rows[id(midwife)] = row
+        self.midwives = list(midwives)
+
+    @staticmethod
+    def supports(women, midwives):
+        """
+        True if these players can be played by a population.
+        """
+        return (numpy_on and len(women) > 0 and len(midwives) > 0 and
+            all(type(x) is RWSignaller for x in women) and all(type(x) is RWResponder for x in midwives))
+
+    def attach(self, woman):
+        """
+        Move a woman's weights into a free row.
+        """
+        row = self.free.pop()
+        self.w_sig[row] = woman.v_sig
+        self.w_type[row] = woman.v_type
+        self.w_configural[row] = woman.v_configural
+        for k in self.signaller_fields:
+            self.w_params[k][row] = getattr(woman, k)
+        woman.v_sig = self.w_sig[row]
+        woman.v_type = self.w_type[row]
+        woman.v_configural = self.w_configural[row]
+        self.rows[id(woman)] = row
+        self.women[id(woman)] = woman
+
+    def detach(self, woman):
+        """
+        Give a woman back her own copy of her weights, and free her row.
+        """
+        row = self.rows.pop(id(woman))
+        del self.women[id(woman)]
+        woman.v_sig = array('d', woman.v_sig)
+        woman.v_type = array('d', woman.v_type)
+        woman.v_configural = [array('d', x) for x in woman.v_configural]
+        self.free.append(row)
+
+    def replace(self, woman, new_woman):
+        """
+        Swap a finished woman for a newly born one.
+        """
+        self.detach(woman)
+        self.attach(new_woman)
+
+    def release(self):
+        """
+        Give every agent back their own weights.
+        """
+        for woman in self.women.values():
+            self.detach(woman)
+        for midwife in self.midwives:
+            midwife.v_sig = array('d', midwife.v_sig)
+            midwife.v_response = array('d', midwife.v_response)
+            midwife.v_configural = [array('d', x) for x in midwife.v_configural]
+        self.midwives = []
+        self.rows.clear()
+
+    def play_round(self, women, midwives):
+        """
+        Play a round between each woman and the matching midwife.
+        """
+        rows = self.rows
+        w = numpy.array([rows[id(x)] for x in women])
+        m = numpy.array([rows[id(x)] for x in midwives])
+        types = numpy.array([x.player_type for x in midwives])
+        # Type cues only apply to a midwife seen before
+        seen = numpy.array([hash(midwife) in woman.v_mw for woman, midwife in zip(women, midwives)])
+        risks = self.w_sig[w]
+        if seen.any():
+            ws = w[seen]
+            ts = types[seen]
+            risks[seen] = (risks[seen] + self.w_type[ws, ts][:, None]) + self.w_configural[ws, :, ts]
+        draws = []
+        for woman in women:
+            woman.random.randint(0, 2)
+            draws.append(woman.random.random())
+        signals = shifted_choices(risks, numpy.array(draws))
+        women_v = risks[numpy.arange(len(women)), signals]
+
+        risks = (self.m_sig[m, signals][:, None] + self.m_response[m]) + self.m_configural[m, signals]
+        draws = []
+        for midwife in midwives:
+            midwife.random.randint(0, 2)
+            draws.append(midwife.random.random())
+        acts = shifted_choices(risks, numpy.array(draws))
+        midwives_v = risks[numpy.arange(len(midwives)), acts]
+
+        signal_payoffs = []
+        receive_payoffs = []
+        for j, (woman, midwife) in enumerate(zip(women, midwives)):
+            signal = int(signals[j])
+            act = int(acts[j])
+            woman.rounds += 1
+            woman.log_signal(signal, midwife)
+            woman.last_v = float(women_v[j])
+            woman.observed_type = bool(seen[j])
+            if self.referral and woman.rounds == self.num_appointments:
+                woman.is_finished = True
+            midwife.last_v = float(midwives_v[j])
+            midwife.response_log.append(act)
+            signal_payoff = self.baby_payoff[woman.player_type][act] + self.social_payoff[signal][midwife.player_type]
+            receive_payoff = self.midwife_payoff[woman.player_type][act]
+            woman.accrued_payoffs += signal_payoff
+            midwife.accrued_payoffs += receive_payoff
+            woman.update_counts(act, midwife, signal_payoff)
+            signal_payoffs.append(woman.last_payoff)
+            receive_payoffs.append(receive_payoff)
+            if self.referral:
+                if act == 1:
+                    woman.is_finished = True
+                elif woman.rounds == self.num_appointments:
+                    woman.is_finished = True
+
+        # Signallers always learn
+        params = self.w_params
+        beta = params['beta'][w]
+        error = numpy.array(signal_payoffs) - women_v
+        self.w_sig[w, signals] += params['signal_alpha'][w] * beta * error
+        type_delta = params['type_alpha'][w] * beta * error
+        self.w_type[w[seen], types[seen]] += type_delta[seen]
+        mw_delta = numpy.where(seen, params['mw_alpha'][w] * beta * error, type_delta)
+        for j, (woman, midwife) in enumerate(zip(women, midwives)):
+            woman.v_mw.learn(hash(midwife), float(mw_delta[j]))
+        self.w_configural[w, signals, types] += params['configural_alpha'][w] * beta * error
+
+        # Responders learn unless they didn't refer in the referral game
+        learn = acts == 1 if self.referral else numpy.ones(len(midwives), dtype=bool)
+        if learn.any():
+            m = m[learn]
+            signals = signals[learn]
+            acts = acts[learn]
+            params = self.m_params
+            payoffs = (numpy.array(receive_payoffs)[learn] - params['low'][m]) / params['diff'][m]
+            beta = params['beta'][m]
+            error = payoffs - midwives_v[learn]
+            self.m_sig[m, signals] += params['signal_alpha'][m] * beta * error
+            self.m_response[m, acts] += params['response_alpha'][m] * beta * error
+            self.m_configural[m, signals, acts] += params['configural_alpha'][m] * beta * error
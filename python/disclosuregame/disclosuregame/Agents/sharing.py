@@ -10,13 +10,16 @@ class SharingResponder(RecognitionResponder):
     In addition, this agent can also make use of information obtained from others
     which is weighted according to the share_weight parameter.
     """
+    __slots__ = ('shareable', 'share_weight')
+
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1],
-        share_weight=0., seed=None):
+        share_weight=0., memory_capacity=None, seed=None):
         # Memory available for sharing
         self.shareable = None
         #Weight given to other's info
         self.share_weight = share_weight
-        super(SharingResponder, self).__init__(player_type, signals, responses, seed=seed)
+        super(SharingResponder, self).__init__(player_type, signals, responses,
+            memory_capacity=memory_capacity, seed=seed)
 
     def __str__(self):
         return "sharing_%s" % super(SharingResponder, self).__str__()
@@ -35,19 +38,24 @@ class SharingResponder(RecognitionResponder):
         """
         super(SharingResponder, self).remember(signaller, signal, response)
         if shareable and response == 1:
-            payoff_sum = sum(map(lambda x: self.payoffs[signaller.player_type][x[1]], self.signal_memory[hash(signaller)]))
-            self.shareable = (payoff_sum, (hash(signaller), (signaller.player_type, list(self.signal_memory[hash(signaller)]))))
+            memory = self.signal_memory[hash(signaller)]
+            payoff_sum = sum(map(lambda x: self.payoffs[signaller.player_type][x[1]], memory))
+            self.shareable = (payoff_sum, (hash(signaller), (signaller.player_type, memory)))
 
 
 class SharingSignaller(BayesianSignaller):
     """
     Class of signaller that maintains a meory of its experiences which can be
     shared with others, and can use the memories of others to update beliefs.
+    Own experiences are recorded as they happen, apart from those of others.
     """
+    __slots__ = ('own_memory', 'own_payoff', 'share_weight')
+
     def __init__(self, player_type=1, signals=[0, 1, 2], responses=[0, 1],
         share_weight=0., seed=None):
-        # Exogenous memories
-        self.exogenous = []
+        # (midwife type, signal, response, payoff) for own appointments
+        self.own_memory = []
+        self.own_payoff = 0
         #Weight given to other's info
         self.share_weight = share_weight
         super(SharingSignaller, self).__init__(player_type, signals, responses, seed=seed)
@@ -55,21 +63,27 @@ class SharingSignaller(BayesianSignaller):
     def __str__(self):
         return "sharing_%s" % super(SharingSignaller, self).__str__()
 
+    def update_counts(self, response, midwife, payoff, midwife_type=None, weight=1.):
+        """
+        Update counts from an appointment of this agent's own, and remember it.
+        """
+        super(SharingSignaller, self).update_counts(response, midwife, payoff, midwife_type, weight)
+        if midwife is not None and response is not None and payoff is not None:
+            self.own_memory.append((midwife.player_type, self.signal_log[len(self.signal_log) - 1],
+                response, payoff))
+            self.own_payoff += payoff
+
     def exogenous_update(self, signal, response, tmp_signaller, payoff, midwife_type=None):
         """
         Update counts from an external source. Counts are weighted according to the agent's
         share_weight attribute.
         """
         self.log_signal(signal, tmp_signaller, self.share_weight)
-        self.exogenous.append((tmp_signaller.player_type, signal, response, payoff))
-        self.update_counts(response, tmp_signaller, payoff, midwife_type, self.share_weight)
+        super(SharingSignaller, self).update_counts(response, tmp_signaller, payoff, midwife_type,
+            self.share_weight)
 
     def get_memory(self):
         """
         return the memory of this agent with the experiences of others stripped out.
         """
-        memories = zip(self.type_log, self.signal_log, self.response_log, self.payoff_log)
-        for memory in self.exogenous:
-            memories.remove(memory)
-        payoff_sum = sum(map(lambda x: x[3], memories))
-        return (payoff_sum, memories)
+        return (self.own_payoff, list(self.own_memory))
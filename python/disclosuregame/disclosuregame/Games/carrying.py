@@ -1,5 +1,6 @@
 import game
 from disclosuregame.Util import random_expectations
+from disclosuregame.Agents.rlpopulation import RWPopulation
 from referral import *
 import collections
 from random import Random
@@ -24,6 +25,7 @@ class CarryingGame(game.Game):
             harsh_mid, harsh_low, mid_high, mid_mid, mid_low, low_high, low_mid, low_low, randomise_payoffs, type_weights,
             rounds, measures_women, measures_midwives, params, num_appointments, seed)
         self.player_random = Random(self.random.random())
+        self.rw_population = False
 
     def random_player(self, probabilities, player, args={}):
         """
@@ -40,10 +42,25 @@ class CarryingGame(game.Game):
                     player = new_player
                 except AttributeError:
                     player = type(player)(player_type=i, seed=self.player_random.random(), **args)
+                player.ident = self.new_ident()
                 return player
         print "Whoops!",bracket,draw
 
 
+    def population(self, women, midwives):
+        """
+        Return an RWPopulation to play the rounds with, if one was asked for
+        and these players and rules can use it.
+        """
+        if not self.rw_population or not RWPopulation.supports(women, midwives):
+            return None
+        rule = type(self).play_round.im_func
+        if rule is game.Game.play_round.im_func:
+            return RWPopulation(self, women, midwives)
+        if rule is ReferralGame.play_round.im_func:
+            return RWPopulation(self, women, midwives, referral=True)
+        return None
+
     def get_distribution(self, players):
         """
         Return a list giving the distribution of player types.
@@ -60,6 +77,7 @@ class CarryingGame(game.Game):
     """
     def play_game(self, players, file_name=""):
         women, midwives = players
+        self.enrol(women + midwives)
         player_dist = self.get_distribution(women)
 
         rounds = self.rounds
@@ -68,10 +86,15 @@ class CarryingGame(game.Game):
         num_midwives = len(midwives)
         women_res = self.measures_women.dump(None, self.rounds, self, None)
         mw_res = self.measures_midwives.dump(None, self.rounds, self, None)
+        self.index_memories(midwives)
+        population = self.population(women, midwives)
         for i in range(rounds):
             players = [women.pop() for j in range(num_midwives)]
             self.random.shuffle(midwives)
-            map(self.play_round, players, midwives)
+            if population is None:
+                map(self.play_round, players, midwives)
+            else:
+                population.play_round(players, midwives)
             for x in midwives:
                 x.finished += 1
             women_res = self.measures_women.dump(players, i, self, women_res)
@@ -81,12 +104,14 @@ class CarryingGame(game.Game):
                     woman.is_finished = True
                     # Add a new naive women back into the mix
                     new_woman = self.random_player(player_dist, woman)#type(woman)(player_type=woman.player_type)
-                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff,
-                        random_expectations(random=self.player_random), [random_expectations(breadth=2, random=self.player_random) for x in range(3)])
+                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff, *self.new_priors())
                     new_woman.started = i
                     new_woman.finished = i
                     women.insert(0, new_woman)
-                    women_res.add_results(self.measures_women.dump([woman, new_woman], self.rounds, self))
+                    self.measures_women.dump([woman, new_woman], self.rounds, self, women_res)
+                    self.forget(woman)
+                    if population is not None:
+                        population.replace(woman, new_woman)
                     del woman
                 else:
                     women.insert(0, woman)
@@ -94,6 +119,8 @@ class CarryingGame(game.Game):
             #if scoop_on:
             #    scoop.logger.info("Worker %s played %d rounds." % (scoop.worker[0], i))
 
+        if population is not None:
+            population.release()
         del women
         del midwives
 
@@ -107,6 +134,7 @@ class CaseloadCarryingGame(CarryingGame, game.CaseloadGame):
 
     def play_game(self, players, file_name=""):
         women, midwives = players
+        self.enrol(women + midwives)
         player_dist = self.get_distribution(women)
 
         rounds = self.rounds
@@ -115,6 +143,8 @@ class CaseloadCarryingGame(CarryingGame, game.CaseloadGame):
         num_midwives = len(midwives)
         women_res = self.measures_women.dump(None, self.rounds, self, None)
         mw_res = self.measures_midwives.dump(None, self.rounds, self, None)
+        self.index_memories(midwives)
+        population = self.population(women, midwives)
 
         caseloads = {}
         num_women = len(women)
@@ -132,7 +162,10 @@ class CaseloadCarryingGame(CarryingGame, game.CaseloadGame):
 
         for i in range(rounds):
             players = [caseloads[midwife].pop() for midwife in midwives]
-            map(self.play_round, players, midwives)
+            if population is None:
+                map(self.play_round, players, midwives)
+            else:
+                population.play_round(players, midwives)
             for x in midwives:
                 x.finished += 1
             women_res = self.measures_women.dump(players, i, self, women_res)
@@ -144,18 +177,22 @@ class CaseloadCarryingGame(CarryingGame, game.CaseloadGame):
                     woman.is_finished = True
                     # Add a new naive women back into the mix
                     new_woman = self.random_player(player_dist, woman)#type(woman)(player_type=woman.player_type)
-                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff,
-                        random_expectations(random=self.player_random), [random_expectations(breadth=2, random=self.player_random) for x in range(3)])
+                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff, *self.new_priors())
                     new_woman.started = i
                     new_woman.finished = i
                     women.insert(0, new_woman)
-                    women_res.add_results(self.measures_women.dump([woman, new_woman], self.rounds, self))
+                    self.measures_women.dump([woman, new_woman], self.rounds, self, women_res)
+                    self.forget(woman)
+                    if population is not None:
+                        population.replace(woman, new_woman)
                     del woman
                 else:
                     women.insert(0, woman)
                     woman.finished += 1
             if scoop_on:
                 scoop.logger.info("Worker %s played %d rounds." % (scoop.worker[0], i))
+        if population is not None:
+            population.release()
         del women
         del midwives
         
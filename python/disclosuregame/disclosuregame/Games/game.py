@@ -1,5 +1,10 @@
 from random import Random
 from disclosuregame.Measures import measures_midwives, measures_women
+from disclosuregame.Agents.recognition import MemoryIndex
+from disclosuregame.Agents.bayes import restore_agent, Probe
+from disclosuregame.Util import pack_value, unpack_value, random_expectations
+import cPickle
+import gzip
 from collections import OrderedDict
 from itertools import count
 from copy import deepcopy
@@ -39,6 +44,14 @@ class Game(object):
         self.measures_women = measures_women
         self.measures_midwives = measures_midwives
         self.num_appointments = num_appointments
+        self.prior_pool = None
+        # Agents are given idents from 0 as they join, so that measures can
+        # keep track of them in bitmaps
+        self.next_ident = 0
+        # Stand-in opponent for measures of what agents would do, and the
+        # decisions made against it for the line being measured
+        self.probe = Probe(self.new_ident())
+        self.counterfactuals = None
         if params is None:
             self.parameters = OrderedDict()
         else:
@@ -63,6 +76,19 @@ class Game(object):
             self.payoffs["low_low"] = -low_low
         self.init_payoffs()
 
+    def snapshot(self):
+        """
+        Return the state of this game as a flat tuple of its class, then
+        (attribute, packed value) pairs.
+        """
+        return (self.__class__,) + tuple((k, pack_value(v)) for k, v in self.__dict__.iteritems())
+
+    def __reduce__(self):
+        return (restore_game, (self.snapshot(),))
+
+    def __deepcopy__(self, memo):
+        return restore_game(self.snapshot(), memo, id(self))
+
     def random_payoffs(self):
 
         self.payoffs["baby_payoff"] = self.self.random.randint(0, 100)
@@ -125,6 +151,51 @@ class Game(object):
                 priors["prior_%d_%d" % (i, j)] = self.type_weights[i][j]
         return priors
 
+    def new_priors(self):
+        """
+        Return type and response priors for a newly born woman, from the
+        prior pool if there is one.
+        """
+        if self.prior_pool is not None:
+            return self.prior_pool.draw()
+        return (random_expectations(random=self.player_random),
+            [random_expectations(breadth=2, random=self.player_random) for x in range(3)])
+
+    def new_ident(self):
+        """
+        Return the next unused agent ident in this game.
+        """
+        ident = self.next_ident
+        self.next_ident += 1
+        return ident
+
+    def enrol(self, players):
+        """
+        Give each of the players a new ident in this game. Must be done
+        before they have played, since opponents are remembered by ident.
+        """
+        for player in players:
+            player.ident = self.new_ident()
+
+    def index_memories(self, midwives):
+        """
+        Share a reverse index of remembered women between the midwives
+        that remember them.
+        """
+        self.memory_index = MemoryIndex()
+        for midwife in midwives:
+            try:
+                midwife.signal_memory.use_index(self.memory_index)
+            except AttributeError:
+                # Not a recognising midwife
+                pass
+
+    def forget(self, woman):
+        """
+        Remove a woman from the memories of every midwife who saw her.
+        """
+        self.memory_index.forget(hash(woman))
+
     def all_played(self, women, rounds=12):
         for woman in women:
             if(woman.rounds < rounds) and not woman.is_finished:
@@ -156,6 +227,7 @@ class Game(object):
 
     def play_game(self, players):
         women, midwives = players
+        self.enrol(women + midwives)
 
         rounds = self.num_appointments
         birthed = []
@@ -192,6 +264,44 @@ class Game(object):
         return rep
 
 
+def restore_game(snapshot, memo=None, original=None):
+    """
+    Rebuild a game from a snapshot. If memo is given, values not packed by
+    pack_value are deep copied with it, and the new game is recorded against
+    the id original. Random streams are packed by value, so a prior pool is
+    pointed back at the game's player_random, which it always draws from.
+    """
+    cls = snapshot[0]
+    game = cls.__new__(cls)
+    if memo is not None:
+        memo[original] = game
+    for name, packed in snapshot[1:]:
+        setattr(game, name, unpack_value(packed, memo))
+    pool = getattr(game, "prior_pool", None)
+    if pool is not None and hasattr(game, "player_random"):
+        pool.random = game.player_random
+    return game
+
+def save_checkpoint(file_name, game, women, midwives):
+    """
+    Write a gzipped checkpoint of a game and its players.
+    """
+    state = (game.snapshot(), [x.snapshot() for x in women], [x.snapshot() for x in midwives])
+    f = gzip.open(file_name, "wb")
+    cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+
+def load_checkpoint(file_name):
+    """
+    Read a checkpoint written by save_checkpoint, and return the game, women,
+    and midwives.
+    """
+    f = gzip.open(file_name, "rb")
+    game, women, midwives = cPickle.load(f)
+    f.close()
+    return restore_game(game), map(restore_agent, women), map(restore_agent, midwives)
+
+
 class CaseloadGame(Game):
     """
     Just like the standard game, but operates a caseloading system. Women
@@ -206,6 +316,7 @@ class CaseloadGame(Game):
 
     def play_game(self, players):
         women, midwives = players
+        self.enrol(women + midwives)
         rounds = self.num_appointments
         birthed = []
         #Assign women to midwives
@@ -224,7 +335,10 @@ class CaseloadGame(Game):
             caseloads[self.random.choice(midwives)].append(women.pop())
 
         while not self.all_played_caseload(caseloads, rounds):
-            for midwife, cases in caseloads.items():
+            # In the order of midwives, not of the caseloads dict, which
+            # follows their idents
+            for midwife in midwives:
+                cases = caseloads[midwife]
                 if not self.all_played(cases, rounds):
                     woman = cases.pop()
                     self.play_round(woman, midwife)
@@ -56,6 +56,7 @@ class CarryingInformationGame(CarryingReferralGame):
             worker = multiprocessing.current_process()
         LOG.debug("Worker %s playing a game." % (worker))
         women, midwives = players
+        self.enrol(women + midwives)
         player_dist = self.get_distribution(women)
 
         rounds = self.rounds
@@ -64,6 +65,7 @@ class CarryingInformationGame(CarryingReferralGame):
         num_midwives = len(midwives)
         women_res = self.measures_women.dump(None, self.rounds, self, None)
         mw_res = self.measures_midwives.dump(None, self.rounds, self, None)
+        self.index_memories(midwives)
         women_memories = []
         mw_memories = []
         for i in range(rounds):
@@ -79,15 +81,13 @@ class CarryingInformationGame(CarryingReferralGame):
                     woman.is_finished = True
                     # Add a new naive women back into the mix
                     new_woman = self.random_player(player_dist, woman, self.signaller_args)#type(woman)(player_type=woman.player_type)
-                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff,
-                        random_expectations(random=self.player_random), [random_expectations(breadth=2, random=self.player_random) for x in range(3)])
+                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff, *self.new_priors())
                     new_woman.started = i
                     new_woman.finished = i
                     women.insert(0, new_woman)
                     if self.women_share_prob > 0 and abs(self.women_share_bias) < 1:
                         women_memories.append(woman.get_memory())
-                    for midwife in midwives:
-                        midwife.signal_memory.pop(hash(woman), None)
+                    self.forget(woman)
                     del woman
                 else:
                     women.insert(0, woman)
@@ -205,6 +205,7 @@ class CarryingInformationGame(CarryingReferralGame):
         if len(memory[1]) > 1:
             LOG.debug("Memory chain length %d" % len(memory[1]))
         tmp_signaller = type(recepients[0])(player_type=player_type)
+        tmp_signaller.ident = self.new_ident()
         
         for recepient in recepients:
             #tmp_mem = deepcopy(recepient.signal_belief)
@@ -233,6 +234,7 @@ class CarryingInformationGame(CarryingReferralGame):
         for mem in memory:
             pt, signal, response, payoff = mem
             tmp_signaller = type(recepients[0])(player_type=pt)
+            tmp_signaller.ident = self.new_ident()
             map(lambda x: x.exogenous_update(signal, response, tmp_signaller, payoff, midwife_type=pt), recepients)
 
 
@@ -264,6 +266,7 @@ class CaseloadSharingGame(CarryingInformationGame):
         else:
             LOG.debug("Playing a game.")
         women, midwives = players
+        self.enrol(women + midwives)
         player_dist = self.get_distribution(women)
 
         rounds = self.rounds
@@ -272,6 +275,7 @@ class CaseloadSharingGame(CarryingInformationGame):
         num_midwives = len(midwives)
         women_res = self.measures_women.dump(None, self.rounds, self, None)
         mw_res = self.measures_midwives.dump(None, self.rounds, self, None)
+        self.index_memories(midwives)
         women_memories = []
         caseloads = {}
         num_women = len(women)
@@ -294,7 +298,7 @@ class CaseloadSharingGame(CarryingInformationGame):
             for x in midwives:
                 x.finished += 1
             LOG.debug("Played.")
-            women_for_measure = players + [item for sublist in caseloads.values() for item in sublist]
+            women_for_measure = players + [item for midwife in midwives for item in caseloads[midwife]]
             women_res = self.measures_women.dump(women_for_measure, i, self, women_res)
             mw_res = self.measures_midwives.dump(midwives, i, self, mw_res)
             #print("Wrote results.")
@@ -307,8 +311,7 @@ class CaseloadSharingGame(CarryingInformationGame):
                     woman.is_finished = True
                     # Add a new naive women back into the mix
                     new_woman = self.random_player(player_dist, woman, self.signaller_args)#type(woman)(player_type=woman.player_type)
-                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff,
-                        random_expectations(random=self.player_random), [random_expectations(breadth=2, random=self.player_random) for x in range(3)])
+                    new_woman.init_payoffs(self.woman_baby_payoff, self.woman_social_payoff, *self.new_priors())
                     new_woman.started = i
                     new_woman.finished = i
                     women.insert(0, new_woman)
@@ -316,11 +319,7 @@ class CaseloadSharingGame(CarryingInformationGame):
                     if self.women_share_prob > 0 and abs(self.women_share_bias) < 1:
                         women_memories.append(woman.get_memory())
                     LOG.debug("Collected memories.")
-                    for midwife in midwives:
-                        try:
-                            midwife.signal_memory.pop(hash(woman), None)
-                        except AttributeError:
-                            LOG.debug("Not a recognising midwife.")
+                    self.forget(woman)
                     LOG.debug("Pruned from midwives.")
                     del woman
                     LOG.debug("Added a new player.")
@@ -339,7 +338,7 @@ class CaseloadSharingGame(CarryingInformationGame):
 
             #Women
             try:
-                self.share_women(reduce(lambda x, y: x + y, caseloads.values()), women_memories)
+                self.share_women(reduce(lambda x, y: x + y, [caseloads[midwife] for midwife in midwives]), women_memories)
             except:
                 LOG.debug("Sharing to women failed.")
             LOG.debug("Played %d rounds." % i)
@@ -1,32 +1,43 @@
 from measures import *
+from disclosuregame.Util import Bitmap
+from array import array
 
 class PopCount(Measure):
+    incremental = True
+
     def __init__(self, player_type=None, midwife_type=None, signal=None):
         super(PopCount, self).__init__(player_type, midwife_type, signal)
-        self.hash_bucket = set()
+        self.hash_bucket = Bitmap()
 
     """
     Return the count of this type up to roundnum.
     """
-    def measure(self, roundnum, women, game):
+    def update(self, roundnum, women, game):
         if self.player_type is not None:
             women = filter(lambda x: x.player_type == self.player_type, women)
         women = map(lambda x: hash(x), women)
          
         self.hash_bucket.update(women)
+
+    def measure(self, roundnum, women, game):
+        self.update(roundnum, women, game)
         return len(self.hash_bucket)
 
 
 class HonestyMeasure(Measure):
-    def __init__(self, player_type=None, midwife_type=None, signal=None, counted=set()):
+    incremental = True
+
+    def __init__(self, player_type=None, midwife_type=None, signal=None, counted=None):
         super(HonestyMeasure, self).__init__(player_type, midwife_type, signal)
         self.count = 0
+        if counted is None:
+            counted = Bitmap()
         self.counted = counted
 
     """
     Return the number of honest signals sent on an appointment.
     """
-    def measure(self, roundnum, women, game):
+    def update(self, roundnum, women, game):
         if self.player_type is not None:
             women = filter(lambda x: x.player_type == self.player_type, women)
         women = filter(lambda x: x.rounds == self.signal, women)
@@ -34,19 +45,26 @@ class HonestyMeasure(Measure):
         women = filter(lambda x: hash(x) not in self.counted, women)
         self.counted.update(map(hash, women))
         self.count += len(women)
+
+    def measure(self, roundnum, women, game):
+        self.update(roundnum, women, game)
         return self.count
 
 
 class RefCount(Measure):
-    def __init__(self, player_type=None, midwife_type=None, signal=None, counted=set()):
+    incremental = True
+
+    def __init__(self, player_type=None, midwife_type=None, signal=None, counted=None):
         super(RefCount, self).__init__(player_type, midwife_type, signal)
         self.count = 0
+        if counted is None:
+            counted = Bitmap()
         self.counted = counted
 
     """
     Return the number of women referred on an appointment.
     """
-    def measure(self, roundnum, women, game):
+    def update(self, roundnum, women, game):
         if self.player_type is not None:
             women = filter(lambda x: x.player_type == self.player_type, women)
         women = filter(lambda x: x.rounds == self.signal, women)
@@ -54,41 +72,108 @@ class RefCount(Measure):
         women = filter(lambda x: hash(x) not in self.counted, women)
         self.counted.update(map(hash, women))
         self.count += len(women)
+
+    def measure(self, roundnum, women, game):
+        self.update(roundnum, women, game)
         return self.count
         
+class AppointmentHistogram(object):
+    """
+    Counts of women by type and by the appointment on which they were first
+    seen to have been referred, and first seen to have signalled honestly.
+    Each set of women is binned in a single pass, however many measures share
+    the histogram.
+    """
+    def __init__(self, types=3, appointments=12):
+        self.referred = [array('l', [0]*appointments) for i in xrange(types)]
+        self.honest = [array('l', [0]*appointments) for i in xrange(types)]
+        self.referred_counted = Bitmap()
+        self.honest_counted = Bitmap()
+        self.women = None
+
+    def update(self, women):
+        """
+        Bin any women newly referred or honest. Measures on the same line are
+        passed the same list, which is only binned once.
+        """
+        if women is self.women:
+            return
+        self.women = women
+        appointments = len(self.referred[0])
+        for woman in women:
+            rounds = woman.rounds
+            # Shared experiences can be logged before a woman's first
+            # appointment, but she is only counted from then on
+            if rounds == 0:
+                continue
+            ident = hash(woman)
+            if ident not in self.referred_counted and 1 in woman.response_log:
+                self.referred_counted.add(ident)
+                if rounds < appointments:
+                    self.referred[woman.player_type][rounds] += 1
+            if ident not in self.honest_counted and woman.player_type in woman.signal_log:
+                self.honest_counted.add(ident)
+                if rounds < appointments:
+                    self.honest[woman.player_type][rounds] += 1
+
+    def upto(self, table, player_type, appointment):
+        """
+        Return the count from the first appointment up to this one, for one
+        type or all of them.
+        """
+        if player_type is None:
+            return sum(sum(row[1:appointment + 1]) for row in table)
+        return sum(table[player_type][1:appointment + 1])
+
 class CumulativeRefCount(Measure):
-    def __init__(self, player_type=None, midwife_type=None, signal=None):
+    incremental = True
+
+    def __init__(self, player_type=None, midwife_type=None, signal=None, histogram=None):
         super(CumulativeRefCount, self).__init__(player_type, midwife_type, signal)
-        counted = set()
-        self.counters = [RefCount(player_type, midwife_type, x + 1, counted) for x in range(signal)]
+        if histogram is None:
+            histogram = AppointmentHistogram()
+        self.histogram = histogram
 
     """
     Return the number of women referred upto an appointment.
     """
+    def update(self, roundnum, women, game):
+        self.histogram.update(women)
+
     def measure(self, roundnum, women, game):
-        return sum(map(lambda x: x.measure(roundnum, women, game), self.counters))
+        self.update(roundnum, women, game)
+        return self.histogram.upto(self.histogram.referred, self.player_type, self.signal)
         
 class CumulativeHonestyCount(Measure):
-    def __init__(self, player_type=None, midwife_type=None, signal=None):
+    incremental = True
+
+    def __init__(self, player_type=None, midwife_type=None, signal=None, histogram=None):
         super(CumulativeHonestyCount, self).__init__(player_type, midwife_type, signal)
-        counted = set()
-        self.counters = [HonestyMeasure(player_type, midwife_type, x + 1, counted) for x in range(signal)]
+        if histogram is None:
+            histogram = AppointmentHistogram()
+        self.histogram = histogram
 
     """
-    Return the number of women referred upto an appointment.
+    Return the number of women honest upto an appointment.
     """
+    def update(self, roundnum, women, game):
+        self.histogram.update(women)
+
     def measure(self, roundnum, women, game):
-        return sum(map(lambda x: x.measure(roundnum, women, game), self.counters))
+        self.update(roundnum, women, game)
+        return self.histogram.upto(self.histogram.honest, self.player_type, self.signal)
 
 
 def abstract_measures_women():
     measures = OrderedDict()
     measures['round'] = Appointment()
+    # Every ref and honesty column reads from one histogram
+    histogram = AppointmentHistogram()
     for i in range(3):
         measures["type_%d_pop" % i] = PopCount(player_type = i)
         for j in range(1,12):
-            measures["type_%d_round_%d_ref" % (i, j)] = CumulativeRefCount(player_type=i, signal=j)
-            measures["type_%d_round_%d_honesty" % (i, j)] = CumulativeHonestyCount(player_type=i, signal=j)
+            measures["type_%d_round_%d_ref" % (i, j)] = CumulativeRefCount(player_type=i, signal=j, histogram=histogram)
+            measures["type_%d_round_%d_honesty" % (i, j)] = CumulativeHonestyCount(player_type=i, signal=j, histogram=histogram)
     return Measures(measures)
 
 def abstract_measures_mw():
@@ -2,22 +2,25 @@ from measures import *
 
 class IndividualMeasures(Measures):
     take_at_end = False
-    def dump(self, women, rounds, game):
+    def dump(self, women, rounds, game, results=None):
         """
         A results dumper. Takes a tuple of a game and players, and two dictionaries.
         Measures should contain a mapping from a field name to method for getting a result
         given an appointment, set of players, and a game. Params should contain mappings
         from parameter names to values.
         Writes rows as individuals, and takes the measure of the last round.
-        Returns a results object for writing to csv.
+        Optionally takes an existing results buffer to add rows to.
+        Returns a results buffer for writing to csv.
         """
-        results = []
+        if results is None:
+            results = ResultBuffer(self.measures.keys(), game.parameters)
         if women is None:
-            return Result(self.measures.keys(), game.parameters, results)
+            return results
+        game.counterfactuals = Counterfactuals(game.probe)
         for woman in women:
             line = map(lambda x: x.measure(rounds, [woman], game), self.measures.values())
             results.append(line)
-        results = Result(self.measures.keys(), game.parameters, results)
+        game.counterfactuals = None
         return results
 
 class PlayerHash(Measure):
@@ -69,20 +72,7 @@ class RoundSignal(Measure):
 
 class Response(Measure):
     def measure(self, roundnum, women, game):
-        woman = women[0]
-        signaller = type(woman)()
-        #print "Hashing by", hash(woman), "hashing", hash(signaller)
-        r = woman.respond(self.signal, signaller)
-        woman.signal_log.pop()
-        woman.response_log.pop()
-        woman.rounds -= 1
-        woman.signal_matches[self.signal] -= 1
-        try:
-            woman.signal_memory.pop(hash(signaller), None)
-            woman.shareable = None
-        except:
-            raise
-        return r
+        return counterfactuals(game).response(women[0], self.signal)
 
 def indiv_measures_women():
     measures = OrderedDict()
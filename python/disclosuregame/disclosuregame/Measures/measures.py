@@ -1,7 +1,9 @@
 from collections import OrderedDict
 import collections
-from disclosuregame.results import Result
+from disclosuregame.results import MISSING, ResultBuffer
 import itertools
+from array import array
+from disclosuregame.Util import Bitmap, TrimmedError, log_entry
 
 class Measures(object):
     def __init__(self, measures, dump_after=0, dump_every=25):
@@ -21,27 +23,47 @@ class Measures(object):
         Measures should contain a mapping from a field name to method for getting a result
         given an appointment, set of players, and a game. Params should contain mappings
         from parameter names to values.
-        Optionally takes an exist results object to add records to. This should have the same
+        Optionally takes an exist results buffer to add records to. This should have the same
         measures and params.
-        Returns a results object for writing to csv.
+        Returns a results buffer for writing to csv.
         """
         if results is None:
-            results = Result(self.measures.keys(), game.parameters, [])
+            results = ResultBuffer(self.measures.keys(), game.parameters)
         if women is None:
             return results
-        line = map(lambda x: x.measure(rounds, women, game), self.measures.values())
         if rounds >= self.dump_after and (rounds % self.dump_every == 0 or rounds == (game.rounds - 1)):
-            results.add_results(Result(self.measures.keys(), game.parameters, [line]))
+            # Counterfactual decisions are shared by every measure on the line
+            game.counterfactuals = Counterfactuals(game.probe)
+            line = map(lambda x: x.measure(rounds, women, game), self.measures.values())
+            game.counterfactuals = None
+            results.append(line)
+        else:
+            # Only measures that keep a running total need to see this round
+            for measure in self.measures.values():
+                if measure.incremental:
+                    measure.update(rounds, women, game)
         return results
 
 # Measures
 
 class Measure(object):
+    # Stateless measures are only evaluated on rounds which are dumped.
+    # Incremental ones keep running totals, and have update called on every
+    # other round.
+    incremental = False
+
     def __init__(self, player_type=None, midwife_type=None, signal=None):
         self.player_type = player_type
         self.midwife_type = midwife_type
         self.signal = signal
 
+    def update(self, roundnum, women, game):
+        """
+        Bring any running totals up to date with this round, without
+        computing the result.
+        """
+        pass
+
     def filter_present(self, women, roundnum):
         """
         Filter out any women not present on this round.
@@ -65,16 +87,20 @@ class NumRounds(Measure):
 
 
 class NumRoundsCumulative(Measure):
-    def __init__(self, player_type=None, midwife_type=None, signal=None, counted=set()):
+    incremental = True
+
+    def __init__(self, player_type=None, midwife_type=None, signal=None, counted=None):
         super(NumRoundsCumulative, self).__init__(player_type, midwife_type, signal)
         self.count = 0
         self.rounds = 0.
+        if counted is None:
+            counted = Bitmap()
         self.counted = counted
 
     """
     Return the cumulative average number of rounds played by a type.
     """
-    def measure(self, roundnum, women, game):
+    def update(self, roundnum, women, game):
         if self.player_type is not None:
             women = filter(lambda x: x.player_type == self.player_type, women)
         women = filter(lambda x: x.is_finished, women)
@@ -83,6 +109,9 @@ class NumRoundsCumulative(Measure):
         self.counted.update(map(hash, women))
         self.count += len(women)
         self.rounds += sum(map(lambda woman: woman.finished - woman.started, women))
+
+    def measure(self, roundnum, women, game):
+        self.update(roundnum, women, game)
         if self.count == 0:
             return 0.
         return self.rounds / self.count
@@ -183,7 +212,11 @@ class SignalChange(Measure):
         num_women = len(women)
         if num_women == 0:
             return 0.
-        change = map(lambda x: x.signal_log[roundnum - x.started] - x.signal_log[roundnum - 1 - x.started], women)
+        try:
+            change = map(lambda x: log_entry(x.signal_log, roundnum - x.started) -
+                log_entry(x.signal_log, roundnum - 1 - x.started), women)
+        except TrimmedError:
+            return MISSING
         return sum(change) / float(num_women)
     
 
@@ -250,7 +283,103 @@ class TypeExperience(Measure):
         return frequencies[self.player_type] / float(total_signals)
 
 
-class RightCallUpto(Measure):
+class ConfusionCounts(object):
+    """
+    Running counts of a midwife's responses against the types of the women
+    they were made to, read from her response and type logs as they grow.
+    Two sets of counts are kept: over every entry seen, and over the first n
+    entries for the last n asked for. Measures ask for rising n, so each entry
+    is read at most twice.
+    """
+    __slots__ = ('width', 'size', 'consumed', 'current', 'mark', 'marked', 'lost')
+
+    def __init__(self, responses, types):
+        self.width = types
+        self.size = responses * types
+        # Entries counted in current, and whether the logs discarded entries
+        # before they were counted
+        self.consumed = 0
+        self.current = array('l', [0]*self.size)
+        self.lost = False
+        # Entries counted in marked
+        self.mark = 0
+        self.marked = array('l', [0]*self.size)
+
+    def count(self, midwife, counts, start, end):
+        """
+        Add log entries start to end to counts, and return whether they were
+        all still in the logs.
+        """
+        r_log = midwife.response_log
+        t_log = midwife.type_log
+        r_trimmed = getattr(r_log, 'trimmed', 0)
+        t_trimmed = getattr(t_log, 'trimmed', 0)
+        if max(r_trimmed, t_trimmed) > start:
+            return False
+        width = self.width
+        for i in xrange(start, end):
+            counts[r_log[i - r_trimmed] * width + t_log[i - t_trimmed]] += 1
+        return True
+
+    def update(self, midwife):
+        """
+        Count any log entries not yet seen.
+        """
+        if self.lost:
+            return
+        r_log = midwife.response_log
+        t_log = midwife.type_log
+        end = min(len(r_log) + getattr(r_log, 'trimmed', 0), len(t_log) + getattr(t_log, 'trimmed', 0))
+        if end > self.consumed:
+            self.lost = not self.count(midwife, self.current, self.consumed, end)
+            self.consumed = end
+
+    def rows(self, counts):
+        width = self.width
+        return [counts[i:i + width] for i in xrange(0, self.size, width)]
+
+    def counts(self, midwife, n=None):
+        """
+        Return the counts over the first n responses with logged types (or
+        all of them) as a list of rows, one per response, indexed by type.
+        Returns None if the logs have discarded entries needed for them.
+        """
+        self.update(midwife)
+        if n is None or n >= self.consumed:
+            return None if self.lost else self.rows(self.current)
+        if n < self.mark:
+            # Asked for fewer than last time, so count again from the start
+            start, marked = 0, array('l', [0]*self.size)
+        else:
+            start, marked = self.mark, self.marked
+        if not self.count(midwife, marked, start, n):
+            return None
+        self.mark, self.marked = n, marked
+        return self.rows(marked)
+
+def confusion(midwife):
+    """
+    Return a midwife's running confusion counts, starting them if need be.
+    """
+    counts = getattr(midwife, 'confusion', None)
+    if counts is None:
+        counts = midwife.confusion = ConfusionCounts(len(midwife.responses), len(midwife.signals))
+    return counts
+
+class ConfusionMeasure(Measure):
+    """
+    A measure read from midwives' running confusion counts. Counts of bounded
+    logs are brought up to date every round, so that they are counted before
+    the logs discard them.
+    """
+    incremental = True
+
+    def update(self, roundnum, women, game):
+        for midwife in women:
+            if getattr(midwife.response_log, 'window', None) is not None:
+                confusion(midwife).counts(midwife, roundnum)
+
+class RightCallUpto(ConfusionMeasure):
     """
     Gives the frequency of right calls given by midwives of
     some (or any) type, up to now.
@@ -261,18 +390,12 @@ class RightCallUpto(Measure):
         total_calls = 0.
         total_right = 0.
         for midwife in women:
-            r_log = midwife.response_log
-            t_log = midwife.type_log
-            total_calls += len(r_log)
-            for i in range(len(r_log)):
-                response = r_log[i]
-                player = t_log[i]
-                if response == 0:
-                    if player == 0:
-                        total_right += 1
-                else:
-                    if player != 0:
-                        total_right += 1
+            rows = confusion(midwife).counts(midwife)
+            if rows is None:
+                return MISSING
+            total_calls += sum(sum(row) for row in rows)
+            # Type 0 not referred, or other types referred
+            total_right += rows[0][0] + sum(sum(row[1:]) for row in rows[1:])
         if total_calls == 0:
             return 0.
         return total_right / total_calls
@@ -312,14 +435,16 @@ class FalsePositive(Measure):
         total_right = 0.
         for midwife in women:
             try:
-                response = midwife.response_log[roundnum]
-                player = midwife.type_log[roundnum]
+                response = log_entry(midwife.response_log, roundnum)
+                player = log_entry(midwife.type_log, roundnum)
                 if response == 1:
                     if player == 0:
                         total_right += 1
                     total_calls += 1
             except IndexError:
                 pass
+            except TrimmedError:
+                return MISSING
         if total_calls == 0:
             return 0.
         return total_right / total_calls
@@ -332,75 +457,70 @@ class FalseNegative(Measure):
         total_right = 0.
         for midwife in women:
             try:
-                response = midwife.response_log[roundnum]
-                player = midwife.type_log[roundnum]
+                response = log_entry(midwife.response_log, roundnum)
+                player = log_entry(midwife.type_log, roundnum)
                 if response == 0:
                     if player != 0:
                         total_right += 1
                     total_calls += 1
             except IndexError:
                 pass
+            except TrimmedError:
+                return MISSING
         if total_calls == 0:
             return 0.
         return total_right / total_calls
 
-class TypedFalseNegativeUpto(Measure):
+class TypedFalseNegativeUpto(ConfusionMeasure):
     def measure(self, roundnum, women, game):
         if self.midwife_type is not None:
             women = filter(lambda x: x.player_type == self.midwife_type, women)
         total_calls = 0.
         total_right = 0.
         for midwife in women:
-            r_log = midwife.response_log[:roundnum]
-            t_log = midwife.type_log[:roundnum]
-            for i in range(len(r_log)):
-                response = r_log[i]
-                player = t_log[i]
-                if player == self.player_type:
-                    total_calls += 1
-                    if response == 0:
-                        total_right += 1
+            rows = confusion(midwife).counts(midwife, roundnum)
+            if rows is None:
+                return MISSING
+            if self.player_type < len(rows[0]):
+                # Women of this type, and those not referred
+                total_calls += sum(row[self.player_type] for row in rows)
+                total_right += rows[0][self.player_type]
         if total_calls == 0:
             return 0.
         return total_right / total_calls
 
 
-class FalsePositiveUpto(Measure):
+class FalsePositiveUpto(ConfusionMeasure):
     def measure(self, roundnum, women, game):
         if self.midwife_type is not None:
             women = filter(lambda x: x.player_type == self.midwife_type, women)
         total_calls = 0.
         total_right = 0.
         for midwife in women:
-            r_log = midwife.response_log[:roundnum]
-            t_log = midwife.type_log[:roundnum]
-            for i in range(len(r_log)):
-                response = r_log[i]
-                player = t_log[i]
-                if response == 1:
-                    if player == 0:
-                        total_right += 1
-                    total_calls += 1
+            rows = confusion(midwife).counts(midwife, roundnum)
+            if rows is None:
+                return MISSING
+            if len(rows) > 1:
+                # Referrals, and those of type 0
+                total_calls += sum(rows[1])
+                total_right += rows[1][0]
         if total_calls == 0:
             return 0.
         return total_right / total_calls
 
-class FalseNegativeUpto(Measure):
+class FalseNegativeUpto(ConfusionMeasure):
     def measure(self, roundnum, women, game):
         if self.midwife_type is not None:
             women = filter(lambda x: x.player_type == self.midwife_type, women)
         total_calls = 0.
         total_right = 0.
         for midwife in women:
-            r_log = midwife.response_log[:roundnum]
-            t_log = midwife.type_log[:roundnum]
-            for i in range(len(r_log)):
-                response = r_log[i]
-                player = t_log[i]
-                if response == 0:
-                    if player != 0:
-                        total_right += 1
-                    total_calls += 1
+            rows = confusion(midwife).counts(midwife, roundnum)
+            if rows is None:
+                return MISSING
+            # Non-referrals, and those not of type 0
+            total_calls += sum(rows[0])
+            total_right += sum(rows[0][1:])
         if total_calls == 0:
             return 0.
         return total_right / total_calls
@@ -419,75 +539,82 @@ class GameSeed(Measure):
     def measure(self, roundnum, women, game):
         return game.seed
 
-class GroupResponse(Measure):
-    def measure_one(self, woman):
-        signaller = type(woman)()
-        #print "Hashing by", hash(woman), "hashing", hash(signaller)
+class Counterfactuals(object):
+    """
+    The decisions agents would make right now against a game's probe
+    opponent, each worked out once however many measures ask for it.
+    """
+    def __init__(self, probe):
+        self.probe = probe
+        self.signals = {}
+        self.responses = {}
+
+    def signal(self, woman):
+        """
+        Return the signal this woman would send.
+        """
+        key = hash(woman)
         try:
-            memory = woman.shareable
-        except:
-            raise
-        r = woman.respond(self.signal, signaller)
-        woman.signal_log.pop()
-        woman.response_log.pop()
-        woman.rounds -= 1
-        woman.signal_matches[self.signal] -= 1
+            return self.signals[key]
+        except KeyError:
+            signal = self.signals[key] = woman.counterfactual_signal(self.probe)
+            return signal
+
+    def response(self, midwife, signal):
+        """
+        Return this midwife's response to the signal.
+        """
+        key = (hash(midwife), signal)
         try:
-            woman.signal_memory.pop(hash(signaller), None)
-            woman.shareable = memory
-        except:
-            raise
-        return r
+            return self.responses[key]
+        except KeyError:
+            response = self.responses[key] = midwife.counterfactual_response(signal, self.probe)
+            return response
+
+def counterfactuals(game):
+    """
+    Return the counterfactual decisions for the line being dumped, or a fresh
+    set if measuring outside of a dump.
+    """
+    if game.counterfactuals is None:
+        return Counterfactuals(game.probe)
+    return game.counterfactuals
 
+class GroupResponse(Measure):
+    """
+    Return the average response everybody would make right now to the signal.
+    """
     def measure(self, roundnum, women, game):
         if self.midwife_type is not None:
             women = filter(lambda x: x.player_type == self.midwife_type, women)
         if len(women) == 0:
             return "NA"
-        return sum(map(self.measure_one, women)) / float(len(women))
+        decisions = counterfactuals(game)
+        return sum(decisions.response(woman, self.signal) for woman in women) / float(len(women))
 
 class GroupHonesty(Measure):
     """
     Return the average absolute distance of everybody's choice of signal
     if they were to signal right now, from their own type.
     """
-    def measure_one(self, woman):
-        #print "Hashing by", hash(woman), "hashing", hash(signaller)
-        r = woman.do_signal(self.signal)
-        woman.signal_log.pop()
-        woman.rounds -= 1
-        woman.signal_matches[r] -= 1
-        try:
-            woman.signal_memory.pop(hash(signaller), None)
-            woman.shareable = None
-        except:
-            pass
-        return abs(r - woman.player_type)
+    def measure_one(self, woman, signal):
+        return abs(signal - woman.player_type)
 
     def measure(self, roundnum, women, game):
         if self.player_type is not None:
             women = filter(lambda x: x.player_type == self.player_type, women)
         if len(women) == 0:
             return "NA"
-        return sum(map(self.measure_one, women)) / float(len(women))
+        decisions = counterfactuals(game)
+        return sum(self.measure_one(woman, decisions.signal(woman)) for woman in women) / float(len(women))
 
 class GroupSignal(GroupHonesty):
     """
     Return the average of everybody's choice of signal
     if they were to signal right now.
     """
-    def measure_one(self, woman):
-        #print "Hashing by", hash(woman), "hashing", hash(signaller)
-        r = woman.do_signal(self.signal)
-        woman.signal_log.pop()
-        woman.rounds -= 1
-        woman.signal_matches[r] -= 1
-        try:
-            woman.signal_memory.pop(hash(signaller), None)
-            woman.shareable = None
-        except:
-            pass
-        return r
+    def measure_one(self, woman, signal):
+        return signal
 
 
 class SquaredGroupHonesty(GroupHonesty):
@@ -495,18 +622,8 @@ class SquaredGroupHonesty(GroupHonesty):
     Return the average squared distance of everybody's choice of signal
     if they were to signal right now, from their own type.
     """
-    def measure_one(self, woman):
-        #print "Hashing by", hash(woman), "hashing", hash(signaller)
-        r = woman.do_signal(self.signal)
-        woman.signal_log.pop()
-        woman.rounds -= 1
-        woman.signal_matches[r] -= 1
-        try:
-            woman.signal_memory.pop(hash(signaller), None)
-            woman.shareable = None
-        except:
-            pass
-        return (r - woman.player_type)**2
+    def measure_one(self, woman, signal):
+        return (signal - woman.player_type)**2
 
 class NormalisedSquaredGroupHonesty(GroupHonesty):
     def scale(self, n, low, high, a=-1., b=1.):
@@ -517,18 +634,8 @@ class NormalisedSquaredGroupHonesty(GroupHonesty):
     if they were to signal right now, from their own type.
     Distances are normalised to between +-1, type 1s are left as is.
     """
-    def measure_one(self, woman):
-        #print "Hashing by", hash(woman), "hashing", hash(signaller)
-        r = woman.do_signal(self.signal)
-        woman.signal_log.pop()
-        woman.rounds -= 1
-        woman.signal_matches[r] -= 1
-        try:
-            woman.signal_memory.pop(hash(signaller), None)
-            woman.shareable = None
-        except:
-            pass
-        diff = (r - woman.player_type)
+    def measure_one(self, woman, signal):
+        diff = (signal - woman.player_type)
         if woman.player_type == 0:
             diff = self.scale(diff, 0., 2.)
         elif woman.player_type == 2:
@@ -1,6 +1,9 @@
-__all__ = ["sqlite_dump", "sqlite_merge"]
+__all__ = ["columnar", "crunch", "gzipstream", "priors", "sampling", "spillqueue", "sqlite_dump", "sqlite_merge", "sqlite_migrate"]
 
 from random import Random
+from array import array
+from copy import deepcopy
+from sampling import weighted_random_choice, weighted_random_choices
 
 def random_expectations(depth=0, breadth=3, low=1, high=10, random=Random()):
     """
@@ -20,14 +23,185 @@ def random_expectations(depth=0, breadth=3, low=1, high=10, random=Random()):
         result = [random_expectations(depth - 1, breadth, low, high, random) for x in range(breadth)]
     return result
 
-def weighted_random_choice(choices, weights, random=Random()):
-    population = [val for val, cnt in zip(choices, weights) for i in range(int(cnt))]
-    return random.choice(population)
-
 def shuffled(target, random=Random()):
     """
     Return a shuffled version of the argument
     """
     a = list(target)
     random.shuffle(a)
-    return a
\ No newline at end of file
+    return a
+
+class TrimmedError(LookupError):
+    """
+    Raised on reading a log entry which a bounded log has discarded.
+    """
+    pass
+
+class BoundedLog(array):
+    """
+    A typed array log that retains at least the most recent window entries.
+    Older entries are discarded in blocks of window, so appending stays
+    amortised O(1). trimmed counts the entries discarded, so entry i of the
+    whole history is held at i - trimmed.
+    """
+    def __new__(cls, typecode, initializer=(), window=None, trimmed=0):
+        log = array.__new__(cls, typecode, initializer)
+        log.window = window
+        log.trimmed = trimmed
+        log.trim()
+        return log
+
+    def trim(self):
+        """
+        Discard older entries if there are at least twice window.
+        """
+        if len(self) >= 2*self.window:
+            dropped = len(self) - self.window
+            del self[:dropped]
+            self.trimmed += dropped
+
+    def append(self, value):
+        array.append(self, value)
+        self.trim()
+
+    def extend(self, values):
+        array.extend(self, values)
+        self.trim()
+
+    def insert(self, i, value):
+        array.insert(self, i, value)
+        self.trim()
+
+    def fromlist(self, values):
+        array.fromlist(self, values)
+        self.trim()
+
+    def fromstring(self, data):
+        array.fromstring(self, data)
+        self.trim()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __copy__(self):
+        return BoundedLog(self.typecode, self, self.window, self.trimmed)
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def __reduce__(self):
+        return (BoundedLog, (self.typecode, list(self), self.window, self.trimmed))
+
+def new_log(typecode, window=None):
+    """
+    Return an empty log of the given array typecode, keeping only recent
+    entries if window is not None.
+    """
+    if window is None:
+        return array(typecode)
+    return BoundedLog(typecode, window=window)
+
+def log_entry(log, i):
+    """
+    Return entry i of a log, counting from the first entry ever made, whether
+    or not the log is bounded. Raises TrimmedError if the entry has been
+    discarded, and IndexError if it was never made.
+    """
+    trimmed = getattr(log, 'trimmed', 0)
+    if 0 <= i < trimmed:
+        raise TrimmedError("Log entry %d has been discarded, only the last %d are kept." % (i, log.window))
+    if i >= 0:
+        i -= trimmed
+    return log[i]
+
+class Bitmap(object):
+    """
+    A set of small non-negative integers, such as agent idents, held as one
+    bit each in a bytearray which grows as larger numbers are added.
+    """
+    __slots__ = ('bits', 'count')
+
+    def __init__(self, items=()):
+        self.bits = bytearray()
+        self.count = 0
+        self.update(items)
+
+    def add(self, n):
+        """
+        Add n, and return True if it was not already present.
+        """
+        byte = n >> 3
+        bit = 1 << (n & 7)
+        bits = self.bits
+        if byte >= len(bits):
+            # Grow geometrically so adding rising idents stays amortised O(1)
+            bits.extend(bytearray(max(byte + 1 - len(bits), len(bits))))
+        if bits[byte] & bit:
+            return False
+        bits[byte] |= bit
+        self.count += 1
+        return True
+
+    def update(self, items):
+        for n in items:
+            self.add(n)
+
+    def __contains__(self, n):
+        byte = n >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (n & 7)))
+
+    def __len__(self):
+        return self.count
+
+def pack_value(value):
+    """
+    Encode a value for a snapshot as a tagged tuple. Typed arrays, and tables
+    of equal length arrays, are stored as raw bytes, and random generators by
+    their state. Anything else is stored as is.
+    """
+    kind = type(value)
+    if kind is array:
+        return ('a', value.typecode, value.tostring())
+    if kind is BoundedLog:
+        return ('b', value.typecode, value.tostring(), value.window, value.trimmed)
+    if kind is list and len(value) > 0 and type(value[0]) is array:
+        typecode = value[0].typecode
+        width = len(value[0])
+        if all(type(row) is array and row.typecode == typecode and len(row) == width for row in value):
+            return ('t', typecode, width, len(value), ''.join(row.tostring() for row in value))
+    if kind is Random:
+        version, internal, gauss_next = value.getstate()
+        return ('r', version, array('I', internal).tostring(), gauss_next)
+    return ('v', value)
+
+def unpack_value(packed, memo=None):
+    """
+    Decode a value packed by pack_value. If memo is not None, values stored as
+    is are deep copied using it.
+    """
+    tag = packed[0]
+    if tag == 'v':
+        if memo is None:
+            return packed[1]
+        return deepcopy(packed[1], memo)
+    if tag == 'a':
+        value = array(packed[1])
+        value.fromstring(packed[2])
+        return value
+    if tag == 'b':
+        value = BoundedLog(packed[1], window=packed[3], trimmed=packed[4])
+        array.fromstring(value, packed[2])
+        return value
+    if tag == 't':
+        typecode, width, rows, data = packed[1:]
+        flat = array(typecode)
+        flat.fromstring(data)
+        return [flat[i*width:(i + 1)*width] for i in xrange(rows)]
+    if tag == 'r':
+        internal = array('I')
+        internal.fromstring(packed[2])
+        value = Random.__new__(Random)
+        value.setstate((packed[1], tuple(internal), packed[3]))
+        return value
+    raise ValueError("Unknown snapshot tag %s" % tag)
@@ -0,0 +1,217 @@
+"""
+Result columns as NumPy arrays, read from a memory-mapped sidecar.
+
+The first read of a db copies its results, sorted by parameter set and
+appointment, into one .npy file per column in <db>.columns. Later reads map
+those files instead of fetching rows through sqlite, so no rows are turned
+into tuples. Each parameter set's results are a contiguous run of every
+column, so reading one parameter set (or any run of them) gives views onto the
+mapped files without copying. The sidecar is rebuilt whenever the db changes.
+Text columns are left out, integer columns with missing values become floats
+with nan in their place, and only current dbs can be read.
+"""
+import os
+import shutil
+import sqlite3
+import cPickle
+from disclosuregame.results import SCHEMA_VERSION, appointment_field, schema_version, table_columns
+try:
+    import numpy
+    from numpy.lib.format import open_memmap
+    numpy_on = True
+except ImportError:
+    numpy_on = False
+
+# Sidecars already opened, by db
+_sidecars = {}
+
+def sidecar_name(db):
+    return "%s.columns" % db
+
+def db_stamp(db):
+    stat = os.stat(db)
+    return stat.st_size, stat.st_mtime
+
+def column_dtypes(conn, fields):
+    """
+    Return the dtype for each field of the results, found from the types of
+    the values it holds, since a column's declared type comes from the first
+    game written to it: integers for columns of only integers, floats for
+    other numbers and for integers with missing values, and None for text.
+    Columns with no values fall back to their declared type.
+    """
+    declared = dict((row[1], row[2].upper()) for row in conn.execute("pragma table_info(results);"))
+    counts = []
+    for field in fields:
+        counts.append("sum(typeof(%s) = 'integer')" % field)
+        counts.append("sum(typeof(%s) = 'real')" % field)
+        counts.append("sum(typeof(%s) in ('text', 'blob'))" % field)
+        counts.append("sum(%s is null)" % field)
+    counts = conn.execute("select %s from results;" % ",".join(counts)).fetchone()
+    dtypes = []
+    for i, field in enumerate(fields):
+        integers, reals, others, nulls = [x or 0 for x in counts[4*i:4*i + 4]]
+        if others > 0:
+            dtypes.append(None)
+        elif integers > 0 and reals == 0 and nulls == 0:
+            dtypes.append(numpy.int64)
+        elif integers > 0 or reals > 0:
+            dtypes.append(numpy.float64)
+        elif declared[field] == "INTEGER" and not nulls:
+            dtypes.append(numpy.int64)
+        elif declared[field] in ("INTEGER", "REAL"):
+            dtypes.append(numpy.float64)
+        else:
+            dtypes.append(None)
+    return dtypes
+
+def build_sidecar(db, size=10000):
+    """
+    Write the numeric results columns of a db to its sidecar, sorted by
+    parameter set and appointment, and return the sidecar's description.
+    """
+    conn = sqlite3.connect(db)
+    if schema_version(conn) != SCHEMA_VERSION:
+        conn.close()
+        raise ValueError("%s uses an older schema, upgrade it with sqlite_migrate." % db)
+    fields = [x for x in table_columns(conn, "results") if x != "id"]
+    fields = [pair for pair in zip(fields, column_dtypes(conn, fields)) if pair[1] is not None]
+    num = conn.execute("select count(*) from results;").fetchone()[0]
+
+    directory = sidecar_name(db)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.mkdir(directory)
+    arrays = [open_memmap(os.path.join(directory, "%s.npy" % field), mode="w+", dtype=dtype, shape=(num,))
+        for field, dtype in fields]
+    names = [field for field, dtype in fields]
+    key = appointment_field(names)
+    c = conn.execute("select %s from results order by param_id%s;" % (",".join(names),
+        ", %s" % key if key else ""))
+    start = 0
+    block = c.fetchmany(size)
+    while block:
+        end = start + len(block)
+        for array, column in zip(arrays, zip(*block)):
+            array[start:end] = column
+        start = end
+        block = c.fetchmany(size)
+    conn.close()
+
+    param_ids = arrays[names.index("param_id")]
+    ids, starts = numpy.unique(param_ids, return_index=True)
+    ends = list(starts[1:]) + [num]
+    spans = dict((int(x), (int(a), int(b))) for x, a, b in zip(ids, starts, ends))
+    for array in arrays:
+        array.flush()
+    del arrays
+    description = {'stamp':db_stamp(db), 'fields':names, 'rows':num, 'spans':spans}
+    # Written last, so that a half built sidecar is never used
+    f = open(os.path.join(directory, "sidecar.pickle"), "wb")
+    cPickle.dump(description, f, -1)
+    f.close()
+    return description
+
+class Sidecar(object):
+    """
+    The memory-mapped columns of a db, built or rebuilt as needed.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.description = None
+        self.columns = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuild the sidecar if it is missing or older than the db.
+        """
+        if self.description is not None and self.description['stamp'] == db_stamp(self.db):
+            return
+        self.columns = {}
+        try:
+            f = open(os.path.join(sidecar_name(self.db), "sidecar.pickle"), "rb")
+            self.description = cPickle.load(f)
+            f.close()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            self.description = None
+        if self.description is None or self.description['stamp'] != db_stamp(self.db):
+            self.description = build_sidecar(self.db)
+
+    @property
+    def fields(self):
+        return self.description['fields']
+
+    def column(self, field):
+        """
+        Return a whole column, mapped read only.
+        """
+        try:
+            return self.columns[field]
+        except KeyError:
+            if field not in self.fields:
+                raise KeyError("%s has no numeric results column %s." % (self.db, field))
+            column = numpy.load(os.path.join(sidecar_name(self.db), "%s.npy" % field), mmap_mode="r")
+            self.columns[field] = column
+            return column
+
+    def param_ids(self, where=None):
+        """
+        Return the param_ids of the parameter sets matching where, or all of
+        them.
+        """
+        conn = sqlite3.connect(self.db)
+        query = "select param_id from parameters%s;" % ("" if where is None else " where %s" % where)
+        ids = [row[0] for row in conn.execute(query)]
+        conn.close()
+        return ids
+
+    def read(self, columns=None, where=None):
+        """
+        Return a dict of arrays holding the named columns (or all of them) of
+        the results for the parameter sets matching where, which is passed to
+        sqlite against the parameters table. Results come sorted by param_id
+        and appointment. Arrays are views onto the mapped files when the
+        matching results are contiguous, and copies otherwise.
+        """
+        self.refresh()
+        if columns is None:
+            columns = self.fields
+        if where is None:
+            spans = [(0, self.description['rows'])]
+        else:
+            spans = self.description['spans']
+            spans = sorted(spans[x] for x in self.param_ids(where) if x in spans)
+            # Join neighbouring parameter sets into single runs
+            runs = []
+            for start, end in spans:
+                if runs and runs[-1][1] == start:
+                    runs[-1] = (runs[-1][0], end)
+                else:
+                    runs.append((start, end))
+            spans = runs
+        result = {}
+        for field in columns:
+            column = self.column(field)
+            if len(spans) == 1:
+                result[field] = column[spans[0][0]:spans[0][1]]
+            elif spans:
+                result[field] = numpy.concatenate([column[start:end] for start, end in spans])
+            else:
+                result[field] = column[:0]
+        return result
+
+def read_columns(db, columns=None, where=None):
+    """
+    Return a dict of NumPy arrays holding results columns of a db, for the
+    parameter sets matching where, as Sidecar.read does. Sidecars are kept
+    open between calls.
+    """
+    if not numpy_on:
+        raise ImportError("Reading columns needs numpy.")
+    db = os.path.abspath(db)
+    try:
+        sidecar = _sidecars[db]
+    except KeyError:
+        sidecar = _sidecars[db] = Sidecar(db)
+    return sidecar.read(columns, where)
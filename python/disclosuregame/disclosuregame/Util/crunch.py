@@ -0,0 +1,201 @@
+"""
+Summarise results dbs without loading them whole.
+
+Results are grouped by parameter set, appointment and, for individual
+measures, player type, and the mean, variance and quantiles of every measure
+are written to a small csv for the figure scripts. Parameter sets are handed
+out to worker processes, each of which holds only one parameter set's results
+at a time, so the dbs may be far larger than memory. Current dbs are indexed
+by parameter set. Version 1 dbs are scanned once per parameter set, so should
+be upgraded with sqlite_migrate first.
+"""
+import sqlite3
+import fnmatch
+import os
+import argparse
+import csv
+import math
+import multiprocessing
+import time
+from collections import OrderedDict
+from disclosuregame.results import MISSING, appointment_field, table_columns
+from disclosuregame.Util.sqlite_dump import dump_query
+
+# Result columns which are never summarised
+SKIP = ("id", "param_id", "hash", "game_seed")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+NUMBERS = (int, long, float)
+
+def quantile(values, q):
+    """
+    Return the q quantile of sorted values, interpolating between the nearest
+    two as R's quantile does by default.
+    """
+    position = (len(values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def summarise(values, quantiles=QUANTILES):
+    """
+    Return the mean, sample variance and quantiles of the numbers in values,
+    with NA for any there are too few numbers to find.
+    """
+    values = sorted(x for x in values if type(x) in NUMBERS)
+    n = len(values)
+    if n == 0:
+        return [MISSING]*(2 + len(quantiles))
+    mean = math.fsum(values) / n
+    var = math.fsum((x - mean)**2 for x in values) / (n - 1) if n > 1 else MISSING
+    return [mean, var] + [quantile(values, q) for q in quantiles]
+
+def stat_names(quantiles=QUANTILES):
+    return ["mean", "var"] + [("q%g" % (100*q)).replace(".", "_") for q in quantiles]
+
+def layout(source):
+    """
+    Return the fields results are grouped by, and the measures, of a db.
+    """
+    t = sqlite3.connect(source)
+    fields = table_columns(t, "results")
+    t.close()
+    keys = [x for x in (appointment_field(fields), "player_type") if x in fields]
+    measures = [x for x in fields if x not in SKIP and x not in keys]
+    return keys, measures
+
+def parameter_sets(sources):
+    """
+    Return the parameter fields of the first db, and an ordered dict of the
+    values of every parameter set in the dbs, by hash.
+    """
+    params = OrderedDict()
+    fields = None
+    for source in sources:
+        t = sqlite3.connect(source)
+        columns = [x for x in table_columns(t, "parameters") if x != "param_id"]
+        if fields is None:
+            fields = [x for x in columns if x != "hash"]
+        for row in t.execute("select %s from parameters;" % ",".join(columns)):
+            values = dict(zip(columns, row))
+            params.setdefault(values["hash"], [values.get(x) for x in fields])
+        t.close()
+    return fields, params
+
+def crunch_params(job):
+    """
+    Summarise one parameter set's results from all the dbs, and return the
+    number of results read and a row for each group.
+    """
+    param_hash, sources, keys, measures, where, quantiles, size = job
+    condition = "hash = ?" if where is None else "hash = ? and (%s)" % where
+    num_keys = len(keys)
+    groups = {}
+    rows = 0
+    for source in sources:
+        t = sqlite3.connect(source)
+        c = t.cursor()
+        c.execute(dump_query(c, keys + measures, condition, fill=False), (param_hash,))
+        block = c.fetchmany(size)
+        while block:
+            for row in block:
+                key = row[:num_keys]
+                try:
+                    group = groups[key]
+                except KeyError:
+                    group = groups[key] = [[] for measure in measures]
+                for column, value in zip(group, row[num_keys:]):
+                    column.append(value)
+            rows += len(block)
+            block = c.fetchmany(size)
+        c.close()
+        t.close()
+    result = []
+    for key in sorted(groups):
+        group = groups[key]
+        line = list(key) + [len(group[0]) if group else 0]
+        for column in group:
+            line += summarise(column, quantiles)
+        result.append(line)
+    return rows, result
+
+def crunch_dbs(sources, target, where=None, processes=None, quantiles=QUANTILES, size=10000):
+    """
+    Summarise the results in sources, which must share a layout, into the csv
+    target. Each line holds a parameter set, its hash, the appointment (and
+    player type), the number of results, and every measure's statistics. where
+    is passed to sqlite to pick the results to use.
+    """
+    if len(sources) == 0:
+        return
+    start = time.time()
+    keys, measures = layout(sources[0])
+    fields, params = parameter_sets(sources)
+    print "Summarising %d measures over %d parameter sets." % (len(measures), len(params))
+    stats = stat_names(quantiles)
+    out = open(target, "wb")
+    csv_writer = csv.writer(out)
+    csv_writer.writerow(fields + ["hash"] + keys + ["n"] +
+        ["%s_%s" % (measure, stat) for measure in measures for stat in stats])
+    jobs = [(param_hash, sources, keys, measures, where, quantiles, size) for param_hash in params]
+    processes = min(processes or multiprocessing.cpu_count(), len(jobs))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        summaries = pool.imap(crunch_params, jobs)
+    else:
+        pool = None
+        summaries = (crunch_params(job) for job in jobs)
+    total = 0
+    for param_hash, (rows, lines) in zip(params, summaries):
+        prefix = params[param_hash] + [param_hash]
+        csv_writer.writerows(prefix + line for line in lines)
+        total += rows
+        elapsed = time.time() - start
+        print "Summarised %s, %d results read in %.1f s (%.0f results/s)." % (param_hash, total,
+            elapsed, total / max(elapsed, 1e-6))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    out.close()
+
+def list_matching(directory, name):
+    matching = []
+    for file in os.listdir(directory):
+        if fnmatch.fnmatch(file, name):
+            matching.append("%s/%s" % (directory, file))
+    return matching
+
+def arguments():
+    parser = argparse.ArgumentParser(
+        description='Summarise results DBs by parameter set and appointment.')
+    parser.add_argument('-d', type=str, nargs='?',
+                   help='Directory to look for DBs to summarise.', default=".",
+                   dest="directory")
+    parser.add_argument('-f', type=str, nargs='*',
+                   help='List of source filenames which may include wildcards.', default=["*.db"],
+                   dest="files")
+    parser.add_argument('-t', type=str, nargs='?',
+                   help='Target CSV.', default="summary.csv",
+                   dest="target")
+    parser.add_argument('-where', type=str, nargs='?',
+        help='Optional argument to where.', dest="where",
+        default=None)
+    parser.add_argument('-q', type=float, nargs='*',
+                   help='Quantiles to find.', default=list(QUANTILES),
+                   dest="quantiles")
+    parser.add_argument('-p', type=int, nargs='?',
+                   help='Number of processes. Defaults to the number of cpus.', default=None,
+                   dest="processes")
+    parser.add_argument('-n', type=int, nargs='?',
+                   help='Number of rows to fetch at a time.', default=10000,
+                   dest="size")
+    args = parser.parse_args()
+    files = []
+    for f in args.files:
+        files += list_matching(args.directory, f)
+    return args.target, files, args.where, args.processes, args.quantiles, args.size
+
+
+if __name__ =="__main__":
+    target, files, where, processes, quantiles, size = arguments()
+    print "Summarising", files
+    crunch_dbs(files, target, where, processes, quantiles, size)
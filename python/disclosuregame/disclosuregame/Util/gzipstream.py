@@ -0,0 +1,81 @@
+"""
+Gzip output compressed on several threads.
+
+Written data is cut into blocks, each compressed as a gzip member of its own
+on a pool of threads and written out in order. A run of members is a valid
+gzip file, which gzip, zcat and R's gzfile read as one stream. zlib releases
+the GIL while it compresses, so the threads do run at once. No more than two
+blocks per thread are held at a time, so memory use does not grow with the
+amount written.
+"""
+import zlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import deque
+
+def compress_member(data, level=6):
+    """
+    Return data as one complete gzip member.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+class GzipWriter(object):
+    """
+    A write only gzip file. Blocks of block bytes are compressed at level on
+    threads threads, by default one per cpu.
+    """
+    def __init__(self, file_name, level=6, threads=None, block=1 << 20):
+        self.file = open(file_name, "wb")
+        self.level = level
+        self.threads = threads or multiprocessing.cpu_count()
+        self.block = block
+        self.parts = []
+        self.size = 0
+        self.members = 0
+        self.pending = deque()
+        self.pool = ThreadPool(self.threads) if self.threads > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.block:
+            self.submit()
+
+    def submit(self):
+        """
+        Start compressing what has been written so far, waiting for the oldest
+        blocks if too many are in hand.
+        """
+        data = "".join(self.parts)
+        self.parts = []
+        self.size = 0
+        if not data:
+            return
+        self.members += 1
+        if self.pool is None:
+            self.file.write(compress_member(data, self.level))
+            return
+        self.pending.append(self.pool.apply_async(compress_member, (data, self.level)))
+        while len(self.pending) >= 2 * self.threads:
+            self.file.write(self.pending.popleft().get())
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.submit()
+        while self.pending:
+            self.file.write(self.pending.popleft().get())
+        if self.members == 0:
+            # An empty file still needs one member to be valid gzip
+            self.file.write(compress_member("", self.level))
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.file.close()
@@ -0,0 +1,64 @@
+"""
+Batch generation of the integer-partition priors made by random_expectations.
+
+Each row is drawn with the same distribution as a call to random_expectations,
+but a whole population's worth of rows comes from one set of NumPy calls.
+Without NumPy, rows are made one at a time by random_expectations itself.
+"""
+from random import Random
+from disclosuregame.Util import random_expectations
+try:
+    import numpy
+    numpy_on = True
+except ImportError:
+    numpy_on = False
+
+def batch_expectations(num, breadth=3, low=1, high=10, random=Random()):
+    """
+    Return a list of num rows, each distributed as random_expectations(0,
+    breadth, low, high) would be.
+    """
+    if not numpy_on:
+        return [random_expectations(breadth=breadth, low=low, high=high, random=random) for x in xrange(num)]
+    state = numpy.random.RandomState(random.randint(0, 2**32 - 1))
+    result = numpy.empty((num, breadth), dtype=int)
+    initial = numpy.empty(num, dtype=int)
+    initial.fill(high + 1)
+    for i in xrange(breadth - 1):
+        # Uniform on [low, initial - low*(breadth - i)], as randint is
+        span = initial - low * (breadth - i) - low + 1
+        n = low + (state.random_sample(num) * span).astype(int)
+        initial -= n
+        result[:, i] = n
+    result[:, breadth - 1] = initial - low
+    # Shuffle every row independently
+    order = numpy.argsort(state.random_sample((num, breadth)), axis=1)
+    return result[numpy.arange(num)[:, None], order].tolist()
+
+def batch_priors(num, random=Random()):
+    """
+    Return num (type weights, response weights) pairs for signallers, as
+    passed to init_payoffs.
+    """
+    types = batch_expectations(num, random=random)
+    responses = batch_expectations(3*num, breadth=2, random=random)
+    return [(types[i], responses[3*i:3*i + 3]) for i in xrange(num)]
+
+class PriorPool(object):
+    """
+    Hands out signaller priors one at a time, generating them in batches of
+    size.
+    """
+    def __init__(self, random, size=256):
+        self.random = random
+        self.size = size
+        self.pool = []
+
+    def draw(self):
+        """
+        Return the next (type weights, response weights) pair.
+        """
+        if not self.pool:
+            self.pool = batch_priors(self.size, self.random)
+            self.pool.reverse()
+        return self.pool.pop()
@@ -0,0 +1,224 @@
+"""
+Weighted random sampling shared by the agents.
+
+By default draws are made exactly as the original population based
+weighted_random_choice made them, so seeded runs are reproducible, but without
+building a population list. Setting compatible to False switches to Walker/Vose
+alias tables, which take O(1) per draw. Tables are cached per weight vector.
+
+Many draws can be made at once from a list of uniforms, taken from a generator
+in the order single draws would take them. With NumPy the uniforms are turned
+into choices by array operations, and without it by bisection.
+"""
+from random import Random
+from bisect import bisect_right
+from itertools import repeat, starmap
+try:
+    import numpy
+    numpy_on = True
+except ImportError:
+    numpy_on = False
+
+# Reproduce the original draws bit for bit. Set to False to use alias tables.
+compatible = True
+
+# Tables are cached by (compatible, weights), and the cache is emptied when it
+# reaches cache_limit entries.
+cache_limit = 4096
+_tables = {}
+
+# The generator weighted_random_choice uses when it isn't given one
+default_random = Random()
+
+def uniforms(random, num):
+    """
+    Return the next num numbers from random.random(), as a NumPy array if
+    NumPy is available.
+    """
+    draws = starmap(random.random, repeat((), num))
+    if numpy_on:
+        return numpy.fromiter(draws, float, num)
+    return list(draws)
+
+def choose(choices, us):
+    """
+    Return the choices random.choice would make with each of the uniforms us.
+    """
+    size = len(choices)
+    if numpy_on:
+        return [choices[i] for i in (numpy.asarray(us) * size).astype(int).tolist()]
+    return [choices[int(u * size)] for u in us]
+
+class CumulativeTable(object):
+    """
+    Cumulative integer weights, drawn from by indexing into the population the
+    weights describe, as random.choice over that population would.
+    """
+    __slots__ = ('cumulative', 'total')
+
+    def __init__(self, weights):
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += int(weight)
+            self.cumulative.append(total)
+        self.total = total
+
+    def draw(self, random):
+        position = int(random.random() * self.total)
+        for i, upto in enumerate(self.cumulative):
+            if position < upto:
+                return i
+        raise IndexError("Cannot choose with no positive weights.")
+
+    def indices(self, us):
+        """
+        Return the draws made with each of the uniforms us.
+        """
+        if self.total <= 0:
+            raise IndexError("Cannot choose with no positive weights.")
+        total = self.total
+        if numpy_on:
+            positions = (numpy.asarray(us) * total).astype(int)
+            return numpy.searchsorted(self.cumulative, positions, side='right').tolist()
+        cumulative = self.cumulative
+        return [bisect_right(cumulative, int(u * total)) for u in us]
+
+
+class AliasTable(object):
+    """
+    A Walker/Vose alias table over some weights, taking one uniform draw per
+    sample.
+    """
+    __slots__ = ('size', 'prob', 'alias')
+
+    def __init__(self, weights):
+        total = float(sum(weights))
+        if total <= 0:
+            raise IndexError("Cannot choose with no positive weights.")
+        size = len(weights)
+        scaled = [weight * size / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.]
+        large = [i for i, p in enumerate(scaled) if p >= 1.]
+        self.prob = [1.]*size
+        self.alias = range(size)
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.
+            if scaled[more] < 1.:
+                small.append(more)
+            else:
+                large.append(more)
+        self.size = size
+
+    def draw(self, random):
+        u = random.random() * self.size
+        i = int(u)
+        if u - i < self.prob[i]:
+            return i
+        return self.alias[i]
+
+    def indices(self, us):
+        """
+        Return the draws made with each of the uniforms us.
+        """
+        if numpy_on:
+            u = numpy.asarray(us) * self.size
+            i = u.astype(int)
+            return numpy.where(u - i < numpy.take(self.prob, i), i, numpy.take(self.alias, i)).tolist()
+        size = self.size
+        prob = self.prob
+        alias = self.alias
+        result = []
+        for u in us:
+            u *= size
+            i = int(u)
+            result.append(i if u - i < prob[i] else alias[i])
+        return result
+
+
+def cache(key, result):
+    """
+    Cache a table under key, and return it.
+    """
+    if len(_tables) >= cache_limit:
+        _tables.clear()
+    _tables[key] = result
+    return result
+
+def table(weights):
+    """
+    Return the (cached) table for drawing indices with these weights.
+    """
+    key = (compatible, tuple(weights))
+    try:
+        return _tables[key]
+    except KeyError:
+        if compatible:
+            return cache(key, CumulativeTable(weights))
+        return cache(key, AliasTable([int(weight) for weight in weights]))
+
+def weighted_random_choice(choices, weights, random=default_random):
+    """
+    Choose one of choices with probability proportional to the integer part of
+    its weight.
+    """
+    return choices[table(weights).draw(random)]
+
+def weighted_random_choices(choices, weights, num, random=default_random):
+    """
+    Make num weighted choices at once, consuming the same random numbers as
+    num calls to weighted_random_choice.
+    """
+    return weighted_choose(choices, weights, uniforms(random, num))
+
+def weighted_choose(choices, weights, us):
+    """
+    Return the choices weighted_random_choice would make with each of the
+    uniforms us.
+    """
+    return [choices[i] for i in table(weights).indices(us)]
+
+def keyed_weighted_choose(choices, weights, keys, us):
+    """
+    Return the choices weighted_random_choice would make with each of the
+    uniforms us, the k-th using the weights weights[keys[k]].
+    """
+    if numpy_on:
+        keys = numpy.asarray(keys)
+        us = numpy.asarray(us)
+        result = numpy.empty(len(keys), dtype=int)
+        for key in numpy.unique(keys).tolist():
+            picked = keys == key
+            result[picked] = table(weights[key]).indices(us[picked])
+        return [choices[i] for i in result.tolist()]
+    result = [None]*len(keys)
+    for key in set(keys):
+        picked = [k for k, x in enumerate(keys) if x == key]
+        for k, i in zip(picked, table(weights[key]).indices([us[k] for k in picked])):
+            result[k] = choices[i]
+    return result
+
+def shifted_choice(choices, weights, random=Random()):
+    """
+    Choose with probability proportional to the weights after shifting them up
+    by the magnitude of the smallest, so that negative weights can be used.
+    """
+    low = abs(min(weights))
+    if not compatible:
+        # These weights change with every update, so the table isn't cached
+        return choices[AliasTable([x + low for x in weights]).draw(random)]
+    total = 0.
+    for weight in weights:
+        total += weight + low
+    r = total * random.random()
+    upto = 0
+    for c, weight in zip(choices, weights):
+        weight += low
+        if upto + weight > r:
+            return c
+        upto += weight
+    assert False, "Shouldn't get here"
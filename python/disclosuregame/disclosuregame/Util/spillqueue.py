@@ -0,0 +1,103 @@
+"""
+A process safe queue which holds a bounded amount in memory.
+
+Items are pickled as they are put. While the items in flight take up less than
+limit bytes they travel through an ordinary multiprocessing queue, and after
+that each is written to a temporary file and only its name is queued. Every
+item comes out in the order it was put, whether or not it was spilled, and
+spill files are removed as they are read. Spill files go in the system's
+temporary directory unless another is given, which should be on a local disk.
+"""
+import os
+import shutil
+import tempfile
+import cPickle
+import multiprocessing
+
+logger = multiprocessing.get_logger()
+
+class SpillQueue(object):
+    """
+    A queue for any number of producers and one consumer, holding at most
+    limit bytes of pickled items in memory (or one item, if that is larger).
+    None is passed through as is, to mark the end of the queue.
+    """
+    def __init__(self, limit=128 << 20, directory=None):
+        self.limit = limit
+        self.directory = tempfile.mkdtemp(prefix="spill_", dir=directory)
+        self.queue = multiprocessing.Queue()
+        self.lock = multiprocessing.Lock()
+        # Bytes held in memory, the most ever held, and the number and bytes
+        # of items spilled, all guarded by lock
+        self.held = multiprocessing.Value('l', 0, lock=False)
+        self.peak = multiprocessing.Value('l', 0, lock=False)
+        self.spilled = multiprocessing.Value('l', 0, lock=False)
+        self.spilled_bytes = multiprocessing.Value('l', 0, lock=False)
+
+    def reserve(self, size):
+        """
+        Count size bytes as held in memory if there is room for them, and
+        return whether there was. Items put hold their own bytes, but this
+        lets memory held elsewhere on their behalf be counted too, until it
+        is given back with release.
+        """
+        peak = None
+        with self.lock:
+            room = self.held.value == 0 or self.held.value + size <= self.limit
+            if room:
+                self.held.value += size
+                # Log each time the high-water mark passes another eighth of the limit
+                step = max(self.limit // 8, 1)
+                if self.held.value // step > self.peak.value // step:
+                    peak = self.held.value
+                self.peak.value = max(self.peak.value, self.held.value)
+        if peak is not None:
+            logger.info("Result queue high-water mark %.1f MB of %.1f MB." % (peak / 1e6, self.limit / 1e6))
+        return room
+
+    def release(self, size):
+        with self.lock:
+            self.held.value -= size
+
+    def put(self, item):
+        if item is None:
+            self.queue.put(None)
+            return
+        data = cPickle.dumps(item, -1)
+        size = len(data)
+        if self.reserve(size):
+            self.queue.put((True, data))
+            return
+        fd, path = tempfile.mkstemp(suffix=".pickle", dir=self.directory)
+        f = os.fdopen(fd, "wb")
+        f.write(data)
+        f.close()
+        with self.lock:
+            self.spilled.value += 1
+            self.spilled_bytes.value += size
+            spilled = self.spilled.value
+        logger.debug("Result queue full, spilled %.1f MB to %s (%d spilled so far)." % (size / 1e6, path, spilled))
+        self.queue.put((False, path))
+
+    def get(self):
+        message = self.queue.get()
+        if message is None:
+            return None
+        in_memory, data = message
+        if in_memory:
+            self.release(len(data))
+        else:
+            path = data
+            f = open(path, "rb")
+            data = f.read()
+            f.close()
+            os.remove(path)
+        return cPickle.loads(data)
+
+    def close(self):
+        """
+        Log the high-water marks and remove any spill files left.
+        """
+        logger.info("Result queue held at most %.1f MB, and spilled %d items (%.1f MB) to disk." % (
+            self.peak.value / 1e6, self.spilled.value, self.spilled_bytes.value / 1e6))
+        shutil.rmtree(self.directory, ignore_errors=True)
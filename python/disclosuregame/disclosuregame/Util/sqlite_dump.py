@@ -4,51 +4,106 @@ import os
 import argparse
 import csv
 import multiprocessing
+import shutil
+import tempfile
+import time
+from disclosuregame.results import MISSING, table_columns
+from disclosuregame.Util.gzipstream import GzipWriter
 
-def dump_db(where, output, sources):
-    source = sources.pop()
-    try:
-        t = sqlite3.connect(source)
-    except:
-        print source
-        raise
-    c = t.cursor()
-
-    if output is None:
-        output = "%s.csv" % source
+def dump_query(conn, columns=None, where=None, fill=True):
+    """
+    Return the query for the results of a db joined to their parameter sets,
+    keeping only the named columns if columns is given and only the rows
+    matching where if that is. Both refer to the joined columns by name, and
+    are left to sqlite. Missing values come out as NA if fill is True.
+    """
+    results = table_columns(conn, "results")
+    parameters = table_columns(conn, "parameters")
+    # Version 1 results hold the parameter hash, later ones a param_id
+    key = "param_id" if "param_id" in results else "hash"
+    joined = ["r.%s as %s" % (x, x) for x in results if x != "param_id"]
+    if key == "param_id":
+        joined.append("p.hash as hash")
+    joined += ["p.%s as %s" % (x, x) for x in parameters if x not in ("param_id", "hash")]
+    if columns is None:
+        columns = [x.split(" as ")[1] for x in joined]
+    if fill:
+        columns = ["ifnull(%s, '%s') as %s" % (x, MISSING, x) for x in columns]
+    query = "select %s from (select %s from results as r join parameters as p on p.%s = r.%s)" % (
+        ",".join(columns), ",".join(joined), key, key)
+    if where is not None:
+        query += " where %s" % where
+    return query + ";"
 
-    c.execute("pragma synchronous = off;")
-    c.execute("pragma journal_mode=off;")
-    print("Dumping from " + source + ".")
-    if where is None:
-        c.execute("select * from results join parameters;")
-    else:    
-        c.execute("select * from results join parameters where %s;" %where)
-    csv_writer = csv.writer(open(output, "w"))
-    csv_writer.writerow([i[0] for i in c.description]) # write headers
-    print("Wrote headers.")
-    print("Writing rows.")
-    csv_writer.writerows(c)
-    del csv_writer
+def dump_db(job):
+    """
+    Write the joined results of a db to a csv file, fetching size rows at a
+    time, and gzipped at level on threads threads if level is not None.
+    Returns the number of rows written.
+    """
+    source, output, columns, where, header, size, level, threads = job
+    start = time.time()
+    t = sqlite3.connect(source)
+    c = t.cursor()
+    c.execute(dump_query(c, columns, where))
+    out = open(output, "wb") if level is None else GzipWriter(output, level, threads)
+    csv_writer = csv.writer(out)
+    if header:
+        csv_writer.writerow([i[0] for i in c.description])
+    rows = 0
+    block = c.fetchmany(size)
+    while block:
+        csv_writer.writerows(block)
+        rows += len(block)
+        block = c.fetchmany(size)
+    out.close()
     c.close()
     t.close()
-    for source in sources:
-        print("Dumping from " + source + ".")
-        t = sqlite3.connect(source)
-        c = t.cursor()
+    elapsed = time.time() - start
+    print "Dumped %d rows from %s in %.1f s (%.0f rows/s)." % (rows, source, elapsed, rows / max(elapsed, 1e-6))
+    return rows
 
-        c.execute("pragma synchronous = off;")
-        c.execute("pragma journal_mode=off;")
-        if where is None:
-            c.execute("select * from results join parameters;")
-        else:    
-           c.execute("select * from results join parameters where %s;" %where)
-        print("Writing rows.")
-        csv_writer = csv.writer(open(output, "a"))
-        csv_writer.writerows(c)
-        del csv_writer
-        c.close()
-        t.close()
+def dump_dbs(sources, target=None, columns=None, where=None, processes=None, size=10000, level=None):
+    """
+    Dump the dbs in sources to csv, several at once. With no target each db is
+    written beside itself as <db>.csv, otherwise the dbs are written to
+    temporary shards which are then joined, in order, into target. If level
+    is given the csv is gzipped at that level, using the cpus the processes
+    leave free, and <db>.csv.gz is written instead. Gzipped shards join into
+    a valid gzip file.
+    """
+    if len(sources) == 0:
+        return
+    start = time.time()
+    work = None
+    suffix = "csv" if level is None else "csv.gz"
+    if target is None:
+        outputs = ["%s.%s" % (source, suffix) for source in sources]
+    else:
+        work = tempfile.mkdtemp(prefix="dump_", dir=os.path.dirname(os.path.abspath(target)))
+        outputs = [os.path.join(work, "%d.%s" % (i, suffix)) for i in xrange(len(sources))]
+    processes = min(processes or multiprocessing.cpu_count(), len(sources))
+    threads = max(1, multiprocessing.cpu_count() // processes)
+    jobs = [(source, output, columns, where, target is None or i == 0, size, level, threads)
+        for i, (source, output) in enumerate(zip(sources, outputs))]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        rows = sum(pool.map(dump_db, jobs))
+        pool.close()
+        pool.join()
+    else:
+        rows = sum(map(dump_db, jobs))
+    if work is not None:
+        out = open(target, "wb")
+        for output in outputs:
+            shard = open(output, "rb")
+            shutil.copyfileobj(shard, out)
+            shard.close()
+        out.close()
+        shutil.rmtree(work)
+    elapsed = time.time() - start
+    print "Dumped %d rows from %d dbs in %.1f s (%.0f rows/s)." % (rows, len(sources), elapsed,
+        rows / max(elapsed, 1e-6))
 
 def list_matching(directory, name):
     matching = []
@@ -57,10 +112,10 @@ def list_matching(directory, name):
             matching.append("%s/%s" % (directory, file))
     return matching
 
- 
+
 def arguments():
     parser = argparse.ArgumentParser(
-        description='A simple SQLite db merger.')
+        description='Dump SQLite results dbs, joined to their parameters, to csv.')
     parser.add_argument('-d', type=str, nargs='?',
                    help='Directory to look for DBs to dump.', default=".",
                    dest="directory")
@@ -68,21 +123,32 @@ def arguments():
                    help='List of source filenames which may include wildcards.', default=["*.db"],
                    dest="files")
 
-    parser.add_argument('-t', type=str, nargs='*',
-                   help='Target CSV.', default=None,
+    parser.add_argument('-t', type=str, nargs='?',
+                   help='Target CSV for all the DBs. If omitted, each DB is dumped to <db>.csv.', default=None,
                    dest="target")
+    parser.add_argument('-c', type=str, nargs='*',
+                   help='Columns to dump, defaults to all of them.', default=None,
+                   dest="columns")
     parser.add_argument('-where', type=str, nargs='?',
         help='Optional argument to where.', dest="where",
         default=None)
+    parser.add_argument('-p', type=int, nargs='?',
+                   help='Number of dumping processes. Defaults to the number of cpus.', default=None,
+                   dest="processes")
+    parser.add_argument('-n', type=int, nargs='?',
+                   help='Number of rows to fetch at a time.', default=10000,
+                   dest="size")
+    parser.add_argument('-z', type=int, nargs='?',
+                   help='Gzip the csv at this compression level (1-9).', default=None,
+                   dest="level")
     args = parser.parse_args()
     files = []
     for f in args.files:
-        files.append(list_matching(args.directory, f))
-    return args.target, files, args.where
+        files += list_matching(args.directory, f)
+    return args.target, files, args.columns, args.where, args.processes, args.size, args.level
 
 
 if __name__ =="__main__":
-    target, files, where = arguments()
+    target, files, columns, where, processes, size, level = arguments()
     print "Dumping", files
-    pool = multiprocessing.Pool()
-    pool.map(lambda x: dump_db(where, target, x), files)
\ No newline at end of file
+    dump_dbs(files, target, columns, where, processes, size, level)
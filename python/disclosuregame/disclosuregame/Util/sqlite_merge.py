@@ -2,32 +2,152 @@ import sqlite3
 import fnmatch
 import os
 import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+def columns(c, table, db="main"):
+    return [row[1] for row in c.execute("pragma %s.table_info(%s);" % (db, table))]
+
+def schema(c, db="main", kind="table"):
+    """
+    Return the (name, sql) pairs for the tables, views or indexes of a db.
+    """
+    return c.execute("select name, sql from %s.sqlite_master where type = ? and sql is not null;" % db,
+        (kind,)).fetchall()
 
 def merge_db(target, source):
+    """
+    Append the results in source to target, giving them new ids. Parameter
+    rows are only added if no row with the same content (by hash) is there
+    already, and results are pointed at the matching row. Returns the number
+    of results added.
+    """
     t = sqlite3.connect(target)
     c = t.cursor()
 
     c.execute("pragma synchronous = off;")
     c.execute("pragma journal_mode=off;")
 
-    print("Attempting to merge " + source + ".")
     query = "attach '" + source + "' as toMerge;"
     c.execute(query)
-    c.execute("insert into results select * from toMerge.results;")
-    c.execute("insert or ignore into parameters select * from toMerge.parameters;")
-    c.execute("detach toMerge;")
+    fields = [x for x in columns(c, "results", "toMerge") if x != "id"]
+    param_fields = [x for x in columns(c, "parameters", "toMerge") if x != "param_id"]
+    c.execute("insert or ignore into parameters (%s) select %s from toMerge.parameters;" % (
+        ",".join(param_fields), ",".join(param_fields)))
+    if "param_id" in fields:
+        fields.remove("param_id")
+        c.execute("insert into results (param_id, %s) select p.param_id, %s from toMerge.results as r "
+            "left join toMerge.parameters as s on s.param_id = r.param_id "
+            "left join parameters as p on p.hash = s.hash;" % (
+            ",".join(fields), ",".join("r.%s" % x for x in fields)))
+    else:
+        # Results from before param_id hold the hash themselves
+        c.execute("insert into results (%s) select %s from toMerge.results;" % (
+            ",".join(fields), ",".join(fields)))
+    rows = c.rowcount
     t.commit()
+    c.execute("detach toMerge;")
     c.close()
     t.close()
+    return rows
+
+def indexes(source):
+    """
+    Return the (name, sql) pairs of the indexes of a db.
+    """
+    t = sqlite3.connect(source)
+    result = schema(t, kind="index")
+    t.close()
+    return result
+
+def drop_indexes(target):
+    t = sqlite3.connect(target)
+    for name, sql in schema(t, kind="index"):
+        t.execute("drop index %s;" % name)
+    t.commit()
+    t.close()
 
-def merge_dbs(sources, target=None):
+def create_indexes(target, indexes):
+    """
+    Make any of the indexes, as (name, sql) pairs, which target lacks.
+    """
+    t = sqlite3.connect(target)
+    existing = set(name for name, sql in schema(t, kind="index"))
+    for name, sql in indexes:
+        if name not in existing:
+            t.execute(sql)
+    t.commit()
+    t.close()
+
+def merge_group(job):
+    """
+    Merge a list of dbs into out, starting from a copy of the first unless it
+    is out already, and leaving out without indexes. Returns the number of
+    results merged.
+    """
+    sources, out = job
+    if sources[0] != out:
+        shutil.copyfile(sources[0], out)
+    drop_indexes(out)
+    rows = 0
+    for source in sources[1:]:
+        start = time.time()
+        merged = merge_db(out, source)
+        elapsed = time.time() - start
+        print "Merged %d results from %s in %.1f s (%.0f results/s)." % (
+            merged, source, elapsed, merged / max(elapsed, 1e-6))
+        rows += merged
+    return rows
+
+def count_results(source):
+    t = sqlite3.connect(source)
+    rows = t.execute("select count(*) from results;").fetchone()[0]
+    t.close()
+    return rows
+
+def merge_dbs(sources, target=None, processes=None):
+    """
+    Merge the dbs in sources into target, or into the first source if target
+    is None. The sources are split between processes, which each merge theirs
+    into one db, and those are then merged into target, so no result is copied
+    more than twice. Indexes are built once at the end. An existing target is
+    merged into, not replaced.
+    """
+    start = time.time()
     if target is None:
         target = sources[0]
-        sources = sources[1:]
+    elif os.path.exists(target):
+        sources = [target] + list(sources)
+    sources = [x for i, x in enumerate(sources) if x not in sources[:i]]
+    if len(sources) == 0:
+        return
+    wanted = indexes(sources[0])
+    total = sum(map(count_results, sources))
+    print "Merging %d dbs holding %d results." % (len(sources), total)
+
+    processes = min(processes or multiprocessing.cpu_count(), len(sources))
+    work = tempfile.mkdtemp(prefix="merge_", dir=os.path.dirname(os.path.abspath(target)))
+    outs = [target] + [os.path.join(work, "%d.db" % i) for i in xrange(1, processes)]
+    jobs = [(sources[i::processes], out) for i, out in enumerate(outs)]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        pool.map(merge_group, jobs)
+        pool.close()
+        pool.join()
     else:
-        clone_empty(sources[0], target)
-    for source in sources:
-        merge_db(target, source)
+        map(merge_group, jobs)
+    for out in outs[1:]:
+        merge_db(target, out)
+    shutil.rmtree(work)
+
+    index_start = time.time()
+    create_indexes(target, wanted)
+    elapsed = time.time() - start
+    print "Built indexes in %.1f s." % (time.time() - index_start)
+    print "Merged %d results into %s in %.1f s (%.0f results/s)." % (
+        total, target, elapsed, total / max(elapsed, 1e-6))
 
 def list_matching(directory, name):
     matching = []
@@ -37,6 +157,9 @@ def list_matching(directory, name):
     return matching
 
 def clone_empty(source, target):
+    """
+    Create the tables and views of source, but not its indexes, in target.
+    """
     t = sqlite3.connect(target)
     c = t.cursor()
 
@@ -45,13 +168,16 @@ def clone_empty(source, target):
 
     query = "attach '" + source + "' as toMerge;"
     c.execute(query)
-    c.execute("create table if not exists results as select * from toMerge.results where 0;")
-    c.execute("create table if not exists parameters as select * from toMerge.parameters where 0;")
+    existing = set(name for name, sql in schema(c) + schema(c, kind="view"))
+    for name, sql in schema(c, "toMerge") + schema(c, "toMerge", "view"):
+        if name not in existing:
+            c.execute(sql)
+    c.execute("pragma user_version = %d;" % c.execute("pragma toMerge.user_version;").fetchone()[0])
     c.execute("detach toMerge;")
     t.commit()
     c.close()
     t.close()
- 
+
 def arguments():
     parser = argparse.ArgumentParser(
         description='A simple SQLite db merger.')
@@ -65,14 +191,17 @@ def arguments():
     parser.add_argument('-t', type=str, nargs='?',
                    help='Optional target DB to merge into, will be created if necessary. If ommited, uses the first matched input db.', default=None,
                    dest="target")
+    parser.add_argument('-p', type=int, nargs='?',
+                   help='Number of merging processes. Defaults to the number of cpus.', default=None,
+                   dest="processes")
     args = parser.parse_args()
     files = []
     for f in args.files:
         files += list_matching(args.directory, f)
-    return args.target, files
+    return args.target, files, args.processes
 
 
 if __name__ =="__main__":
-    target, files = arguments()
+    target, files, processes = arguments()
     print "Merging", files
-    merge_dbs(files, target)
\ No newline at end of file
+    merge_dbs(files, target, processes)
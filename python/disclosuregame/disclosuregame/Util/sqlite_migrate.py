@@ -0,0 +1,133 @@
+import sqlite3
+import fnmatch
+import os
+import argparse
+import time
+from disclosuregame.results import (SCHEMA_VERSION, MISSING, appointment_field, schema_version,
+    table_columns, create_tables, create_indexes)
+
+def column_types(c, table, fields):
+    """
+    Return the SQLite type of each of a version 1 table's fields, found in one
+    pass over the table. Missing values are ignored, and columns with nothing
+    else in them are REAL.
+    """
+    counts = []
+    for field in fields:
+        counts.append("sum(typeof(%s) = 'integer')" % field)
+        counts.append("sum(typeof(%s) = 'real')" % field)
+        counts.append("sum(typeof(%s) in ('text', 'blob') and %s != '%s')" % (field, field, MISSING))
+    counts = c.execute("select %s from old.%s;" % (",".join(counts), table)).fetchone()
+    types = []
+    for i in xrange(len(fields)):
+        integers, reals, others = [x or 0 for x in counts[3*i:3*i + 3]]
+        if others > 0:
+            types.append("TEXT")
+        elif integers > 0 and reals == 0:
+            types.append("INTEGER")
+        else:
+            types.append("REAL")
+    return types
+
+def time_lookup(c, query, args):
+    start = time.time()
+    c.execute(query, args).fetchall()
+    return time.time() - start
+
+def migrate_db(source, keep=False):
+    """
+    Upgrade a version 1 results db in place, and return its size before and
+    after, and the time taken to fetch the results for one parameter set and
+    appointment before and after. If keep is True, the original is kept as
+    source.v1.
+    """
+    target = "%s.migrating" % source
+    if os.path.exists(target):
+        os.remove(target)
+    t = sqlite3.connect(target)
+    c = t.cursor()
+
+    c.execute("pragma synchronous = off;")
+    c.execute("pragma journal_mode=off;")
+
+    c.execute("attach '" + source + "' as old;")
+    fields = [x for x in table_columns(c, "results", "old") if x not in ("id", "hash")]
+    param_fields = [x for x in table_columns(c, "parameters", "old") if x != "hash"]
+    create_tables(c, fields, column_types(c, "results", fields),
+        param_fields, column_types(c, "parameters", param_fields), indexes=False)
+
+    c.execute("insert into parameters (%s, hash) select %s, hash from old.parameters;" % (
+        ",".join(param_fields), ",".join("nullif(%s, '%s')" % (x, MISSING) for x in param_fields)))
+    c.execute("insert into results (id, param_id, %s) select r.id, p.param_id, %s from old.results as r "
+        "left join parameters as p on p.hash = r.hash;" % (",".join(fields),
+        ",".join("nullif(r.%s, '%s')" % (x, MISSING) for x in fields)))
+    create_indexes(c, fields)
+    t.commit()
+
+    # Time fetching one parameter set's results at one appointment
+    key = appointment_field(fields)
+    sample = c.execute("select hash%s from old.results limit 1;" % (", %s" % key if key else "")).fetchone()
+    before = after = None
+    if sample is not None:
+        match = " and %s = ?" % key if key else ""
+        before = time_lookup(c, "select * from old.results where hash = ?%s;" % match, sample)
+        param_id = c.execute("select param_id from parameters where hash = ?;", sample[:1]).fetchone()
+        after = time_lookup(c, "select * from results where param_id = ?%s;" % match, param_id + sample[1:])
+    c.execute("detach old;")
+    c.close()
+    t.close()
+
+    old_size = os.path.getsize(source)
+    if keep:
+        os.rename(source, "%s.v1" % source)
+    os.rename(target, source)
+    return old_size, os.path.getsize(source), before, after
+
+def needs_migration(source):
+    """
+    True if the db holds results in an older layout.
+    """
+    t = sqlite3.connect(source)
+    try:
+        return schema_version(t) < SCHEMA_VERSION and "hash" in table_columns(t, "results")
+    finally:
+        t.close()
+
+def list_matching(directory, name):
+    matching = []
+    for file in os.listdir(directory):
+        if fnmatch.fnmatch(file, name):
+            matching.append("%s/%s" % (directory, file))
+    return matching
+
+def arguments():
+    parser = argparse.ArgumentParser(
+        description='Upgrade results DBs to the current schema.')
+    parser.add_argument('-d', type=str, nargs='?',
+                   help='Directory to look for DBs to upgrade.', default=".",
+                   dest="directory")
+    parser.add_argument('-f', type=str, nargs='*',
+                   help='List of source filenames which may include wildcards.', default=["*.db"],
+                   dest="files")
+    parser.add_argument('-k', action='store_true',
+                   help='Keep the original DBs, with .v1 appended to their names.',
+                   dest="keep")
+    args = parser.parse_args()
+    files = []
+    for f in args.files:
+        files += list_matching(args.directory, f)
+    return files, args.keep
+
+
+if __name__ =="__main__":
+    files, keep = arguments()
+    for source in files:
+        if not needs_migration(source):
+            print "Skipping " + source + ", already current."
+            continue
+        print("Upgrading " + source + ".")
+        old_size, new_size, before, after = migrate_db(source, keep)
+        print "Size %.1f MB -> %.1f MB (%.0f%% smaller)." % (old_size / 1e6, new_size / 1e6,
+            100. * (old_size - new_size) / old_size)
+        if before is not None:
+            print "Lookup of one parameter set and appointment %.4f s -> %.4f s." % (before, after)
@@ -24,6 +24,7 @@ import argparse
 from os.path import expanduser
 import cPickle
 import gzip, csv
+from array import array
 
 
 def scale_weights(weights, top):
@@ -59,8 +60,8 @@ def inject_type_belief(weights, num):
         target = random.sample(women, num)
         signals = [0, 1, 2]
         for agent in target:
-            agent.response_belief = dict([(signal, dict([(response, []) for response in [0, 1]])) for signal in signals])
-            agent.type_distribution = dict([(signal, []) for signal in signals])
+            agent.response_belief = agent.response_signal_dict(signals, [0, 1])
+            agent.type_distribution = array('d', [0.]*len(signals))
             agent.type_weights = weights
             agent.update_beliefs(None, None, None)
     return f
@@ -1,5 +1,11 @@
-import gzip
+import os
+import mmap
 import sqlite3
+import tempfile
+from array import array
+from itertools import izip, repeat
+from disclosuregame.Util import pack_value, unpack_value
+from disclosuregame.Util.gzipstream import GzipWriter
 try:
     import scoop
     scoop.worker
@@ -8,6 +14,81 @@ except:
     single_db = True
     pass
 
+# Version of the database layout written by ResultBuffer, kept as the db's
+# user_version. Version 1 dbs (user_version 0) keep the parameter hash string
+# on every result row, in untyped columns, and are upgraded by
+# Util/sqlite_migrate.py.
+SCHEMA_VERSION = 2
+# Measures return this for a missing value, which is stored as NULL
+MISSING = "NA"
+
+def write_csv(file_name, fields, rows, sep=",", level=9, threads=None):
+    """
+    Stream a header and rows to a gzipped csv file, compressed on threads.
+    """
+    file = GzipWriter(file_name, level, threads)
+    file.write(sep.join(fields))
+    for row in rows:
+        file.write("\n")
+        file.write(sep.join(map(str, row)))
+    file.close()
+
+def sql_type(values):
+    """
+    Return the SQLite column type for these values, ignoring missing ones.
+    """
+    kinds = set(type(value) for value in values if value is not None and value != MISSING)
+    if kinds <= set([int, long, bool]) and kinds:
+        return "INTEGER"
+    if kinds <= set([int, long, bool, float]):
+        return "REAL"
+    return "TEXT"
+
+def appointment_field(fields):
+    """
+    Return the field holding the appointment (or round), or None.
+    """
+    for name in ("appointment", "round"):
+        if name in fields:
+            return name
+    return None
+
+def schema_version(conn, db="main"):
+    return conn.execute("PRAGMA %s.user_version" % db).fetchone()[0]
+
+def table_columns(conn, table, db="main"):
+    """
+    Return the names of a table's columns, or an empty list if there is no
+    such table.
+    """
+    return [row[1] for row in conn.execute("PRAGMA %s.table_info(%s)" % (db, table))]
+
+def create_indexes(conn, fields):
+    """
+    Index results by parameter set and appointment.
+    """
+    key = appointment_field(fields)
+    columns = "param_id, %s" % key if key is not None else "param_id"
+    conn.execute("CREATE INDEX IF NOT EXISTS results_param ON results (%s)" % columns)
+
+def create_tables(conn, fields, field_types, param_fields, param_types, indexes=True):
+    """
+    Create the current layout: parameter sets keyed by an integer param_id
+    (and unique by hash), results referring to them, typed columns, and a
+    results_hashed view which joins the hash back on for older analyses.
+    Indexes may be left until the tables are filled.
+    """
+    columns = ", ".join("%s %s" % pair for pair in zip(param_fields, param_types))
+    conn.execute("CREATE TABLE IF NOT EXISTS parameters (param_id INTEGER PRIMARY KEY, %s, hash TEXT UNIQUE)" % columns)
+    columns = ", ".join("%s %s" % pair for pair in zip(fields, field_types))
+    conn.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, "
+        "param_id INTEGER REFERENCES parameters (param_id), %s)" % columns)
+    if indexes:
+        create_indexes(conn, fields)
+    conn.execute("CREATE VIEW IF NOT EXISTS results_hashed AS SELECT results.*, parameters.hash AS hash "
+        "FROM results LEFT JOIN parameters USING (param_id)")
+    conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
 class Result(object):
     def __init__(self, fields, parameters, results):
         fields.append("hash")
@@ -25,26 +106,18 @@ class Result(object):
         self.results += results.results
         return self
 
-    def write(self, file_name, sep=","):
+    def write(self, file_name, sep=",", level=9, threads=None):
         """
         Write a results to a (csv) file.
         """
         if not single_db:
             file_name = "%s_%s" % (scoop.worker[0], file_name)
-        result = [sep.join(self.fields)]
-        result += map(lambda l: sep.join(map(str, l)), self.results)
-        file = gzip.open(file_name, "w")
-        file.write("\n".join(result))
-        file.close()
+        write_csv(file_name, self.fields, self.results, sep, level, threads)
     
-    def write_params(self, file_name, sep=","):
+    def write_params(self, file_name, sep=",", level=9, threads=None):
         if not single_db:
             file_name = "%s_%s" % (scoop.worker[0], file_name)
-        result = [sep.join(self.param_fields)]
-        result += map(lambda l: sep.join(map(str, l)), self.parameters.values())
-        file = gzip.open(file_name, "w")
-        file.write("\n".join(result))
-        file.close()
+        write_csv(file_name, self.param_fields, self.parameters.values(), sep, level, threads)
 
     def write_db(self, db_name):
         """
@@ -78,3 +151,315 @@ class Result(object):
         conn.commit()
         conn.close()
 
+
+def column_typecode(values):
+    """
+    Return the smallest array typecode which holds all of these values
+    exactly, or None if they are not all ints or all floats.
+    """
+    kinds = set(map(type, values))
+    if kinds == set([float]):
+        return 'd'
+    if kinds == set([int]):
+        low, high = min(values), max(values)
+        for typecode in INT_TYPECODES:
+            limit = 2**(8*array(typecode).itemsize - 1)
+            if -limit <= low and high < limit:
+                return typecode
+    return None
+
+# Integer typecodes, narrowest first
+INT_TYPECODES = 'bhil'
+
+def wider_typecode(a, b):
+    """
+    Return a typecode for a column holding values of typecodes a and b, or
+    None if it must hold them as they are.
+    """
+    if a is None or b is None:
+        return None
+    if a == b:
+        return a
+    if a in INT_TYPECODES and b in INT_TYPECODES:
+        return max(a, b, key=INT_TYPECODES.index)
+    return None
+
+
+class ResultBuffer(object):
+    """
+    Append-only results for one game, held by column. The schema and the
+    parameters are fixed when the buffer is made, and the parameter hash is
+    only computed once. Rows are staged, and moved into the columns a block
+    at a time. A column of ints or floats is kept in the narrowest typed array
+    that holds it, until a value of another type turns up. Columns grow
+    geometrically.
+    """
+    # Rows staged before they are moved into the columns
+    block = 256
+
+    def __init__(self, fields, parameters):
+        self.fields = list(fields) + ["hash"]
+        self.param_fields = parameters.keys() + ["hash"]
+        self.param_hash = "h%d" % hash(tuple(parameters.values()))
+        self.parameters = {self.param_hash:parameters.values() + [self.param_hash]}
+        self.columns = [None]*(len(self.fields) - 1)
+        self.pending = []
+        self.size = 0
+        self.capacity = 0
+
+    def __len__(self):
+        return self.size + len(self.pending)
+
+    def append(self, row):
+        """
+        Add a row of measures, without the hash.
+        """
+        self.pending.append(row)
+        if len(self.pending) >= self.block:
+            self.flush()
+
+    def flush(self):
+        """
+        Move the staged rows into the columns.
+        """
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        size = self.size
+        end = size + len(pending)
+        if end > self.capacity:
+            self.capacity = max(2*self.capacity, end)
+        for i, values in enumerate(izip(*pending)):
+            column = self.columns[i]
+            typecode = column_typecode(values)
+            if column is None:
+                current = typecode
+            elif type(column) is list:
+                current = None
+            else:
+                current = column.typecode
+            if current is not None:
+                current = wider_typecode(current, typecode)
+            if column is None:
+                column = array(current, [0])*self.capacity if current else [None]*self.capacity
+            elif current is None and type(column) is not list:
+                column = list(column)
+            elif current is not None and current != column.typecode:
+                column = array(current, column)
+            if len(column) < self.capacity:
+                column.extend(column[:self.capacity - len(column)])
+            if current is None:
+                column[size:end] = values
+            else:
+                column[size:end] = array(current, values)
+            self.columns[i] = column
+        self.size = end
+
+    def add_results(self, results):
+        """
+        Append the rows of another buffer for the same game.
+        """
+        if results.param_hash != self.param_hash or results.fields != self.fields:
+            raise ValueError("Can only add results with the same fields and parameters.")
+        for row in results.rows():
+            self.append(row[:-1])
+        return self
+
+    def rows(self):
+        """
+        Return an iterator over the rows as tuples, ending with the hash.
+        """
+        self.flush()
+        if self.size == 0:
+            return iter([])
+        size = self.size
+        param_hash = self.param_hash
+        return (row + (param_hash,) for row in izip(*[column[:size] for column in self.columns]))
+
+    @property
+    def results(self):
+        """
+        The rows as lists, as Result holds them.
+        """
+        return map(list, self.rows())
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        state['columns'] = [None if column is None else pack_value(column[:self.size])
+            for column in self.columns]
+        state['capacity'] = self.size
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.columns = [None if column is None else unpack_value(column) for column in self.columns]
+
+    def nbytes(self):
+        """
+        The number of bytes the typed columns' values take.
+        """
+        self.flush()
+        return sum(column.itemsize * self.size for column in self.columns if type(column) is array)
+
+    def share(self, directory=None):
+        """
+        Move the typed columns into a shared block, and return the
+        SharedResult describing them.
+        """
+        return SharedResult(self, directory)
+
+    def write(self, file_name, sep=",", level=9, threads=None):
+        """
+        Write a results to a (csv) file, streaming rows to gzip members which
+        are compressed at level on threads threads (one per cpu by default).
+        """
+        if not single_db:
+            file_name = "%s_%s" % (scoop.worker[0], file_name)
+        write_csv(file_name, self.fields, self.rows(), sep, level, threads)
+
+    def write_params(self, file_name, sep=",", level=9, threads=None):
+        if not single_db:
+            file_name = "%s_%s" % (scoop.worker[0], file_name)
+        write_csv(file_name, self.param_fields, self.parameters.values(), sep, level, threads)
+
+    def field_types(self):
+        """
+        Return the SQLite type of each measure column.
+        """
+        self.flush()
+        types = []
+        for column in self.columns:
+            if column is None:
+                types.append("REAL")
+            elif type(column) is list:
+                types.append(sql_type(column[:self.size]))
+            else:
+                types.append("REAL" if column.typecode == 'd' else "INTEGER")
+        return types
+
+    def db_rows(self, param_id):
+        """
+        Return an iterator over the rows as stored: the param_id, then the
+        measures with missing values as None.
+        """
+        self.flush()
+        size = self.size
+        if size == 0:
+            return iter([])
+        columns = []
+        for column in self.columns:
+            column = column[:size]
+            if type(column) is list:
+                column = [None if value == MISSING else value for value in column]
+            columns.append(column)
+        return izip(repeat(param_id, size), *columns)
+
+    def write_db(self, db_name):
+        """
+        Write this result set to an sqlite db, creating the tables if needed.
+        """
+        if not single_db:
+            db_name = "%s_%s" % (db_name, scoop.worker[0])
+
+        conn = sqlite3.connect("%s.db" % db_name)
+        if schema_version(conn) != SCHEMA_VERSION:
+            if table_columns(conn, "results"):
+                conn.close()
+                raise ValueError("%s.db uses an older schema, upgrade it with sqlite_migrate." % db_name)
+            values = self.parameters[self.param_hash][:-1]
+            create_tables(conn, self.fields[:-1], self.field_types(),
+                self.param_fields[:-1], [sql_type([value]) for value in values])
+
+        placeholders = ",".join(['?']*len(self.param_fields))
+        insert = "INSERT OR IGNORE INTO parameters (%s) VALUES (%s)" % (",".join(self.param_fields), placeholders)
+        conn.execute(insert, self.parameters[self.param_hash])
+        param_id = conn.execute("SELECT param_id FROM parameters WHERE hash = ?", (self.param_hash,)).fetchone()[0]
+
+        fields = self.fields[:-1]
+        placeholders = ",".join(['?']*(len(fields) + 1))
+        insert = "INSERT INTO results (param_id, %s) VALUES (%s)" % (",".join(fields), placeholders)
+        conn.executemany(insert, self.db_rows(param_id))
+        conn.commit()
+        conn.close()
+
+def shared_directory():
+    """
+    Return a directory for blocks handed between processes, which is held in
+    memory if the system has one.
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+class SharedResult(object):
+    """
+    A ResultBuffer whose typed columns have been copied, as raw bytes, into a
+    block shared through a file in directory (shared_directory() if None).
+    Only the rest is pickled, so it crosses a queue in a few hundred bytes
+    however many rows there are. load maps the block, rebuilds the buffer,
+    and removes the block.
+    """
+    def __init__(self, results, directory=None):
+        results.flush()
+        size = results.size
+        self.state = results.__dict__.copy()
+        self.state['pending'] = []
+        self.state['capacity'] = size
+        del self.state['columns']
+        self.nbytes = results.nbytes()
+        self.name = None
+        # Typed columns are ('s', typecode, offset, length) in the block,
+        # and anything else is packed as for pickling
+        self.layout = []
+        if self.nbytes:
+            fd, self.name = tempfile.mkstemp(prefix="result_", dir=directory or shared_directory())
+            block = os.fdopen(fd, "wb")
+        offset = 0
+        for column in results.columns:
+            if type(column) is array:
+                length = column.itemsize * size
+                block.write(buffer(column, 0, length))
+                self.layout.append(('s', column.typecode, offset, length))
+                offset += length
+            else:
+                self.layout.append(None if column is None else pack_value(column[:size]))
+        if self.nbytes:
+            block.close()
+
+    def load(self):
+        """
+        Return the ResultBuffer, and free the block.
+        """
+        results = ResultBuffer.__new__(ResultBuffer)
+        results.__dict__.update(self.state)
+        mapping = None
+        if self.name is not None:
+            block = open(self.name, "rb")
+            mapping = mmap.mmap(block.fileno(), 0, access=mmap.ACCESS_READ)
+            block.close()
+        columns = []
+        for entry in self.layout:
+            if entry is None:
+                columns.append(None)
+            elif entry[0] == 's':
+                typecode, offset, length = entry[1:]
+                column = array(typecode)
+                column.fromstring(buffer(mapping, offset, length))
+                columns.append(column)
+            else:
+                columns.append(unpack_value(entry))
+        results.columns = columns
+        if mapping is not None:
+            mapping.close()
+        self.release()
+        return results
+
+    def release(self):
+        """
+        Remove the block.
+        """
+        if self.name is not None:
+            os.remove(self.name)
+            self.name = None
@@ -14,11 +14,19 @@ from disclosuregame.Measures import *
 from disclosuregame.Measures.abstract import *
 
 from disclosuregame.experiments import *
+from disclosuregame.Util.priors import PriorPool, batch_priors as make_priors
+from disclosuregame.results import SharedResult, shared_directory
+from disclosuregame.Util.spillqueue import SpillQueue
+from disclosuregame.Util.sqlite_merge import merge_dbs
 
 import multiprocessing
+import Queue
 import itertools
 from collections import OrderedDict
 import argparse
+import os
+import shutil
+import tempfile
 from os.path import expanduser
 import cPickle
 import pickle
@@ -107,6 +115,24 @@ def arguments():
         'info', 'warniing', 'error'], default='info', nargs="?")
     parser.add_argument('--log-file', dest='log_file', type=str, default='')
     parser.add_argument('--tag', dest='tag', type=str, default='')
+    parser.add_argument('--batch-priors', dest='batch_priors', action="store_true",
+        help="Generate women's priors in batches, which is faster but draws differently to the default.",
+        default=False)
+    parser.add_argument('--rw-population', dest='rw_population', action="store_true",
+        help="Play rounds between RWSignallers and RWResponders in carrying games a population at a time.",
+        default=False)
+    parser.add_argument('--queue-memory', dest='queue_memory', type=float, default=128,
+        help="Megabytes of finished results to hold in memory while they wait to be written, beyond which they are spilled to temporary files.")
+    parser.add_argument('--spill-directory', dest='spill_dir', type=str, default=None,
+        help="Local directory to spill waiting results to. Defaults to the system's temporary directory.")
+    parser.add_argument('--sharded', dest='sharded', action="store_true",
+        help="Have every worker write its own dbs, which are merged at the end, instead of sending results to one writer.",
+        default=False)
+    parser.add_argument('--processes', dest='processes', type=int, default=None,
+        help="Number of worker processes. Defaults to the number of cpus.")
+    parser.add_argument('--shared-results', dest='shared', action="store_true",
+        help="Hand results to the writer in shared memory blocks instead of pickling them.",
+        default=False)
 
     args = parser.parse_args()
 
@@ -128,7 +154,8 @@ def arguments():
         players = list(itertools.product(map(eval, set(args.signallers)), map(eval, set(args.responders))))
     else:
         players = zip(map(eval, args.signallers), map(eval, args.responders))
-    kwargs = {'runs':args.runs, 'rounds':args.rounds, 'nested':False, 'file_name':file_name, 'tag':args.tag}
+    kwargs = {'runs':args.runs, 'rounds':args.rounds, 'nested':False, 'file_name':file_name, 'tag':args.tag,
+        'batch_priors':args.batch_priors, 'rw_population':args.rw_population}
     if args.women is not None:
         kwargs['women_weights'] = args.women
     #if args.indiv:
@@ -153,7 +180,9 @@ def arguments():
         except cPickle.UnpicklingError:
             logger.info("Not a valid pickle file.")
             raise
-    return games, players, kwargs, args.runs, args.test_only, file_name
+    run_args = {'queue_args':{'limit':int(args.queue_memory * 1e6), 'directory':args.spill_dir},
+        'sharded':args.sharded, 'num_consumers':args.processes, 'shared':args.shared}
+    return games, players, kwargs, args.runs, args.test_only, file_name, run_args
 
 
 def make_players(constructor, num=100, weights=[1/3., 1/3., 1/3.], nested=False,
@@ -214,7 +243,8 @@ def decision_fn_compare(signaller_fn=BayesianSignaller, responder_fn=BayesianRes
     runs=1, game=None, rounds=100,
     mw_weights=[80/100., 15/100., 5/100.], women_weights=[1/3., 1/3., 1/3.], women_priors=None, seeds=None,
     women_modifier=None, measures_women=measures_women(), measures_midwives=measures_midwives(),
-    nested=False, mw_priors=None, file_name="", responder_args={}, signaller_args={}, tag=""):
+    nested=False, mw_priors=None, file_name="", responder_args={}, signaller_args={}, tag="",
+    batch_priors=False, rw_population=False):
 
     if game is None:
         game = Game()
@@ -225,6 +255,7 @@ def decision_fn_compare(signaller_fn=BayesianSignaller, responder_fn=BayesianRes
     game.measures_women = measures_women
     game.signaller_args = signaller_args
     game.responder_args = responder_args
+    game.rw_population = rw_population
     params = params_dict(str(signaller_fn()), str(responder_fn()), mw_weights, women_weights, game, rounds,
         signaller_args, responder_args, tag)
     for key, value in params.items():
@@ -245,6 +276,8 @@ def decision_fn_compare(signaller_fn=BayesianSignaller, responder_fn=BayesianRes
         game.random = Random(seeds[i])
         try:
           game.player_random = Random(game.random.random())
+          if batch_priors:
+              game.prior_pool = PriorPool(game.player_random)
         except AttributeError:
           pass
           
@@ -254,10 +287,13 @@ def decision_fn_compare(signaller_fn=BayesianSignaller, responder_fn=BayesianRes
         #Make players and initialise beliefs
         women = make_players(signaller_fn, num=num_women, weights=women_weights, nested=nested, player_args=signaller_args, random=random)
         #logger.info "made %d women." % len(women)
+        priors = women_priors
+        if priors is None and batch_priors:
+            priors = make_priors(len(women), random)
         for j in range(len(women)):
             woman = women[j]
-            if women_priors is not None:
-                woman.init_payoffs(game.woman_baby_payoff, game.woman_social_payoff, women_priors[j][0], women_priors[j][1])
+            if priors is not None:
+                woman.init_payoffs(game.woman_baby_payoff, game.woman_social_payoff, priors[j][0], priors[j][1])
             else:
                 woman.init_payoffs(game.woman_baby_payoff, game.woman_social_payoff, random_expectations(random=random), [random_expectations(breadth=2, random=random) for x in range(3)])
         if women_modifier is not None:
@@ -303,58 +339,100 @@ def make_work(queue, kwargs, num_consumers, kill_queue):
     queue.put(None)
 
 
-def do_work(queueIn, queueOut, kill_queue):
+def share_results(res, queue, directory):
     """
-    Consume games, play them, then put their results in the output queue.
+    Move a game's results into shared blocks in directory, if the queue has
+    room to count them against its memory limit, so that only their
+    descriptions are pickled. Otherwise return them as they are.
+    """
+    if not queue.reserve(sum(x.nbytes() for x in res)):
+        return res
+    return tuple(x.share(directory) for x in res)
+
+def stop_run(kill_queue):
+    """
+    Tell every process to stop, unless another already has.
+    """
+    try:
+        kill_queue.put_nowait(None)
+    except Queue.Full:
+        pass
+
+def do_work(queueIn, queueOut, kill_queue, shard=None, shared=None):
+    """
+    Consume games, play them, then put their results in the output queue,
+    or write them to the shard's own dbs if it has one. If shared is a
+    directory, results are handed over in shared blocks there.
     """
     while True:
         try:
             if not kill_queue.empty():
                 break
-            number, config = queueIn.get()
+            item = queueIn.get()
+            if item is None:
+                break
+            number, config = item
             logger.info("Running game %d." % number)
-            res = (number, play_game(config))
-            queueOut.put(res)
+            res = play_game(config)
+            if shard is not None:
+                try:
+                    write_result(number, res, shard)
+                except:
+                    stop_run(kill_queue)
+                    raise
+            elif shared is not None:
+                queueOut.put((number, share_results(res, queueOut, shared)))
+            else:
+                queueOut.put((number, res))
             del config
         except MemoryError:
             raise
             break
         except AssertionError:
-            kill_queue.put(None)
+            stop_run(kill_queue)
             raise
             break
-        except TypeError:
-            break
         except:
             raise
             break
     logger.info("Done.")
 
+def write_result(number, res, db_name):
+    """
+    Write a game's results to the women's and midwives' dbs for db_name.
+    """
+    women_res, mw_res = res
+    logger.info("Writing game %d." % number)
+    women_res.write_db("%s_women" % db_name)
+    mw_res.write_db("%s_mw" % db_name)
+
 def write(queue, db_name, kill_queue):
     while True:
         try:
-            number, res = queue.get()
-            #print res
-            women_res, mw_res = res
-            logger.info("Writing game %d." % number)
-            women_res.write_db("%s_women" % db_name)
-            mw_res.write_db("%s_mw" % db_name)
-            del women_res
-            del mw_res
+            item = queue.get()
+            if item is None:
+                break
+            number, res = item
+            if type(res[0]) is SharedResult:
+                size = sum(x.nbytes for x in res)
+                res = [x.load() for x in res]
+                queue.release(size)
+            write_result(number, res, db_name)
+            del res
         except sqlite3.OperationalError as e:
             print e
-            kill_queue.put(None)
+            stop_run(kill_queue)
             raise
             break
         except:
-            kill_queue.put(None)
+            stop_run(kill_queue)
             raise
             break
 
 
 def experiment(file_name, game_fns=[Game, CaseloadGame], 
     agents=[(ProspectTheorySignaller, ProspectTheoryResponder), (BayesianSignaller, BayesianResponder)],
-    kwargs=[{}]):
+    kwargs=[{}], queue_args={}, sharded=False, num_consumers=None, shared=False):
     run_params = []
     for pair in agents:
         for game_fn in game_fns:
@@ -366,23 +444,56 @@ def experiment(file_name, game_fns=[Game, CaseloadGame],
                 arg['signaller_fn'] = pair[0]
                 arg['responder_fn'] = pair[1]
                 run_params.append(arg)
-    kw_experiment(run_params, file_name)
+    kw_experiment(run_params, file_name, queue_args, sharded, num_consumers, shared)
+
+def shard_names(db_name, num_consumers):
+    return ["%s_shard%d" % (db_name, i) for i in range(num_consumers)]
 
-def kw_experiment(kwargs, file_name):
+def consolidate(db_name, shards):
+    """
+    Merge the shards' dbs into the women's and midwives' dbs for db_name, and
+    remove them.
+    """
+    for kind in ("women", "mw"):
+        sources = [x for x in ("%s_%s.db" % (shard, kind) for shard in shards) if os.path.exists(x)]
+        if sources:
+            merge_dbs(sources, "%s_%s.db" % (db_name, kind))
+        for source in sources:
+            os.remove(source)
+
+def kw_experiment(kwargs, file_name, queue_args={}, sharded=False, num_consumers=None, shared=False):
     """
     Run a bunch of experiments in parallel. Experiments are
     defined by a list of keyword argument dictionaries.
+    Finished results wait to be written in a SpillQueue made with
+    queue_args, so a slow writer can't run the node out of memory.
+    If sharded is True there is no writer, and each worker writes its
+    own dbs, which are merged once all the games are played. If shared
+    is True, results go to the writer in shared memory blocks.
     """
-    num_consumers = multiprocessing.cpu_count()
+    if num_consumers is None:
+        num_consumers = multiprocessing.cpu_count()
     #Make tasks
     jobs = multiprocessing.Queue(num_consumers)
     kill_queue = multiprocessing.Queue(1)
-    results = multiprocessing.Queue()
+    if sharded:
+        results = writProc = None
+        shards = shard_names(file_name, num_consumers)
+        for shard in shards:
+            for kind in ("women", "mw"):
+                if os.path.exists("%s_%s.db" % (shard, kind)):
+                    logger.warning("Removing stale shard %s_%s.db." % (shard, kind))
+                    os.remove("%s_%s.db" % (shard, kind))
+    else:
+        results = SpillQueue(**queue_args)
+        shards = [None]*num_consumers
+    blocks = tempfile.mkdtemp(prefix="blocks_", dir=shared_directory()) if shared and not sharded else None
     producer = multiprocessing.Process(target = make_work, args = (jobs, kwargs, num_consumers, kill_queue))
     producer.start()
-    calcProc = [multiprocessing.Process(target = do_work , args = (jobs, results, kill_queue)) for i in range(num_consumers)]
-    writProc = multiprocessing.Process(target = write, args = (results, file_name, kill_queue))
-    writProc.start()
+    calcProc = [multiprocessing.Process(target = do_work , args = (jobs, results, kill_queue, shard, blocks)) for shard in shards]
+    if not sharded:
+        writProc = multiprocessing.Process(target = write, args = (results, file_name, kill_queue))
+        writProc.start()
 
     for p in calcProc:
         p.start()
@@ -393,19 +504,32 @@ def kw_experiment(kwargs, file_name):
             for p in calcProc:
                 p.terminate()
             producer.terminate()
-            writProc.terminate()
+            if not sharded:
+                writProc.terminate()
+                results.close()
+            if blocks is not None:
+                shutil.rmtree(blocks, ignore_errors=True)
             sys.exit(1)
-    results.put(None)
-    writProc.join()
+    if sharded:
+        consolidate(file_name, shards)
+    else:
+        results.put(None)
+        writProc.join()
+        results.close()
+    if blocks is not None:
+        shutil.rmtree(blocks, ignore_errors=True)
     while True:
         if jobs.get() is None:
             break
         print "waiting.."
     producer.join()
+    failed = [p for p in calcProc + [writProc] if p is not None and p.exitcode != 0]
+    if failed:
+        raise RuntimeError("%d processes failed, so results are incomplete." % len(failed))
 
 
 def main():
-    games, players, kwargs, runs, test, file_name = arguments()
+    games, players, kwargs, runs, test, file_name, run_args = arguments()
     logger.info("Version %f" % version)
     logger.info("Running %d game type%s, with %d player pair%s, and %d run%s of each." % (
         len(games), "s"[len(games)==1:], len(players), "s"[len(players)==1:], runs, "s"[runs==1:]))
@@ -415,7 +539,7 @@ def main():
         logger.info("This is a test of the emergency broadcast system. This is only a test.")
     else:
         start = time.clock()
-        experiment(file_name, games, players, kwargs=kwargs)
+        experiment(file_name, games, players, kwargs=kwargs, **run_args)
         print "Ran in %f" % (time.clock() - start)
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import unittest
+from collections import OrderedDict
+from disclosuregame.Agents.bayes import BayesianSignaller, BayesianResponder
+from disclosuregame.Games.carrying import CarryingGame
+from disclosuregame.Measures.abstract import HonestyMeasure, RefCount, abstract_measures_women
+from disclosuregame.Measures.measures import Measure, Measures
+from disclosuregame.run import decision_fn_compare
+from disclosuregame.Util import Bitmap
+
+class Cumulative(Measure):
+    """
+    The per-counter cumulative measure the histogram replaced, summing one
+    counter per appointment.
+    """
+    incremental = True
+
+    def __init__(self, counter, player_type, signal):
+        super(Cumulative, self).__init__(player_type, None, signal)
+        counted = Bitmap()
+        self.counters = [counter(player_type, None, x + 1, counted) for x in range(signal)]
+
+    def update(self, roundnum, women, game):
+        for counter in self.counters:
+            counter.update(roundnum, women, game)
+
+    def measure(self, roundnum, women, game):
+        return sum(map(lambda x: x.measure(roundnum, women, game), self.counters))
+
+class TestAppointmentHistogram(unittest.TestCase):
+    def play(self, measures):
+        game = CarryingGame()
+        kw = dict(signaller_fn=BayesianSignaller, responder_fn=BayesianResponder, num_midwives=10,
+            num_women=40, game=game, rounds=100, measures_women=measures, measures_midwives=Measures(OrderedDict()))
+        for g, w, m in decision_fn_compare(**kw):
+            return g.play_game((w, m))[0]
+
+    def test_against_counters(self):
+        """
+        Columns match the per-counter measures every round, and on the dumps
+        made for each birth.
+        """
+        new = abstract_measures_women()
+        new.dump_every = 1
+        measures = OrderedDict(new.measures)
+        for i in range(3):
+            for j in range(1, 12):
+                measures["old_%d_%d_ref" % (i, j)] = Cumulative(RefCount, i, j)
+                measures["old_%d_%d_honesty" % (i, j)] = Cumulative(HonestyMeasure, i, j)
+        results = self.play(Measures(measures, dump_every=1))
+        fields = results.fields
+        births = 0
+        for row in results.results:
+            row = dict(zip(fields, row))
+            births += row['round'] == 100
+            for i in range(3):
+                for j in range(1, 12):
+                    self.assertEqual(row["type_%d_round_%d_ref" % (i, j)], row["old_%d_%d_ref" % (i, j)])
+                    self.assertEqual(row["type_%d_round_%d_honesty" % (i, j)], row["old_%d_%d_honesty" % (i, j)])
+        # The game must have birthed women, referred some and seen honesty
+        self.assertTrue(births > 0)
+        self.assertTrue(sum(row['type_%d_round_11_ref' % i] for i in range(3)) > 0)
+        self.assertTrue(sum(row['type_%d_round_11_honesty' % i] for i in range(3)) > 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+import unittest
+from disclosuregame.results import ResultBuffer
+from disclosuregame.Util import columnar
+
+@unittest.skipUnless(columnar.numpy_on, "needs numpy")
+class TestReadColumns(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_name = os.path.join(self.directory, "results")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, values, seed):
+        results = ResultBuffer(["value"], {"game": "Game", "seed": seed})
+        for value in values:
+            results.append([value])
+        results.write_db(self.db_name)
+
+    def test_reals_after_integers(self):
+        """
+        A column declared INTEGER by the first game keeps later games' reals.
+        """
+        self.write([1, 2], 0)
+        self.write([0.5, 2.75], 1)
+        values = columnar.read_columns("%s.db" % self.db_name, ["value"])["value"]
+        self.assertEqual(sorted(values), [0.5, 1, 2, 2.75])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from random import Random
+from disclosuregame.Util.gzipstream import GzipWriter
+
+class TestGzipWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, "out.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with gzip.open(self.file_name, "rb") as f:
+            return f.read()
+
+    def check(self, parts, threads, block=64):
+        """
+        Parts written, with the given threads and block size, read back as one
+        stream. Returns the number of members written.
+        """
+        with GzipWriter(self.file_name, threads=threads, block=block) as writer:
+            for part in parts:
+                writer.write(part)
+        self.assertEqual(self.read(), "".join(parts))
+        return writer.members
+
+    def lines(self, num):
+        random = Random(1)
+        return ["%d,%f,NA\n" % (i, random.random()) for i in xrange(num)]
+
+    def test_members(self):
+        """
+        Many members, more than the threads can hold at once, are read in order.
+        """
+        for threads in (1, 3):
+            self.assertTrue(self.check(self.lines(500), threads) > 6*threads)
+
+    def test_large_write(self):
+        """
+        A write larger than a block is one member of its own.
+        """
+        parts = ["a"*10, "b"*1000, "c"*10]
+        self.assertEqual(self.check(parts, 2, block=100), 2)
+
+    def test_empty_writes(self):
+        self.assertEqual(self.check(["", "abc", "", ""], 2, block=3), 1)
+
+    def test_empty_file(self):
+        """
+        A file with nothing written is still a valid gzip, of one empty member.
+        """
+        for threads in (1, 2):
+            self.assertEqual(self.check([], threads), 0)
+            self.assertTrue(os.path.getsize(self.file_name) > 0)
+            self.assertEqual(self.check([""], threads), 0)
+
+    def test_close_twice(self):
+        writer = GzipWriter(self.file_name, threads=2)
+        writer.write("abc")
+        writer.close()
+        writer.close()
+        self.assertEqual(self.read(), "abc")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from random import Random
+from disclosuregame.Measures.measures import ConfusionCounts, FalseNegativeUpto, FalsePositive, \
+    FalsePositiveUpto, RightCallUpto, SignalChange, TypedFalseNegativeUpto
+from disclosuregame.results import MISSING
+from disclosuregame.Util import new_log
+
+class Player(object):
+    signals = [0, 1, 2]
+    responses = [0, 1]
+
+    def __init__(self, player_type=0, window=None):
+        self.player_type = player_type
+        self.started = 0
+        self.signal_log = new_log('b', window)
+        self.response_log = new_log('b', window)
+        self.type_log = new_log('b', window)
+
+class TestRoundIndexed(unittest.TestCase):
+    def test_signal_change(self):
+        woman = Player()
+        woman.signal_log.extend([0, 1, 2, 0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual(SignalChange(player_type=0).measure(2, [woman], None), 1.)
+
+    def test_trimmed_signal_change(self):
+        """
+        A round a bounded log has discarded gives NA, not a later round.
+        """
+        woman = Player(window=4)
+        woman.signal_log.extend([0, 1, 2, 0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual(SignalChange(player_type=0).measure(2, [woman], None), MISSING)
+        self.assertEqual(SignalChange(player_type=0).measure(9, [woman], None), -2.)
+
+    def test_trimmed_false_positive(self):
+        midwife = Player(window=4)
+        midwife.response_log.extend([1]*10)
+        midwife.type_log.extend([0]*10)
+        self.assertEqual(FalsePositive().measure(1, [midwife], None), MISSING)
+        self.assertEqual(FalsePositive().measure(9, [midwife], None), 1.)
+
+class TestConfusionCounts(unittest.TestCase):
+    def play(self, midwife, counts, rounds, random, lag=None):
+        """
+        Log rounds random responses, reading the counts over all but the last
+        lag of them after each, or just bringing the counts up to date.
+        """
+        history = []
+        for i in xrange(rounds):
+            response, player = random.randint(0, 1), random.randint(0, 2)
+            midwife.response_log.append(response)
+            midwife.type_log.append(player)
+            history.append((response, player))
+            if lag is None:
+                counts.update(midwife)
+            else:
+                counts.counts(midwife, max(i + 1 - lag, 0))
+        return history
+
+    def expected(self, history, n):
+        rows = [[0]*3 for x in range(2)]
+        for response, player in history[:n]:
+            rows[response][player] += 1
+        return rows
+
+    def test_bounded_logs(self):
+        """
+        Counts follow the whole history while the logs are trimmed and regrow,
+        as long as they are read before the entries they need are discarded.
+        """
+        midwife = Player(window=8)
+        counts = ConfusionCounts(2, 3)
+        history = self.play(midwife, counts, 100, Random(1), lag=5)
+        self.assertTrue(midwife.response_log.trimmed > 0)
+        for n in (100, 95, 97, None):
+            self.assertEqual(map(list, counts.counts(midwife, n)), self.expected(history, n))
+        self.assertEqual(counts.counts(midwife, 10), None)
+        self.assertEqual(map(list, counts.counts(midwife, 98)), self.expected(history, 98))
+
+    def test_fixed_size(self):
+        """
+        Only two sets of counts are held, however long the logs grow.
+        """
+        midwife = Player()
+        counts = ConfusionCounts(2, 3)
+        history = self.play(midwife, counts, 500, Random(1), lag=3)
+        self.assertEqual((len(counts.current), len(counts.marked)), (counts.size, counts.size))
+        for n in (500, 250, 497, 3, 0):
+            self.assertEqual(map(list, counts.counts(midwife, n)), self.expected(history, n))
+
+    def test_discarded_before_counted(self):
+        midwife = Player(window=4)
+        counts = ConfusionCounts(2, 3)
+        self.play(midwife, counts, 10, Random(1))
+        midwife.response_log.extend([0]*10)
+        midwife.type_log.extend([0]*10)
+        self.assertEqual(counts.counts(midwife), None)
+
+    def test_untyped_responses(self):
+        """
+        Responses without logged types are left out.
+        """
+        midwife = Player()
+        counts = ConfusionCounts(2, 3)
+        midwife.response_log.extend([1, 0, 1])
+        midwife.type_log.extend([2, 0])
+        self.assertEqual(map(list, counts.counts(midwife, 3)), [[1, 0, 0], [0, 0, 1]])
+
+def scan_upto(midwives, roundnum, count):
+    """
+    The Upto measures as they were, rescanning the logs, with count giving
+    (calls, right) for one response and type.
+    """
+    total_calls = 0.
+    total_right = 0.
+    for midwife in midwives:
+        r_log = midwife.response_log[:roundnum]
+        t_log = midwife.type_log[:roundnum]
+        for i in range(len(r_log)):
+            calls, right = count(r_log[i], t_log[i])
+            total_calls += calls
+            total_right += right
+    if total_calls == 0:
+        return 0.
+    return total_right / total_calls
+
+class TestUptoMeasures(unittest.TestCase):
+    def test_against_scan(self):
+        """
+        The Upto measures give what rescanning unbounded logs gave, as the
+        logs grow and for earlier rounds.
+        """
+        random = Random(3)
+        midwives = [Player(player_type=i % 3) for i in range(4)]
+        measures = [
+            (RightCallUpto(), False, lambda r, t: (1, (r == 0) == (t == 0))),
+            (FalsePositiveUpto(), True, lambda r, t: (r == 1, r == 1 and t == 0)),
+            (FalseNegativeUpto(), True, lambda r, t: (r == 0, r == 0 and t != 0)),
+            (TypedFalseNegativeUpto(player_type=2), True, lambda r, t: (t == 2, t == 2 and r == 0))]
+        for roundnum in range(60) + [30, 59, 10]:
+            if len(midwives[0].response_log) <= roundnum:
+                for midwife in midwives:
+                    for i in range(random.randint(1, 3)):
+                        midwife.response_log.append(random.randint(0, 1))
+                        midwife.type_log.append(random.randint(0, 2))
+            for measure, by_round, count in measures:
+                # RightCallUpto counts every response so far
+                upto = roundnum if by_round else max(len(x.response_log) for x in midwives)
+                self.assertEqual(measure.measure(roundnum, midwives, None), scan_upto(midwives, upto, count))
+
+if __name__ == "__main__":
+    unittest.main()
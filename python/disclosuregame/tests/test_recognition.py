@@ -0,0 +1,97 @@
+import unittest
+from random import Random
+from disclosuregame.Agents.bayes import BayesianSignaller
+from disclosuregame.Agents.recognition import MemoryIndex, RecognitionResponder, SignalMemory
+from disclosuregame.Games.game import Game
+
+def scan(memories):
+    """
+    The holders of every ident, found by looking through each memory.
+    """
+    holders = {}
+    for memory in memories:
+        for ident in memory.entries:
+            holders.setdefault(ident, set()).add(memory)
+    return holders
+
+class TestSignalMemory(unittest.TestCase):
+    def test_round_trip(self):
+        memory = SignalMemory(2)
+        memory.remember(7, 2, 1)
+        memory.remember(7, 0, 0)
+        self.assertEqual(memory[7], [(2, 1), (0, 0)])
+        self.assertEqual(memory.pop(7), [(2, 1), (0, 0)])
+        self.assertFalse(7 in memory)
+
+    def test_capacity_forgets_first_seen(self):
+        """
+        The signaller first seen longest ago is forgotten, even if they were
+        seen again since.
+        """
+        memory = SignalMemory(2, capacity=3)
+        for ident in [1, 2, 3, 1]:
+            memory.remember(ident, 0, 1)
+        memory.remember(4, 1, 0)
+        self.assertEqual(sorted(memory.entries), [2, 3, 4])
+        self.assertEqual(len(memory), 3)
+
+class TestMemoryIndex(unittest.TestCase):
+    def test_index_matches_scan(self):
+        """
+        The index agrees with a scan of the memories through remembering,
+        eviction, popping and forgetting.
+        """
+        random = Random(1)
+        index = MemoryIndex()
+        memories = [SignalMemory(2, capacity=random.choice([None, 5])) for i in range(6)]
+        for memory in memories:
+            memory.use_index(index)
+        for step in range(500):
+            memory = random.choice(memories)
+            ident = random.randint(0, 30)
+            action = random.random()
+            if action < 0.7:
+                memory.remember(ident, random.randint(0, 2), random.randint(0, 1))
+            elif action < 0.85:
+                memory.pop(ident)
+            else:
+                index.forget(ident)
+            self.assertEqual(index.holders, scan(memories))
+
+    def test_use_index_registers_existing(self):
+        memory = SignalMemory(2)
+        memory.remember(3, 1, 1)
+        index = MemoryIndex()
+        memory.use_index(index)
+        self.assertEqual(index.holders, {3: set([memory])})
+
+class TestForget(unittest.TestCase):
+    def test_replaced_woman(self):
+        """
+        Once a woman is forgotten and replaced, no midwife or index entry
+        holds her, and her replacement is indexed like anybody else.
+        """
+        game = Game()
+        women = [BayesianSignaller(player_type=i % 3) for i in range(6)]
+        midwives = [RecognitionResponder(player_type=i % 3, memory_capacity=4) for i in range(3)]
+        game.enrol(women + midwives)
+        game.index_memories(midwives)
+        memories = [midwife.signal_memory for midwife in midwives]
+        for midwife in midwives:
+            for woman in women[:4]:
+                midwife.remember(woman, 1, 0)
+        gone = women.pop(0)
+        game.forget(gone)
+        new_woman = BayesianSignaller(player_type=gone.player_type)
+        new_woman.ident = game.new_ident()
+        women.append(new_woman)
+        for midwife in midwives[:2]:
+            midwife.remember(new_woman, 2, 1)
+        for memory in memories:
+            self.assertFalse(hash(gone) in memory)
+        self.assertFalse(hash(gone) in game.memory_index.holders)
+        self.assertEqual(game.memory_index.holders[hash(new_woman)], set(memories[:2]))
+        self.assertEqual(game.memory_index.holders, scan(memories))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import cPickle
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from array import array
+from disclosuregame.results import MISSING, ResultBuffer, SharedResult, shared_directory
+from disclosuregame.run import share_results
+from disclosuregame.Util.spillqueue import SpillQueue
+
+class TestWriteDb(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_name = os.path.join(self.directory, "results")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty_buffer(self):
+        """
+        A game which dumped no rows still writes its parameter set.
+        """
+        results = ResultBuffer(["appointment", "honesty"], {"game": "Game"})
+        results.write_db(self.db_name)
+        conn = sqlite3.connect("%s.db" % self.db_name)
+        self.assertEqual(conn.execute("select count(*) from results").fetchone()[0], 0)
+        self.assertEqual(conn.execute("select count(*) from parameters").fetchone()[0], 1)
+        conn.close()
+
+class TestResultBuffer(unittest.TestCase):
+    def check_rows(self, blocks):
+        results = ResultBuffer(["value"], {"game": "Game"})
+        expected = []
+        for block in blocks:
+            for value in block:
+                results.append([value])
+                expected.append([value])
+            results.flush()
+        self.assertEqual([list(x[:-1]) for x in results.rows()], expected)
+
+    def test_typed_column_then_text(self):
+        """
+        A block which cannot be typed turns a typed column back into a list.
+        """
+        self.check_rows([[1]*256, ["NA"]])
+
+    def test_typed_column_then_mixed(self):
+        self.check_rows([[1]*256, [1, 0.5]])
+
+    def test_int_column_widens(self):
+        self.check_rows([[1]*3, [2**40, 3]])
+
+class TestSharedResult(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def buffer(self, rows=300):
+        """
+        A buffer with int, float, text and "NA" columns, and one left empty.
+        """
+        results = ResultBuffer(["appointment", "honesty", "change", "player", "empty"],
+            {"game": "Game", "rounds": 100})
+        for i in xrange(rows):
+            results.append([i, i / 7., MISSING if i % 3 == 0 else i / 3., "w%d" % (i % 5), None])
+        return results
+
+    def check_same(self, loaded, results):
+        self.assertEqual(list(loaded.rows()), list(results.rows()))
+        for field in ("fields", "param_fields", "param_hash", "parameters", "size"):
+            self.assertEqual(getattr(loaded, field), getattr(results, field))
+        self.assertEqual([type(x) for x in loaded.columns], [type(x) for x in results.columns])
+        self.assertEqual([x.typecode for x in loaded.columns if type(x) is array],
+            [x.typecode for x in results.columns if type(x) is array])
+        self.assertEqual(loaded.field_types(), results.field_types())
+
+    def test_round_trip(self):
+        """
+        A shared buffer, pickled as for a queue, loads as the same buffer and
+        frees its block.
+        """
+        results = self.buffer()
+        self.assertEqual([type(x) for x in results.columns], [array, array, list, list, list])
+        shared = cPickle.loads(cPickle.dumps(results.share(self.directory), -1))
+        self.assertEqual(shared.nbytes, results.nbytes())
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(shared.name)])
+        loaded = shared.load()
+        self.check_same(loaded, results)
+        self.assertEqual(os.listdir(self.directory), [])
+        # The loaded buffer can still grow
+        loaded.append([300, 1., 2., "w0", None])
+        results.append([300, 1., 2., "w0", None])
+        self.check_same(loaded, results)
+
+    def test_pending(self):
+        """
+        Staged rows are shared too.
+        """
+        results = self.buffer(10)
+        self.assertEqual(len(results.pending), 10)
+        self.check_same(results.share(self.directory).load(), results)
+
+    def test_untyped(self):
+        """
+        A buffer with no rows or no typed columns needs no block.
+        """
+        text = ResultBuffer(["player"], {"game": "Game"})
+        text.append(["w0"])
+        for results in (self.buffer(0), text):
+            shared = results.share(self.directory)
+            self.assertEqual(shared.name, None)
+            self.check_same(shared.load(), results)
+
+    def test_release(self):
+        """
+        A block left in the default directory is removed by release.
+        """
+        shared = self.buffer().share()
+        name = shared.name
+        self.assertEqual(os.path.dirname(name), shared_directory())
+        self.assertTrue(os.path.exists(name))
+        shared.release()
+        self.assertFalse(os.path.exists(name))
+        shared.release()
+
+    def test_share_results(self):
+        """
+        Results are shared if the queue has room for their blocks, which is
+        given back when they are loaded, and are passed as they are if not.
+        """
+        queue = SpillQueue(limit=1 << 20, directory=self.directory)
+        res = (self.buffer(), self.buffer(20))
+        size = sum(x.nbytes() for x in res)
+        shared = share_results(res, queue, self.directory)
+        self.assertEqual(map(type, shared), [SharedResult]*2)
+        self.assertEqual(queue.held.value, size)
+        for loaded, results in zip([x.load() for x in shared], res):
+            self.check_same(loaded, results)
+        queue.release(size)
+        self.assertEqual(queue.held.value, 0)
+        self.assertTrue(queue.reserve(queue.limit))
+        self.assertTrue(share_results(res, queue, self.directory) is res)
+        queue.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+if __name__ == "__main__":
+    unittest.main()
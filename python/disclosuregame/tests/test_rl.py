@@ -0,0 +1,55 @@
+import unittest
+from itertools import count
+from disclosuregame.Agents.bayes import Agent
+from disclosuregame.Agents.rl import RWResponder, RWSignaller
+from disclosuregame.Games.carrying import CarryingGame
+
+class TestWarmUp(unittest.TestCase):
+    def setUp(self):
+        # Start process-wide idents from 0, so that the warm-up's stand-in
+        # midwives get idents the game will hand out
+        self.id_generator = Agent.id_generator
+        Agent.id_generator = count()
+
+    def tearDown(self):
+        Agent.id_generator = self.id_generator
+
+    def test_no_midwife_remembered_after_enrol(self):
+        """
+        Women warmed up on stand-in midwives have met none of the game's
+        midwives once everybody is enrolled.
+        """
+        game = CarryingGame(seed=1)
+        women = [RWSignaller(player_type=i % 3, seed=i) for i in range(20)]
+        for woman in women:
+            woman.init_payoffs(game.woman_baby_payoff, game.woman_social_payoff)
+        midwives = [RWResponder(player_type=i % 3, seed=i) for i in range(5)]
+        game.enrol(women + midwives)
+        for woman in women:
+            self.assertEqual(len(woman.v_mw), 0)
+            for midwife in midwives:
+                self.assertFalse(hash(midwife) in woman.v_mw)
+                woman.risk(0, midwife)
+                self.assertFalse(woman.observed_type)
+
+class TestMidwifeWeights(unittest.TestCase):
+    def test_unbounded_by_default(self):
+        """
+        A woman keeps her weights for every midwife she has met.
+        """
+        woman = RWSignaller(seed=1)
+        for ident in range(250):
+            woman.v_mw.learn(ident, 0.5)
+        self.assertEqual(len(woman.v_mw), 250)
+        self.assertEqual(woman.v_mw[0], 0.5)
+
+    def test_capacity(self):
+        woman = RWSignaller(seed=1, mw_capacity=3)
+        for ident in [0, 1, 2, 0, 3]:
+            woman.v_mw.learn(ident, 0.5)
+        # 1 was the least recently met
+        self.assertEqual(woman.v_mw.keys(), [2, 0, 3])
+        self.assertEqual(woman.v_mw[0], 1.)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from random import Random
+from disclosuregame.Util import sampling
+
+class TestBatchDraws(unittest.TestCase):
+    weights = [[3, 1, 6], [1, 1, 1], [0, 2, 5]]
+
+    def setUp(self):
+        self.compatible = sampling.compatible
+        self.numpy_on = sampling.numpy_on
+
+    def tearDown(self):
+        sampling.compatible = self.compatible
+        sampling.numpy_on = self.numpy_on
+        sampling._tables.clear()
+
+    def modes(self):
+        for compatible in (True, False):
+            for numpy_on in set([False, self.numpy_on]):
+                sampling.compatible = compatible
+                sampling.numpy_on = numpy_on
+                sampling._tables.clear()
+                yield
+
+    def test_weighted_random_choices(self):
+        """
+        Many draws at once match as many single draws from the same stream.
+        """
+        for mode in self.modes():
+            random = Random(1)
+            single = [sampling.weighted_random_choice("abc", self.weights[0], random) for x in range(500)]
+            self.assertEqual(sampling.weighted_random_choices("abc", self.weights[0], 500, Random(1)), single)
+
+    def test_interleaved_draws(self):
+        """
+        A choice, a keyed weighted choice and a weighted choice per encounter
+        match draws made one encounter at a time.
+        """
+        for mode in self.modes():
+            random = Random(2)
+            expected = []
+            for i in range(300):
+                signal = random.choice([0, 1, 2])
+                response = sampling.weighted_random_choice([0, 1, 2], self.weights[signal], random)
+                player_type = sampling.weighted_random_choice([0, 1, 2], self.weights[1], random)
+                expected.append((signal, response, player_type))
+            us = sampling.uniforms(Random(2), 900)
+            signals = sampling.choose([0, 1, 2], us[0::3])
+            responses = sampling.keyed_weighted_choose([0, 1, 2], self.weights, signals, us[1::3])
+            player_types = sampling.weighted_choose([0, 1, 2], self.weights[1], us[2::3])
+            self.assertEqual(zip(signals, responses, player_types), expected)
+
+    def test_no_positive_weights(self):
+        for mode in self.modes():
+            self.assertRaises(IndexError, sampling.weighted_random_choices, "ab", [0, 0], 3, Random(1))
+
+    def test_shifted_choice_not_cached(self):
+        sampling.compatible = False
+        sampling._tables.clear()
+        random = Random(1)
+        for i in range(100):
+            sampling.shifted_choice("abc", [random.random() - 0.5 for x in range(3)], random)
+        self.assertEqual(len(sampling._tables), 0)
+
+if __name__ == "__main__":
+    unittest.main()
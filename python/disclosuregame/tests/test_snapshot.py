@@ -0,0 +1,27 @@
+import cPickle
+import unittest
+from copy import deepcopy
+from disclosuregame.Games.carrying import CarryingGame
+from disclosuregame.Util.priors import PriorPool
+
+class TestGameSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.game = CarryingGame(seed=1)
+        self.game.prior_pool = PriorPool(self.game.player_random)
+
+    def check_shared(self, game):
+        self.assertTrue(game.prior_pool.random is game.player_random)
+        self.assertEqual(game.prior_pool.draw(), self.game.prior_pool.draw())
+        self.assertEqual(game.player_random.random(), self.game.player_random.random())
+
+    def test_deepcopy_keeps_prior_pool_stream(self):
+        """
+        The prior pool draws from the copy's player_random, not a copy of it.
+        """
+        self.check_shared(deepcopy(self.game))
+
+    def test_pickle_keeps_prior_pool_stream(self):
+        self.check_shared(cPickle.loads(cPickle.dumps(self.game, -1)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import cPickle
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from disclosuregame.Util.spillqueue import SpillQueue
+
+def produce(queue, producer, num):
+    for i in xrange(num):
+        queue.put((producer, i, "x"*(i % 7)*100))
+
+class TestSpillQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def size(self, item):
+        return len(cPickle.dumps(item, -1))
+
+    def spilled(self, queue):
+        return os.listdir(queue.directory)
+
+    def test_order(self):
+        """
+        Items come out in the order they were put, whether they were held in
+        memory or spilled, and nothing is held or left on disk once they are.
+        """
+        items = [range(i % 5 * 50) for i in xrange(40)]
+        queue = SpillQueue(limit=3*self.size(items[4]), directory=self.directory)
+        for item in items[:20]:
+            queue.put(item)
+        got = [queue.get() for i in xrange(10)]
+        for item in items[20:]:
+            queue.put(item)
+        queue.put(None)
+        got += iter(queue.get, None)
+        self.assertEqual(got, items)
+        self.assertTrue(0 < queue.spilled.value < len(items))
+        self.assertEqual(queue.held.value, 0)
+        self.assertEqual(self.spilled(queue), [])
+        queue.close()
+        self.assertFalse(os.path.exists(queue.directory))
+
+    def test_large_item(self):
+        """
+        One item larger than the limit is held in memory if nothing else is.
+        """
+        queue = SpillQueue(limit=10, directory=self.directory)
+        queue.put("x"*100)
+        queue.put("y")
+        self.assertEqual(queue.spilled.value, 1)
+        self.assertEqual([queue.get(), queue.get()], ["x"*100, "y"])
+        self.assertEqual(queue.held.value, 0)
+        queue.close()
+
+    def test_reserve(self):
+        """
+        Reserved bytes count towards the limit until they are released.
+        """
+        queue = SpillQueue(limit=1000, directory=self.directory)
+        self.assertTrue(queue.reserve(600))
+        self.assertFalse(queue.reserve(600))
+        queue.put("x"*500)
+        self.assertEqual(queue.spilled.value, 1)
+        self.assertTrue(queue.reserve(400))
+        self.assertEqual(queue.held.value, 1000)
+        self.assertEqual(queue.get(), "x"*500)
+        queue.release(600)
+        queue.release(400)
+        self.assertEqual(queue.held.value, 0)
+        self.assertEqual(queue.peak.value, 1000)
+        queue.put("y")
+        self.assertEqual(queue.spilled.value, 1)
+        self.assertEqual(queue.get(), "y")
+        self.assertEqual(queue.held.value, 0)
+        queue.close()
+
+    def test_producers(self):
+        """
+        Each producer's items come out in the order it put them.
+        """
+        queue = SpillQueue(limit=2000, directory=self.directory)
+        producers = [multiprocessing.Process(target=produce, args=(queue, i, 100)) for i in range(3)]
+        for p in producers:
+            p.start()
+        got = [queue.get() for i in xrange(300)]
+        for p in producers:
+            p.join()
+        for i in range(3):
+            self.assertEqual([x[1] for x in got if x[0] == i], range(100))
+        self.assertEqual(queue.held.value, 0)
+        self.assertEqual(self.spilled(queue), [])
+        queue.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from disclosuregame.results import ResultBuffer
+from disclosuregame.run import consolidate, shard_names
+from disclosuregame.Util.sqlite_merge import merge_db, merge_dbs
+
+def write(db_name, game, values):
+    results = ResultBuffer(["appointment", "honesty"], {"game": game})
+    for i, value in enumerate(values):
+        results.append([i, value])
+    results.write_db(db_name)
+
+def query(db, sql):
+    conn = sqlite3.connect(db)
+    rows = conn.execute(sql).fetchall()
+    conn.close()
+    return rows
+
+class MergeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.expected = {}
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, game, values):
+        """
+        Write a db of results, and note the rows a merge should end up with.
+        """
+        write(self.path(name), game, values)
+        self.expected.setdefault(game, []).extend(enumerate(values))
+        return "%s.db" % self.path(name)
+
+    def check(self, db):
+        """
+        Ids are unique, each parameter set has one row, and every result points
+        at the row for its own parameters.
+        """
+        ids = [x[0] for x in query(db, "select id from results")]
+        self.assertEqual(len(ids), len(set(ids)))
+        params = query(db, "select game, count(*) from parameters group by game")
+        self.assertEqual(sorted(params), [(game, 1) for game in sorted(self.expected)])
+        counts = query(db, "select param_id, count(*) from results group by param_id")
+        param_ids = dict(query(db, "select game, param_id from parameters"))
+        self.assertEqual(sorted(counts),
+            sorted((param_ids[game], len(rows)) for game, rows in self.expected.items()))
+        for game, rows in self.expected.items():
+            merged = query(db, "select appointment, honesty from results natural join parameters "
+                "where game = '%s'" % game)
+            self.assertEqual(sorted(merged), sorted(rows))
+
+class TestMergeDb(MergeTestCase):
+    def test_merge_db(self):
+        target = self.write("a", "Game", [0.5, 0.25])
+        source = self.write("b", "CarryingGame", [1.])
+        self.assertEqual(merge_db(target, source), 1)
+        self.check(target)
+
+    def test_shared_parameters(self):
+        """
+        A parameter set both dbs hold is not added twice.
+        """
+        target = self.write("a", "Game", [0.5, 0.25])
+        source = self.write("b", "Game", [1., 0.75, 0.])
+        self.assertEqual(merge_db(target, source), 3)
+        self.check(target)
+
+class TestMergeDbs(MergeTestCase):
+    def sources(self):
+        return [self.write("a", "Game", [0.5, 0.25]), self.write("b", "CarryingGame", [1.]),
+            self.write("c", "Game", [0.75]), self.write("d", "CaseloadGame", [0., 0.125, 1.]),
+            self.write("e", "CarryingGame", [0.5])]
+
+    def test_into_first(self):
+        sources = self.sources()
+        merge_dbs(sources, processes=1)
+        self.check(sources[0])
+
+    def test_processes(self):
+        """
+        Sources split between processes are merged into the target.
+        """
+        target = self.path("target.db")
+        merge_dbs(self.sources(), target, processes=2)
+        self.check(target)
+        self.assertFalse([x for x in os.listdir(self.directory) if x.startswith("merge_")])
+
+    def test_existing_target(self):
+        """
+        An existing target is merged into, and keeps its results.
+        """
+        target = self.write("target", "ReferralGame", [0.5, 1.])
+        merge_dbs(self.sources(), target, processes=2)
+        self.check(target)
+
+    def test_indexes(self):
+        sources = self.sources()
+        wanted = query(sources[0], "select name from sqlite_master where type = 'index' and sql is not null")
+        target = self.path("target.db")
+        merge_dbs(sources, target, processes=2)
+        self.assertEqual(sorted(query(target, "select name from sqlite_master where type = 'index' and sql is not null")),
+            sorted(wanted))
+
+class TestConsolidate(MergeTestCase):
+    def test_consolidate(self):
+        """
+        Each kind of shard db is merged into its own db, and the shards are
+        removed. A shard which wrote nothing is skipped.
+        """
+        db_name = self.path("experiment")
+        shards = shard_names(db_name, 3)
+        for shard, game in zip(shards, ["Game", "CarryingGame"]):
+            self.write("%s_women" % os.path.basename(shard), game, [0.5, 0.25])
+        women = self.expected
+        self.expected = {}
+        for shard in shards[1:]:
+            self.write("%s_mw" % os.path.basename(shard), "Game", [1.])
+        consolidate(db_name, shards)
+        self.check("%s_mw.db" % db_name)
+        self.expected = women
+        self.check("%s_women.db" % db_name)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["experiment_mw.db", "experiment_women.db"])
+
+    def test_existing(self):
+        """
+        Results already in the experiment's db are kept.
+        """
+        db_name = self.path("experiment")
+        self.write("experiment_women", "ReferralGame", [0.5])
+        for shard in shard_names(db_name, 2):
+            self.write("%s_women" % os.path.basename(shard), "Game", [0.75])
+        consolidate(db_name, shard_names(db_name, 2))
+        self.check("%s_women.db" % db_name)
+
+if __name__ == "__main__":
+    unittest.main()
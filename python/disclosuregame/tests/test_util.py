@@ -0,0 +1,54 @@
+import cPickle
+import unittest
+from copy import deepcopy
+from disclosuregame.Util import BoundedLog, TrimmedError, log_entry, new_log, pack_value, unpack_value
+
+class TestBoundedLog(unittest.TestCase):
+    def check_bounded(self, log, total):
+        self.assertTrue(len(log) < 2*log.window)
+        self.assertEqual(log.trimmed + len(log), total)
+        self.assertEqual(log_entry(log, total - 1), (total - 1) % 100)
+
+    def test_append(self):
+        log = new_log('b', 4)
+        for i in range(10):
+            log.append(i)
+        self.check_bounded(log, 10)
+
+    def test_extend(self):
+        log = new_log('b', 4)
+        log.extend(range(10))
+        self.check_bounded(log, 10)
+        log += range(10, 20)
+        self.assertTrue(type(log) is BoundedLog)
+        self.check_bounded(log, 20)
+        log.fromlist(range(20, 30))
+        self.check_bounded(log, 30)
+
+    def test_insert(self):
+        log = new_log('b', 4)
+        for i in range(10):
+            log.insert(len(log), i)
+        self.check_bounded(log, 10)
+
+    def test_trimmed_entries(self):
+        """
+        Entries are found by their place in the whole history, and discarded
+        ones raise rather than giving a later entry.
+        """
+        log = new_log('b', 4)
+        log.extend(range(10))
+        self.assertRaises(TrimmedError, log_entry, log, 0)
+        self.assertEqual(log_entry(log, log.trimmed), log.trimmed)
+        self.assertRaises(IndexError, log_entry, log, 10)
+        self.assertEqual(log_entry(range(3), 2), 2)
+
+    def test_copies_keep_trimmed(self):
+        log = new_log('b', 4)
+        log.extend(range(10))
+        for copy in (deepcopy(log), cPickle.loads(cPickle.dumps(log, -1)), unpack_value(pack_value(log))):
+            self.assertEqual(list(copy), list(log))
+            self.assertEqual((copy.window, copy.trimmed), (log.window, log.trimmed))
+
+if __name__ == "__main__":
+    unittest.main()